@@ -0,0 +1 @@
+""" Benchmark suite of the simulator (run with python -m bench, see README.md). """
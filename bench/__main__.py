@@ -0,0 +1,147 @@
+# Command-line interface of the benchmark suite:
+#
+#   python -m bench                     run all cases and compare them with bench/baseline.json
+#   python -m bench --case execute      run some cases only
+#   python -m bench --save              store the results as the new baseline
+#
+# Every case runs in a fresh process, so that its peak memory is its own.
+# The exit status is 1 if any metric regressed by more than the tolerance,
+# or if any count differs from the baseline (see cases.py).
+
+import numpy as np
+
+import os
+import sys
+import json
+import platform
+import argparse
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from . import cases
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# Relative change of a throughput, time or memory metric that counts as a regression
+TOLERANCE = 0.25
+
+def environment() -> dict:
+    """ Interpreter, library versions and machine the results were measured on. """
+    try:
+        import scipy
+        scipy_version = scipy.__version__
+    except ImportError:
+        scipy_version = None
+
+    return {'python' : platform.python_version(), 'numpy' : np.__version__, 'scipy' : scipy_version,
+            'platform' : platform.platform(), 'machine' : platform.machine(), 'cpus' : os.cpu_count()}
+
+def run(names) -> dict:
+    """ Runs the given cases, each in its own process. Returns a dictionary: case -> metrics. """
+    results = {}
+
+    for name in names:
+        print(f'Running {name}...', flush=True)
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results[name] = executor.submit(cases.run_case, name).result()
+
+    return results
+
+def compare(metric, value, reference, tolerance=TOLERANCE) -> str:
+    """ 'ok', 'faster', 'slower' (regression) or 'changed' (count differs) - see the metric names in cases.py. """
+    if metric.endswith('_per_sec'):
+        change = value / reference - 1.0
+    elif metric.endswith('_seconds') or metric.endswith('_mb'):
+        change = reference / value - 1.0
+    else:
+        return 'ok' if value == reference else 'changed'
+
+    if change < -tolerance:
+        return 'slower'
+
+    return 'faster' if change > tolerance else 'ok'
+
+def report(results, baseline, tolerance=TOLERANCE) -> bool:
+    """ Prints all metrics next to the baseline. Returns False if any metric regressed or changed. """
+    passed = True
+
+    print(f'\n{"case":<10}{"metric":<28}{"value":>14}{"baseline":>14}{"ratio":>9}  status')
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            reference = baseline.get(name, {}).get(metric)
+
+            if reference is None:
+                print(f'{name:<10}{metric:<28}{value:>14.6g}{"-":>14}{"-":>9}  new')
+                continue
+
+            status = compare(metric, value, reference, tolerance)
+            passed = passed and status not in ['slower', 'changed']
+
+            print(f'{name:<10}{metric:<28}{value:>14.6g}{reference:>14.6g}{value / reference if reference else np.nan:>9.3f}  {status}')
+
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbe Metabolism Simulator - benchmark suite')
+
+    parser.add_argument('--case', help=f"Case to run (repeatable): {', '.join(cases.CASES)}. Default: all cases.",
+                        action='append', choices=list(cases.CASES), default=None)
+
+    parser.add_argument('--baseline', help="Baseline file to compare with (or to write, with --save).",
+                        default=BASELINE, type=str)
+
+    parser.add_argument('--tolerance', help="Relative change of a throughput, time or memory metric that counts as a regression.",
+                        default=TOLERANCE, type=float)
+
+    parser.add_argument('--save', help="Store the results as the new baseline instead of comparing.",
+                        action='store_true')
+
+    parser.add_argument('--output', help="Also write the results to this JSON file.",
+                        default=None, type=str)
+
+    args = parser.parse_args()
+
+    results = run(args.case or list(cases.CASES))
+    measured = {'environment' : environment(), 'cases' : results}
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(measured, f, indent=1)
+            f.write('\n')
+
+    if args.save:
+        if args.case and os.path.exists(args.baseline):
+            # keep the stored results of the cases that were not run
+            with open(args.baseline) as f:
+                stored = json.load(f)
+            measured['cases'] = {**stored['cases'], **results}
+
+        with open(args.baseline, 'w') as f:
+            json.dump(measured, f, indent=1)
+            f.write('\n')
+
+        report(results, {}, args.tolerance)
+        print(f'\nBaseline written to {args.baseline}.')
+        return
+
+    if not os.path.exists(args.baseline):
+        report(results, {}, args.tolerance)
+        print(f'\nNo baseline found at {args.baseline} (see --save).')
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    passed = report(results, baseline['cases'], args.tolerance)
+
+    if baseline.get('environment') != measured['environment']:
+        print(f'\nNote: the baseline was measured in another environment: {baseline.get("environment")}')
+
+    if not passed:
+        print(f'\nRegression: some metrics are more than {args.tolerance:.0%} worse than, or differ from, the baseline.')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
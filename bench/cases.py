@@ -0,0 +1,270 @@
+# Benchmark cases: kernels, a full simulation, a stiff simulation, network building, output and startup.
+#
+# Every case is a function that returns a dictionary of metrics. Metric
+# names say how they compare against a baseline (see compare in __main__.py):
+#
+#   *_per_sec           throughput - higher is better
+#   *_seconds, *_mb     time and memory - lower is better
+#   anything else       counts (iterations, evaluations, rows, ...) that
+#                       must match the baseline exactly - a change means
+#                       that the numerics changed, not just the speed
+#
+# All random inputs are drawn from fixed seeds, and nothing is written
+# outside of temporary directories.
+
+import numpy as np
+
+import os
+import sys
+import timeit
+import tempfile
+import subprocess
+from types import SimpleNamespace
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows - peak memory is not reported there
+    resource = None
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import sim
+import main as cli
+
+from sim.model import ode_model, RateKernel, GibbsKernel
+from sim.integrate import calculate_gibbs
+from sim.solvers import calculate_flux
+
+# Network of cariaco.txt
+CARIACO = ['asos', 'oxH2SrNO3', 'oxH2SrNO2', 'amoA', 'nxr', 'anammox']
+
+# Master seed of all simulations and synthetic libraries
+SEED = 1
+
+# Default timestep of main.py
+TIMESTEP = 5.0
+
+# Size of the synthetic library (reactions, metabolites)
+LIBRARY_REACTIONS = 5000
+LIBRARY_METABOLITES = 500
+
+# Timed repetitions of every measurement (the fastest one counts)
+REPEAT = 5
+
+def best_time(function, repeat=REPEAT) -> float:
+    """ Shortest wall time (seconds) of repeat calls of function. """
+    times = []
+
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    return min(times)
+
+def calls_per_sec(function, repeat=REPEAT) -> float:
+    """ Calls of function per second (best of repeat loops of at least 0.2 seconds each). """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(repeat, number))
+
+def peak_memory() -> float:
+    """ Peak resident memory of this process (MB), or None if unknown. """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+def cariaco():
+    """ The network of cariaco.txt (built without the disk cache). """
+    sim.setup.CACHE_DIRECTORY = ''
+    return sim.setup.make_network(CARIACO)
+
+def simulate(network, record=None):
+    """ One simulation of network with the fixed seed of run 1, as main.py runs it. """
+    return sim.execute(network.initialC, network.deltaGf0, network.stoich_mats, network.ou_parameters,
+                       default_timestep=TIMESTEP, random_seed=sim.sweep.run_seed(SEED, 1), record=record)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+# CASES
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+def kernels() -> dict:
+    """ Right-hand side (reference and compiled), Gibbs energies (reference and compiled) and one RKF45 step on the Cariaco network. """
+    network = cariaco()
+    S_mats = [sim.sparse.dense(S) for S in network.stoich_mats]
+
+    C = network.initialC.copy()
+    G = calculate_gibbs(C, S_mats[0], network.deltaGf0, sim.config.general.TEMPERATURE)
+    # rates in the middle of the typical rate ranges
+    X = network.ou_parameters[0].mean(axis=1)
+
+    rate_kernel = RateKernel(S_mats)
+    gibbs = GibbsKernel(S_mats, network.deltaGf0, sim.config.general.TEMPERATURE)
+    gibbs.start(C)
+
+    f = lambda t, C : rate_kernel(t, C, G, X)
+
+    return {'ode_model_per_sec' : calls_per_sec(lambda : ode_model(0.0, C, S_mats, G, X)),
+            'rate_kernel_per_sec' : calls_per_sec(lambda : rate_kernel(0.0, C, G, X)),
+            'calculate_gibbs_per_sec' : calls_per_sec(lambda : calculate_gibbs(C, S_mats[0], network.deltaGf0, sim.config.general.TEMPERATURE)),
+            'gibbs_kernel_per_sec' : calls_per_sec(lambda : gibbs(C)),
+            'calculate_flux_per_sec' : calls_per_sec(lambda : calculate_flux(0.0, 0.01, C, f))}
+
+def execute() -> dict:
+    """ Full simulation of the Cariaco network (run 1 of seed 1, end state only). """
+    network = cariaco()
+    runs = []
+
+    for _ in range(3):
+        sol, success = simulate(network, record='end')
+        runs.append(sol['stats'])
+
+    stats = min(runs, key=lambda record : record['wall_time'])
+
+    return {'steps_per_sec' : stats['accepted'] / stats['wall_time'],
+            'rhs_evaluations_per_sec' : stats['rhs_evaluations'] / stats['wall_time'],
+            'execute_seconds' : stats['wall_time'],
+            'iterations' : stats['iterations'],
+            'accepted' : stats['accepted'],
+            'rhs_evaluations' : stats['rhs_evaluations']}
+
+def stiff() -> dict:
+    """
+    Rosenbrock solver with the tolerance controller on a stiff Cariaco run (run 3 of seed 7 in
+    a sweep of O2 over 50-150 uM, i.e. O2 = 150 uM). rejected_permille pins the share of rejected steps.
+    """
+    network = cariaco()
+    initialC = network.initialC.copy()
+    initialC[list(network.metabolites).index('O2')] = 150.0
+
+    sol, success = sim.execute(initialC, network.deltaGf0, network.stoich_mats, network.ou_parameters,
+                               default_timestep=TIMESTEP, random_seed=sim.sweep.run_seed(7, 3), record='end',
+                               solver='rosenbrock', atol=sim.control.tolerance_vector(network.metabolites))
+    stats = sol['stats']
+
+    return {'stiff_steps_per_sec' : stats['accepted'] / stats['wall_time'],
+            'iterations' : stats['iterations'],
+            'accepted' : stats['accepted'],
+            'rejected' : stats['rejected'],
+            'rejected_permille' : round(1000 * stats['rejected'] / stats['iterations'])}
+
+def synthetic_library(directory, N, M, rng) -> tuple:
+    """
+    Writes a random library of N reactions between M metabolites to directory
+    (stoichiometry.txt, as in sim/config) and returns the matching
+    (reaction library, metabolite library) in the form of sim/config.
+    """
+    metabolites = np.array([f'X{j}' for j in range(M)])
+    reactions = np.array([f'r{i}' for i in range(N)])
+
+    with open(os.path.join(directory, 'stoichiometry.txt'), 'w') as f:
+        f.write('# synthetic library (see bench/cases.py)\n')
+
+        for rxn in reactions:
+            species = rng.choice(M, size=rng.integers(3, 7), replace=False)
+            reactants = rng.integers(1, len(species) - 1)
+
+            terms = []
+            for j in species:
+                coeff = f'[{rng.uniform(0.1, 4.0):.3f}]' if rng.uniform() < 0.7 else ''
+                flags = rng.choice(['', '', '', '[NL]', '[C]', '[NL|C]'])
+                terms.append(f'{coeff}{metabolites[j]}{flags}')
+
+            f.write(f'{rxn} : {", ".join(terms[:reactants])} -> {", ".join(terms[reactants:])}\n')
+
+    # the network cache is keyed by all library files
+    for fname in ['reactions.py', 'metabolites.py']:
+        with open(os.path.join(directory, fname), 'w') as f:
+            f.write(f'# synthetic library of {N} reactions and {M} metabolites (see bench/cases.py)\n')
+
+    # (min, max) ranges, as in sim/config/reactions.py
+    ranges = lambda low, high : np.sort(rng.uniform(low, high, size=(N, 2)), axis=1)
+
+    reaction_library = SimpleNamespace(reactions=reactions,
+                                       typical_rates=ranges(0.1, 50.0),
+                                       typical_decay=ranges(0.1, 20.0),
+                                       typical_std=ranges(0.1, 1.0))
+
+    metabolite_library = SimpleNamespace(metabolites=metabolites,
+                                         initialC=rng.uniform(1.0, 1000.0, size=M),
+                                         deltaGf0=rng.uniform(-500.0, 0.0, size=M))
+
+    return reaction_library, metabolite_library
+
+def network() -> dict:
+    """ Parsing and building (compiled and cached) networks of a large synthetic library. """
+    rng = np.random.default_rng(SEED)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sim.setup.reaction_library, sim.setup.metabolite_library = synthetic_library(directory, LIBRARY_REACTIONS, LIBRARY_METABOLITES, rng)
+        sim.setup.CONFIG_DIRECTORY = directory
+
+        fname = os.path.join(directory, 'stoichiometry.txt')
+        names = [str(rxn) for rxn in sim.setup.reaction_library.reactions]
+        subset = set(names[::10])
+
+        metrics = {'parse_seconds' : best_time(lambda : sim.parser.parse_file(fname)),
+                   'parse_subset_seconds' : best_time(lambda : sim.parser.parse_file(fname, only=subset))}
+
+        sim.setup.CACHE_DIRECTORY = ''
+        metrics['build_seconds'] = best_time(lambda : sim.setup.build_network(names), repeat=3)
+
+        sim.setup.CACHE_DIRECTORY = os.path.join(directory, 'cache')
+        sim.setup.build_network(names)
+        metrics['cached_build_seconds'] = best_time(lambda : sim.setup.build_network(names))
+
+        built = sim.setup.make_network(names)
+        metrics['reactions'] = len(built.reactions)
+        metrics['metabolites'] = len(built.metabolites)
+        metrics['nonzeros'] = int(sum([len(values) for rows, columns, values in map(sim.sparse.triplets, built.stoich_mats)]))
+
+    return metrics
+
+def output() -> dict:
+    """ Debug output of main.py (tsv and binary columnar) for the full trajectory of the Cariaco simulation. """
+    network = cariaco()
+    sol, success = simulate(network)
+    rows = len(sol['time'])
+
+    # dead_ends.tsv of an incremental sweep of 1000 runs (see main.write_dead_ends)
+    entries = [sim.manifest.make_entry(run, sim.sweep.run_seed(SEED, run), 'bench', {}, {}, True, sol['composition'][-1])
+               for run in range(1, 1001)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        write = lambda file_format : cli.write_debug(directory, 1, sol, success, network.metabolites, network.reactions, file_format=file_format)
+
+        metrics = {'write_tsv_seconds' : best_time(lambda : write('tsv')),
+                   'write_npy_seconds' : best_time(lambda : write('npy')),
+                   'write_dead_ends_seconds' : best_time(lambda : cli.write_dead_ends(directory, entries, network.metabolites))}
+
+    metrics['rows'] = rows
+    metrics['write_tsv_rows_per_sec'] = rows / metrics['write_tsv_seconds']
+
+    return metrics
+
+def startup() -> dict:
+    """ Time to import the sim package, and to start main.py (--help) in a fresh interpreter. """
+    run = lambda arguments : subprocess.run([sys.executable] + arguments, cwd=REPOSITORY, check=True,
+                                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return {'import_seconds' : best_time(lambda : run(['-c', 'import sim'])),
+            'cli_startup_seconds' : best_time(lambda : run(['main.py', '--help']))}
+
+# Cases in the order they are run
+CASES = {'kernels' : kernels, 'execute' : execute, 'stiff' : stiff, 'network' : network, 'output' : output, 'startup' : startup}
+
+def run_case(name) -> dict:
+    """ Runs one case (in a fresh process, see __main__.py) and adds the peak memory of that process. """
+    metrics = CASES[name]()
+
+    peak = peak_memory()
+    if peak is not None:
+        metrics['peak_memory_mb'] = peak
+
+    return metrics
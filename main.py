@@ -9,191 +9,656 @@ import numpy as np
 import sys
 import os, shutil
 import csv
+import json
+import contextlib
 
 import argparse
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-# I. READ COMMAND-LINE ARGUMENTS
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-
-parser = argparse.ArgumentParser(description='Microbe Metabolism Simulator')
-
-parser.add_argument('-r', '--runs', help='Set number of simulation runs.',
-                    const=50, default=50, nargs='?', type=int)
-
-parser.add_argument('-o', '--out', help='Specify target output directory.',
-                    const='data', default='data', nargs='?', type=str)
-
-parser.add_argument('-t', '--timestep', help="Default timestep for ODE solver.",
-                    const=5.0, default=5.0, nargs='?', type=float)
-
-parser.add_argument('-d', '--debug', help="Indicates whether to log all sim data (True) or just end states (False).",
-                    const=True, default=False, nargs='?', type=bool)
-
-parser.add_argument('-s', '--seed', help="Input random seed for Ornstein-Uhlenbeck Process.",
-                    const=None, default=None, nargs='?', type=int)
-
-args = parser.parse_args()
-
-RUNS = args.runs
-OUT = args.out
-TIMESTEP = args.timestep
-DEBUG = args.debug
-SEED = args.seed
-
-if sys.stdin is None:
-    sys.stderr.write("Cannot execute program without input file.")
-    sys.stderr.flush()
-    sys.exit(1)
-
-FILE = sys.stdin
-
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-# II. READ SIMULATION PARAMETERS from SETUP.py
-# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-
-reaction_list = FILE.readline().strip().split(' ')
- 
-[
-    metabolites,
-    reactions,
-    deltaGf0,
-    initialC,
-    stoich_mats,
-    ou_parameters
-] = sim.setup.build_network(reaction_list)
-
-stoich_mat_full, stoich_mat_lim, stoich_mat_nconst = stoich_mats
-
-# - - - - - - - - - - - - - - - - - - - //
-# III. BUILD OUTPUT DIRECTORY 
-# - - - - - - - - - - - - - - - - - - - //
-
-if os.path.exists(OUT):
-    print("""\nWarning: specified output directory already exists.\nOutput directory will be overwritten.""")
-    shutil.rmtree(OUT)
-
-os.makedirs(OUT)
-
-with open(f'{OUT}/dead_ends.tsv', 'a+') as dead_end_file:
-    # log all reactions and metabolites
-    with open(f'{OUT}/network_desc.txt', 'w') as names:
-        names.write(f'metabolites ({len(metabolites)}): {metabolites}\n')
-        names.write(f'reactions ({len(reactions)}): {reactions}\n')
-
-    # write all stoichiometric matrices to txt files
-    np.savetxt(f'{OUT}/stoich_mat_full.txt', stoich_mat_full)
-    np.savetxt(f'{OUT}/stoich_mat_lim.txt', stoich_mat_lim)
-    np.savetxt(f'{OUT}/stoich_mat_nconst.txt', stoich_mat_nconst)
-
-    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-    # IV. DETERMINE WHETHER TO VARY METABOLITE CONCENTRATIONS
-    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-
-    VARY_METABOLITE = False 
-    
-    answer = FILE.readline().strip()
-    if answer.lower() in ['yes', 'y', 'sure']:
-        var_met_name = FILE.readline().strip()
-
-        try:
-            assert var_met_name in metabolites
-        except AssertionError:
-            sys.stderr.write("Invalid choice: {var_met_name} not found.")
-            sys.stderr.flush()
-            sys.exit(1)
-
-        try:
-            input_range = FILE.readline().strip()
-            assert input_range[0] == '(' and input_range[-1] == ')'
-            float_tuple = input_range[1:-1].split(',')
 
-            try:
-                float_tuple = tuple([float(i) for i in float_tuple])
-            except:
-                raise AssertionError
-                
-                assert len(float_tuple) == 2
-                assert float_tuple[0] > 0 and float_tuple[1] > 0
-                assert float_tuple[1] > float_tuple[0]
+def parse_arguments():
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    # I. READ COMMAND-LINE ARGUMENTS
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+    parser = argparse.ArgumentParser(description='Microbe Metabolism Simulator')
+
+    parser.add_argument('-r', '--runs', help='Set number of simulation runs.',
+                        const=50, default=50, nargs='?', type=int)
+
+    parser.add_argument('-o', '--out', help='Specify target output directory.',
+                        const='data', default='data', nargs='?', type=str)
+
+    parser.add_argument('-t', '--timestep', help="Default timestep for ODE solver.",
+                        const=5.0, default=5.0, nargs='?', type=float)
+
+    parser.add_argument('-d', '--debug', help="Indicates whether to log all sim data (True) or just end states (False).",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('-s', '--seed', help="Input random seed for Ornstein-Uhlenbeck Process.",
+                        const=None, default=None, nargs='?', type=int)
+
+    parser.add_argument('-e', '--ensemble', help="Advance all runs at once as a single batched ensemble.",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('-w', '--workers', help="Number of worker processes (0 uses every core).",
+                        const=0, default=1, nargs='?', type=int)
+
+    parser.add_argument('--spill', help="Spill recorded time series to disk (optionally in the given directory) to bound memory.",
+                        const=True, default=None, nargs='?', type=str)
+
+    parser.add_argument('-f', '--format', help="File format for debug time series (tsv, or binary columnar npy).",
+                        default='tsv', choices=sim.storage.FORMATS, type=str)
+
+    parser.add_argument('--record', help="Recording policy for debug time series: all, every:K, grid:DT, change:X or end.",
+                        default='all', type=str)
+
+    parser.add_argument('--solver', help="Single-step method for the ODE solver (rkf45, dopri5, or implicit rosenbrock for stiff networks).",
+                        default='rkf45', choices=list(sim.solvers.SOLVERS), type=str)
+
+    parser.add_argument('--control', help="Step-size controller: bounds (E_MIN/E_MAX) or tolerance (rtol/atol). The rosenbrock solver needs tolerance, its default.",
+                        default=None, choices=sim.control.CONTROLS, type=str)
+
+    parser.add_argument('--rtol', help="Relative tolerance for the tolerance controller.",
+                        default=sim.config.general.RTOL, type=float)
+
+    parser.add_argument('--atol', help="Absolute tolerance (uM) for the tolerance controller (see ATOL_SPECIES in general.py).",
+                        default=sim.config.general.ATOL, type=float)
+
+    parser.add_argument('--events', help="Locate sign changes of ∆G and the dead-end state within steps, and restart the solver there.",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('--checkpoint', help="Save every running simulation every SECONDS seconds, for --resume (off by default; CHECKPOINT_INTERVAL with --resume).",
+                        default=None, type=float, metavar='SECONDS')
+
+    parser.add_argument('--resume', help="Resume interrupted runs in the output directory from their last checkpoint (implies --incremental).",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('--incremental', help="Keep the output directory and skip runs already completed there (see manifest.jsonl).",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('--retry', help="Run again every run that did not reach a dead-end state (implies --incremental).",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('--timers', help="Measure the time every run spends in each phase of the integrator (see run_stats.tsv).",
+                        const=True, default=False, nargs='?', type=bool)
+
+    parser.add_argument('--store', help="Also append every run (seed, varied value, network, success, iterations, end state) to the result store in this directory, shared by all batches (see sim/results.py).",
+                        default=None, type=str, metavar='DIR')
+
+    parser.add_argument('--assembly', help="Community-assembly sweep: simulate random K-reaction subsets of the input reactions (--runs runs each).",
+                        default=None, type=int, metavar='K')
+
+    parser.add_argument('--networks', help="Number of distinct random reaction subsets in an assembly sweep (all of them, if there are fewer).",
+                        default=100, type=int)
 
-        except AssertionError:
-            sys.stderr.write(f"Invalid input: {input_range}. The rules: max > min, and must be a tuple of two strictly positive floats.")
-            sys.stderr.flush()
-            sys.exit(1)
+    parser.add_argument('--enumerate', help="In an assembly sweep, simulate every subset of at most K reactions instead of random ones.",
+                        const=True, default=False, nargs='?', type=bool)
 
-        input_range = float_tuple
-        VARY_METABOLITE = True
+    parser.add_argument('--factor', help="Design sweep: vary NAME (a metabolite, TEMPERATURE, or rate:, decay: or std:<reaction>) over LOW:HIGH (append :log for a log scale). Repeat for every factor.",
+                        action='append', default=None, type=str, metavar='NAME=LOW:HIGH')
 
-    if VARY_METABOLITE:
-        var_met_index = list(metabolites).index(var_met_name)
+    parser.add_argument('--design', help="Design of a design sweep: full grid, Latin hypercube (lhs) or Sobol sequence.",
+                        default='lhs', choices=sim.design.DESIGNS, type=str)
 
-        a, b = input_range
-        var_range = np.linspace(a, b, num=RUNS)
+    parser.add_argument('--points', help="Number of design points (levels per factor for a grid) in a design sweep, --runs runs each.",
+                        default=16, type=int)
 
+    parser.add_argument('--converge', help="In a design sweep, add runs to every design point until STAT of its end states stabilizes (instead of --runs runs): mean, quantile:P or failure. Repeat for every statistic.",
+                        action='append', default=None, type=str, metavar='STAT')
+
+    parser.add_argument('--converge-tol', help="Largest relative change of the --converge statistics when a batch of runs is added.",
+                        default=sim.config.general.CONVERGENCE_TOLERANCE, type=float)
+
+    parser.add_argument('--converge-batch', help="Runs added at a time to every design point that has not converged.",
+                        default=sim.config.general.CONVERGENCE_BATCH, type=int)
+
+    parser.add_argument('--min-runs', help="Minimum number of runs of every design point with --converge.",
+                        default=sim.config.general.MIN_RUNS, type=int)
+
+    parser.add_argument('--max-runs', help="Maximum number of runs of every design point with --converge.",
+                        default=sim.config.general.MAX_RUNS, type=int)
+
+    args = parser.parse_args()
+
+    # default controller of the solver (see sim.solvers.resolve_control)
+    try:
+        args.control = sim.solvers.resolve_control(args.solver, args.control)
+    except ValueError as error:
+        parser.error(str(error))
+
+    # the bounds controller only halves or doubles the timestep, so event location costs steps without making them longer
+    if args.events and args.control != 'tolerance':
+        parser.error("--events needs --control tolerance.")
+
+    # options that only apply to runs executed one at a time (see sim.execute_ensemble)
+    if args.ensemble:
+        unsupported = {'--solver' : args.solver != 'rkf45', '--control' : args.control != 'bounds', '--events' : args.events,
+                       '--timers' : args.timers, '--spill' : args.spill is not None, '--checkpoint' : args.checkpoint is not None,
+                       '--resume' : args.resume, '--assembly' : args.assembly is not None, '--factor' : bool(args.factor)}
+        unsupported = [flag for flag, given in unsupported.items() if given]
+
+        if unsupported:
+            parser.error(f"--ensemble cannot be combined with {', '.join(unsupported)}.")
+
+    # assembly and design sweeps only keep the end state of every run (see sim.sweep.run_subset and run_point),
+    # and neither checkpoint their runs nor record them in a manifest
+    sweep = '--assembly' if args.assembly is not None else '--factor' if args.factor else None
+
+    if sweep is not None:
+        unsupported = {'--debug' : args.debug, '--record' : args.record != 'all', '--spill' : args.spill is not None,
+                       '--format' : args.format != 'tsv', '--checkpoint' : args.checkpoint is not None, '--resume' : args.resume,
+                       '--incremental' : args.incremental, '--retry' : args.retry}
+        unsupported = [flag for flag, given in unsupported.items() if given]
+
+        if unsupported:
+            parser.error(f"{sweep} cannot be combined with {', '.join(unsupported)}.")
+
+    # the result store holds the runs of simple sweeps, indexed on at most one varied metabolite (see sim/results.py)
+    if args.store is not None and (args.assembly is not None or args.factor):
+        parser.error(f"--store cannot be combined with {'--assembly' if args.assembly is not None else '--factor'}.")
+
+    # checkpoints are only written on request, or to go on resuming runs
+    if args.checkpoint is None:
+        args.checkpoint = sim.config.general.CHECKPOINT_INTERVAL if args.resume else 0
+
+    return args
+
+def build_or_exit(reaction_list):
+    try:
+        return sim.setup.make_network(reaction_list)
+    except ValueError as error:
+        sys.stderr.write(f'{error}\n')
+        sys.stderr.flush()
+        sys.exit(1)
+
+def write_debug(OUT, i, sol, success, metabolites, reactions, initial_condition=None, file_format='tsv'):
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    # VI. OUTPUT DATA TO TSV (OR NPY) FILES IF DEBUG == TRUE
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+    # written under a temporary name and renamed when complete,
+    # so that sim_XX never holds the partial output of an interrupted run
+    directory = f'{OUT}/sim_{i:0>2}'
+    partial = f'{OUT}/.sim_{i:0>2}.partial'
+
+    if os.path.exists(partial):
+        shutil.rmtree(partial)
+    os.mkdir(partial)
+
+    if initial_condition is not None:
+        var_met_name, var_met_init_con = initial_condition
+        with open(f'{partial}/initial_condition.txt', 'w') as f:
+            f.write(f'[{var_met_name}]  # in micro-molars\n{var_met_init_con}')
+
+    tables = [('deltaG', sol['deltaG'], reactions),
+              ('composition', sol['composition'], metabolites),
+              ('ornbeck', sol['stochastic process value'], reactions),
+              ('flux', sol['net metabolite flux'], metabolites)]
+
+    for name, data, columns in tables:
+        if file_format == 'npy':
+            sim.storage.write_columns(f'{partial}/{name}_{i:0>2}', sol['time'], data, columns)
+        else:
+            header = '\t'.join(['time'] + list(columns))
+            np.savetxt(f'{partial}/{name}_{i:0>2}.tsv', np.column_stack([sol['time'], data]), delimiter='\t',
+                    header=header, comments='')
+
+    # report whether simulation was successful
+    with open(f'{partial}/report.txt', 'w') as report:
+            report.write(f'success: {success}')
+
+    # write the event log (timestep changes, errors, ...) to a txt file
+    with open(f'{partial}/messages.txt', 'w') as messages:
+            for line in sol['log'].lines():
+                    messages.write(line + '\n')
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.rename(partial, directory)
+
+def make_output_directory(OUT, incremental=False):
+    if incremental:
+        # previous output (completed runs, checkpoints) is kept - see --incremental
+        os.makedirs(OUT, exist_ok=True)
+        return
+
+    if os.path.exists(OUT):
+        print("""\nWarning: specified output directory already exists.\nOutput directory will be overwritten.""")
+        shutil.rmtree(OUT)
+
+    os.makedirs(OUT)
+
+def dead_end_header(metabolites, var_met_name=None):
+    # columns of dead_ends.tsv: run index, random stream of the run (see sim.manifest.seed_label),
+    # end state, and the varied initial concentration (if any)
+    return ['run', 'seed'] + list(metabolites) + ([f'{var_met_name}_INIT'] if var_met_name is not None else [])
+
+def write_dead_ends(OUT, entries, metabolites, var_met_name=None):
+    # dead_ends.tsv of an incremental sweep, rebuilt from the manifest entries
+    # of its completed runs (written to a temporary file, then renamed)
+    with open(f'{OUT}/.dead_ends.tsv.partial', 'w') as dead_end_file:
+        dead_ends = csv.writer(dead_end_file, delimiter='\t')
+        dead_ends.writerow(dead_end_header(metabolites, var_met_name))
+
+        for entry in entries:
+            if entry['status'] == sim.manifest.SUCCESS:
+                dead_ends.writerow([entry['run'], sim.manifest.seed_label(entry['seed'])] + entry['end_state'] + list(entry['parameters'].values()))
+
+    os.replace(f'{OUT}/.dead_ends.tsv.partial', f'{OUT}/dead_ends.tsv')
+
+def write_stats(OUT, columns, rows):
+    # statistics of every run (run_stats.tsv) and their summary over the sweep (stats.json)
+    # rows - list of (values of columns, statistics record) tuples, see sim/stats.py
+    records = [record for labels, record in rows]
+    fields = sim.stats.fields(records) if records else list(sim.stats.COUNTERS)
+
+    with open(f'{OUT}/run_stats.tsv', 'w') as stats_file:
+        table = csv.writer(stats_file, delimiter='\t')
+        table.writerow(list(columns) + fields)
+
+        for labels, record in rows:
+            table.writerow(list(labels) + [record.get(field, '') for field in fields])
+
+    with open(f'{OUT}/stats.json', 'w') as summary:
+        json.dump(sim.stats.summarize(records), summary, indent=1)
+        summary.write('\n')
+
+def previous_seed(OUT):
+    # master seed of the previous simulation in OUT (see network_desc.txt), or None
+    try:
+        with open(f'{OUT}/network_desc.txt') as names:
+            for line in names:
+                if line.startswith('seed: '):
+                    return int(line[len('seed: '):])
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+def assembly_sweep(args, network, master_seed, workers):
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-    # V. EXECUTE ALL SIMULATIONS (In Serial)
+    # COMMUNITY-ASSEMBLY SWEEP: many networks cut out of one library
+    # (the input reactions), written to a single table assembly.tsv
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-    dead_ends = csv.writer(dead_end_file, delimiter='\t')
+    K = args.assembly
+    N = len(network.reactions)
 
-    if VARY_METABOLITE:
-        dead_ends.writerow(list(metabolites) + [f'{var_met_name}_INIT'])
+    if not 1 <= K <= N:
+        sys.stderr.write(f"Invalid choice: cannot select {K} of {N} reactions.")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    if args.enumerate:
+        subsets = sim.sweep.all_subsets(N, K)
     else:
-        dead_ends.writerow(list(metabolites))
+        subsets = sim.sweep.random_subsets(N, K, args.networks, rng=np.random.SeedSequence(master_seed))
 
-    for i in range(1, RUNS + 1):
+    tasks = [(index, subset, run, sim.sweep.point_seed(master_seed, index, run))
+             for index, subset in enumerate(subsets, start=1) for run in range(1, args.runs + 1)]
 
-        # refresh
-        del sim
-        import sim
+    options = {'default_timestep': args.timestep, 'solver': args.solver, 'control': args.control,
+               'rtol': args.rtol, 'atol': args.atol, 'events': args.events, 'timers': args.timers}
 
-        if VARY_METABOLITE:
-            # variable metabolite initial concentration
-            var_met_init_con = var_range[i - 1]
-            initialC[var_met_index] = var_met_init_con
+    make_output_directory(args.out)
 
-        sol, success = sim.execute(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=TIMESTEP, random_seed=SEED)
+    with open(f'{args.out}/network_desc.txt', 'w') as names:
+        names.write(f'metabolites ({len(network.metabolites)}): {network.metabolites}\n')
+        names.write(f'reactions ({N}): {network.reactions}\n')
+        names.write(f'networks: {len(subsets)} ({"all subsets of at most" if args.enumerate else "random subsets of"} {K} reactions), {args.runs} run(s) each\n')
+        names.write(f'seed: {master_seed}\n')
 
-        # if dead-end state condition met
-        if success:
-            if VARY_METABOLITE:
-                dead_ends.writerow(np.append(sol['composition'][-1, :], var_met_init_con))
-            else:
-                dead_ends.writerow(sol['composition'][-1, :])
+    with open(f'{args.out}/assembly.tsv', 'w') as assembly_file:
+        table = csv.writer(assembly_file, delimiter='\t')
+
+        # one row per run: network index, run, reactions present (0/1), success, end state (NaN = metabolite absent)
+        table.writerow(['network', 'run'] + list(network.reactions) + ['success'] + list(network.metabolites))
+
+        stats = []
+
+        for index, run, success, end_state, run_stats in sim.sweep.run_assembly(tasks, network, options, workers=workers):
+            present = np.zeros(N, dtype=int)
+            present[list(subsets[index - 1])] = 1
+
+            table.writerow([index, run] + present.tolist() + [int(success)] + end_state.tolist())
+            stats.append(((index, run, int(success)), run_stats))
+
+    write_stats(args.out, ['network', 'run', 'success'], stats)
+
+def design_sweep(args, network, master_seed, workers):
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    # DESIGN SWEEP: one network at every point of a multi-dimensional
+    # design, written to a single table design.tsv
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    try:
+        factors = [sim.design.parse_factor(spec) for spec in args.factor]
+        sim.design.check_factors(network, factors)
+        assert args.points > 0, f"Invalid choice: {args.points} design points."
+
+        # sequential stopping (see sim/convergence.py)
+        rule = None
+        if args.converge:
+            rule = sim.convergence.StoppingRule([sim.convergence.parse_statistic(spec) for spec in args.converge],
+                                                tolerance=args.converge_tol, batch=args.converge_batch,
+                                                min_runs=args.min_runs, max_runs=args.max_runs)
+    except (ValueError, AssertionError) as error:
+        sys.stderr.write(f'{error}\n')
+        sys.stderr.flush()
+        sys.exit(1)
+
+    coordinates = sim.design.make_design(factors, args.design, args.points, rng=np.random.SeedSequence(master_seed))
+
+    options = {'default_timestep': args.timestep, 'solver': args.solver, 'control': args.control,
+               'rtol': args.rtol, 'atol': sim.control.tolerance_vector(network.metabolites, args.atol), 'events': args.events,
+               'timers': args.timers}
+
+    make_output_directory(args.out)
+
+    with open(f'{args.out}/network_desc.txt', 'w') as names:
+        names.write(f'metabolites ({len(network.metabolites)}): {network.metabolites}\n')
+        names.write(f'reactions ({len(network.reactions)}): {network.reactions}\n')
+        runs = f'runs until {rule}' if rule is not None else f'{args.runs} run(s) each'
+        names.write(f'design: {args.design}, {len(coordinates)} points over {factors}, {runs}\n')
+        names.write(f'seed: {master_seed}\n')
+
+    with open(f'{args.out}/design.tsv', 'w') as design_file:
+        table = csv.writer(design_file, delimiter='\t')
+
+        # one row per run: design point, run, coordinates (one per factor), success, end state
+        table.writerow(['point', 'run'] + [factor.label for factor in factors] + ['success'] + list(network.metabolites))
+
+        stats = []
+
+        if rule is not None:
+            replicates = [sim.convergence.Replicates(rule) for _ in coordinates]
+            results = sim.sweep.run_sequential(coordinates, replicates, network, factors, options, master_seed, workers=workers)
+        else:
+            tasks = [(index, point, run, sim.sweep.point_seed(master_seed, index, run))
+                     for index, point in enumerate(coordinates, start=1) for run in range(1, args.runs + 1)]
+            results = sim.sweep.run_design(tasks, network, factors, options, workers=workers)
+
+        for index, run, success, end_state, run_stats in results:
+            table.writerow([index, run] + coordinates[index - 1].tolist() + [int(success)] + end_state.tolist())
+            stats.append(((index, run, int(success)), run_stats))
+
+    write_stats(args.out, ['point', 'run', 'success'], stats)
+
+    if rule is not None:
+        # number of runs of every design point, and whether its statistics converged
+        with open(f'{args.out}/convergence.tsv', 'w') as convergence_file:
+            table = csv.writer(convergence_file, delimiter='\t')
+            table.writerow(['point'] + [factor.label for factor in factors] + ['runs', 'successes', 'converged'])
+
+            for index, point in enumerate(replicates, start=1):
+                table.writerow([index] + coordinates[index - 1].tolist() + [point.runs, sum(point.success), int(point.converged)])
+
+def main():
+    args = parse_arguments()
+
+    try:
+        sim.record.parse_policy(args.record)
+    except ValueError as error:
+        sys.stderr.write(str(error))
+        sys.stderr.flush()
+        sys.exit(1)
+
+    RUNS = args.runs
+    OUT = args.out
+    TIMESTEP = args.timestep
+    DEBUG = args.debug
+    SEED = args.seed
+    ENSEMBLE = args.ensemble
+    WORKERS = args.workers if args.workers > 0 else os.cpu_count()
+    SPILL = args.spill
+    FORMAT = args.format
+    RECORD = args.record
+    SOLVER = args.solver
+    CONTROL = args.control
+    INCREMENTAL = args.incremental or args.resume or args.retry
+
+    # Completed runs are recorded in the manifest whenever the sweep may be resumed later
+    WRITE_MANIFEST = INCREMENTAL or args.checkpoint > 0
+
+    if sys.stdin is None:
+        sys.stderr.write("Cannot execute program without input file.")
+        sys.stderr.flush()
+        sys.exit(1)
+
+    FILE = sys.stdin
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    # II. READ SIMULATION PARAMETERS from SETUP.py
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+    reaction_list = FILE.readline().strip().split(' ')
+
+    network = build_or_exit(reaction_list)
+
+    [
+        metabolites,
+        reactions,
+        deltaGf0,
+        initialC,
+        stoich_mats,
+        ou_parameters
+    ] = network
+
+    stoich_mat_full, stoich_mat_lim, stoich_mat_nconst = stoich_mats
+
+    # Resumed (and added) runs must draw from the same random streams as before
+    if INCREMENTAL and SEED is None:
+        SEED = previous_seed(OUT)
+
+    # Master seed - every run derives its own random stream from it (see sim.sweep.run_seed)
+    master_seed = np.random.SeedSequence(SEED).entropy
+
+    if args.assembly is not None:
+        assembly_sweep(args, network, master_seed, WORKERS)
+        return
+
+    if args.factor:
+        design_sweep(args, network, master_seed, WORKERS)
+        return
+
+    # - - - - - - - - - - - - - - - - - - - //
+    # III. BUILD OUTPUT DIRECTORY
+    # - - - - - - - - - - - - - - - - - - - //
+
+    CHECKPOINTS = f'{OUT}/checkpoints'
+
+    make_output_directory(OUT, incremental=INCREMENTAL)
+
+    if os.path.isdir(CHECKPOINTS):
+        # partial files of checkpoints that were being written when a run was killed
+        for entry in os.listdir(CHECKPOINTS):
+            if entry.startswith('checkpoint_'):
+                os.remove(os.path.join(CHECKPOINTS, entry))
+
+    # incremental sweeps write dead_ends.tsv from the manifest at the end (see write_dead_ends)
+    with (open(f'{OUT}/dead_ends.tsv', 'a+') if not INCREMENTAL else contextlib.nullcontext()) as dead_end_file:
+        # log all reactions and metabolites
+        with open(f'{OUT}/network_desc.txt', 'w') as names:
+            names.write(f'metabolites ({len(metabolites)}): {metabolites}\n')
+            names.write(f'reactions ({len(reactions)}): {reactions}\n')
+            names.write(f'seed: {master_seed}\n')
+
+        # write all stoichiometric matrices to txt files
+        np.savetxt(f'{OUT}/stoich_mat_full.txt', sim.sparse.dense(stoich_mat_full))
+        np.savetxt(f'{OUT}/stoich_mat_lim.txt', sim.sparse.dense(stoich_mat_lim))
+        np.savetxt(f'{OUT}/stoich_mat_nconst.txt', sim.sparse.dense(stoich_mat_nconst))
+
+        # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+        # IV. DETERMINE WHETHER TO VARY METABOLITE CONCENTRATIONS
+        # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+        VARY_METABOLITE = False
+
+        answer = FILE.readline().strip()
+        if answer.lower() in ['yes', 'y', 'sure']:
+            var_met_name = FILE.readline().strip()
+
+            try:
+                assert var_met_name in metabolites
+            except AssertionError:
+                sys.stderr.write("Invalid choice: {var_met_name} not found.")
+                sys.stderr.flush()
+                sys.exit(1)
+
+            try:
+                input_range = FILE.readline().strip()
+                assert input_range[0] == '(' and input_range[-1] == ')'
+                float_tuple = input_range[1:-1].split(',')
+
+                try:
+                    float_tuple = tuple([float(i) for i in float_tuple])
+                except:
+                    raise AssertionError
+
+                    assert len(float_tuple) == 2
+                    assert float_tuple[0] > 0 and float_tuple[1] > 0
+                    assert float_tuple[1] > float_tuple[0]
+
+            except AssertionError:
+                sys.stderr.write(f"Invalid input: {input_range}. The rules: max > min, and must be a tuple of two strictly positive floats.")
+                sys.stderr.flush()
+                sys.exit(1)
+
+            input_range = float_tuple
+            VARY_METABOLITE = True
+
+        if VARY_METABOLITE:
+            var_met_index = list(metabolites).index(var_met_name)
+
+            a, b = input_range
+            var_range = np.linspace(a, b, num=RUNS)
 
         # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-        # VI. OUTPUT DATA TO TSV FILES IF DEBUG == TRUE
+        # V. EXECUTE ALL SIMULATIONS (In Serial, or on a pool of WORKERS)
         # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-        if DEBUG:
-            os.mkdir(f'{OUT}/sim_{i:0>2}')
+        if not INCREMENTAL:
+            dead_ends = csv.writer(dead_end_file, delimiter='\t')
+            dead_ends.writerow(dead_end_header(metabolites, var_met_name if VARY_METABOLITE else None))
+
+        tasks = []
+        for i in range(1, RUNS + 1):
+            run_initialC = initialC.copy()
 
             if VARY_METABOLITE:
-                with open(f'{OUT}/sim_{i:0>2}/initial_condition.txt', 'w') as f:
-                    f.write(f'[{var_met_name}]  # in micro-molars\n{var_range[i - 1]}')
-
-            metabolite_header = '\t'.join(['time'] + list(metabolites))
-            reaction_header = '\t'.join(['time'] + list(reactions))
-
-            deltaG_data = np.column_stack([sol['time'], sol['deltaG']])
-            np.savetxt(f'{OUT}/sim_{i:0>2}/deltaG_{i:0>2}.tsv', deltaG_data, delimiter='\t',
-                    header=reaction_header, comments='')
-
-            composition_data = np.column_stack([sol['time'], sol['composition']])
-            np.savetxt(f'{OUT}/sim_{i:0>2}/composition_{i:0>2}.tsv', composition_data, delimiter='\t',
-                    header=metabolite_header, comments='')
-
-            ornbeck_data = np.column_stack([sol['time'], sol['stochastic process value']])
-            np.savetxt(f'{OUT}/sim_{i:0>2}/ornbeck_{i:0>2}.tsv', ornbeck_data, delimiter='\t',
-                    header=reaction_header, comments='')
-
-            flux_data = np.column_stack([sol['time'], sol['net metabolite flux']])
-            np.savetxt(f'{OUT}/sim_{i:0>2}/flux_{i:0>2}.tsv', flux_data, delimiter='\t',
-                    header=metabolite_header, comments='')
-        
-            # report whether simulation was successful
-            with open(f'{OUT}/sim_{i:0>2}/report.txt', 'w') as report:
-                    report.write(f'success: {success}')
-
-            # write all error messages to a txt file
-            with open(f'{OUT}/sim_{i:0>2}/messages.txt', 'w') as messages:
-                    for line in sol['messages']:
-                            messages.write(line + '\n')
+                # variable metabolite initial concentration
+                run_initialC[var_met_index] = var_range[i - 1]
+
+            tasks.append((i, run_initialC, sim.sweep.run_seed(master_seed, i)))
+
+        # inputs that differ between runs - recorded in the manifest
+        parameters = lambda i : {f'{var_met_name}_INIT' : float(var_range[i - 1])} if VARY_METABOLITE else {}
+
+        # without --debug, only the end state of every run is needed
+        options = {'default_timestep': TIMESTEP, 'trajectory': DEBUG, 'record': RECORD if DEBUG else 'end'}
+
+        # spilling, solvers, controllers, events, timers and checkpoints apply to runs executed
+        # one at a time (parse_arguments rejects them with --ensemble)
+        if not ENSEMBLE:
+            options['spill'] = SPILL
+            options['solver'] = SOLVER
+            options['control'] = CONTROL
+            options['rtol'] = args.rtol
+            options['atol'] = sim.control.tolerance_vector(metabolites, args.atol)
+            options['events'] = args.events
+            options['timers'] = args.timers
+
+            # every run saves its state periodically, so that --resume can continue it (see sim/checkpoint.py)
+            if args.checkpoint > 0:
+                options['checkpoints'] = CHECKPOINTS
+                options['checkpoint_interval'] = args.checkpoint
+                options['resume'] = args.resume
+
+        # options that change the results of a run - recorded in the manifest
+        run_options = {name : value for name, value in options.items() if name in ['default_timestep', 'solver', 'control', 'rtol', 'events', 'record']}
+        if not ENSEMBLE:
+            run_options['atol'] = args.atol
+
+        pending = tasks
+
+        if WRITE_MANIFEST:
+            MANIFEST = f'{OUT}/{sim.manifest.MANIFEST}'
+            network_id = sim.manifest.network_id(reactions)
+
+        if INCREMENTAL:
+            completed = sim.manifest.read_manifest(MANIFEST)
+
+            # a run is skipped if it finished with the same seed, network, parameters and options
+            # (and, in --debug mode, its time series have been written)
+            pending = [(i, run_initialC, seed) for i, run_initialC, seed in tasks
+                       if not sim.manifest.is_complete(completed.get(i), seed, network_id, parameters(i), run_options, retry=args.retry)
+                       or (DEBUG and not os.path.isdir(f'{OUT}/sim_{i:0>2}'))]
+
+            print(f'{RUNS - len(pending)} of {RUNS} runs already completed in {OUT}.')
+
+        # In ensemble mode, every worker advances one contiguous batch of runs at once
+        batch_size = max(1, -(-len(pending) // WORKERS)) if ENSEMBLE else 1
+        batches = [pending[j:j + batch_size] for j in range(0, len(pending), batch_size)]
+
+        # statistics of every run, see write_stats
+        stats = []
+
+        # every invocation appends to its own segment of the result store
+        store = None
+        if args.store is not None:
+            try:
+                store = sim.results.ResultStore(args.store, metabolites, f'{var_met_name}_INIT' if VARY_METABOLITE else None)
+                store_network = sim.manifest.network_id(reactions)
+            except ValueError as error:
+                sys.stderr.write(f'{error}\n')
+                sys.stderr.flush()
+                sys.exit(1)
+
+        # The main process is the single writer of all output files:
+        # results arrive in run order, whatever the number of workers.
+        for i, sol, success in sim.sweep.run_all(batches, deltaGf0, stoich_mats, ou_parameters, options, workers=WORKERS):
+
+            var_met_init_con = tasks[i - 1][1][var_met_index] if VARY_METABOLITE else None
+
+            # NaN if the run recorded no row (e.g. failed right after restoring a checkpoint)
+            end_state = sim.sweep.end_state(sol)
+            stats.append(((i, int(success)), sol['stats']))
+
+            # if dead-end state condition met
+            if success and not INCREMENTAL:
+                row = [i, sim.manifest.seed_label(tasks[i - 1][2])] + list(end_state)
+                dead_ends.writerow(row + [var_met_init_con] if VARY_METABOLITE else row)
+
+            if DEBUG:
+                write_debug(OUT, i, sol, success, metabolites, reactions,
+                            (var_met_name, var_met_init_con) if VARY_METABOLITE else None, FORMAT)
+
+            # append to the result store before the manifest entry: a run cut off in between
+            # is run again and its row repeated (see unique in sim.results.read_results)
+            if store is not None:
+                store.append(i, master_seed, store_network, success, sol['stats']['iterations'],
+                             end_state, value=var_met_init_con if VARY_METABOLITE else np.nan)
+
+            # the run is complete once its manifest entry is written
+            if WRITE_MANIFEST:
+                sim.manifest.append_entry(MANIFEST, sim.manifest.make_entry(i, tasks[i - 1][2], network_id, parameters(i), run_options,
+                                                                            success, end_state, sol['stats']))
+
+        if store is not None:
+            store.close()
+
+    if INCREMENTAL:
+        completed = sim.manifest.read_manifest(MANIFEST)
+        entries = [completed[i] for i, run_initialC, seed in tasks
+                   if sim.manifest.is_complete(completed.get(i), seed, network_id, parameters(i), run_options)]
+
+        write_dead_ends(OUT, entries, metabolites, var_met_name if VARY_METABOLITE else None)
+
+        # statistics of all completed runs, including those of earlier invocations
+        stats = [((entry['run'], int(entry['status'] == sim.manifest.SUCCESS)), entry['stats'])
+                 for entry in entries if entry.get('stats') is not None]
+
+    write_stats(OUT, ['run', 'success'], stats)
+
+    # every finished run has removed its checkpoint
+    if os.path.isdir(CHECKPOINTS) and not os.listdir(CHECKPOINTS):
+        os.rmdir(CHECKPOINTS)
+
+if __name__ == '__main__':
+    main()
@@ -9,36 +9,35 @@
 INPUT_FILE="cariaco.txt"
 
 NUM_SETS=2
-RUNS_PER_SIM=30
+RUNS_PER_SIM=90
 
-# Never do too many threads -- this causes issues in data output.
-NUM_THREADS=3
+# Worker processes per set (see the --workers flag in main.py).
+# Output is written by a single process, so any number is safe.
+NUM_WORKERS=3
 
 OUTPUT_DIR=data
 
+# Every batch also appends its runs to this result store (see sim/results.py),
+# which visualization.ipynb reads in one go.
+RESULTS_DIR="$OUTPUT_DIR/results"
+
 # - - - - - - - - - - //
 
 # WARNING: RUNNING THIS SCRIPT WILL OVERWRITE THE EXISTING DATA DIRECTORY
 rm -rf $OUTPUT_DIR 
 
-COUNTER=0
-
 for SET in $(seq 1 $NUM_SETS); do
 
-    # Run 'NUM_THREADS' simulations in parallel
-    for i in $(seq 1 $NUM_THREADS); do
-
-        ((COUNTER++))
-        printf -v LABEL "%02d" $COUNTER
-
-        # Execute simulation
-        python3 main.py \
-            --runs=$RUNS_PER_SIM \
-            --out="$OUTPUT_DIR/batch_$LABEL" \
-            --debug \
-            < $INPUT_FILE \
-            & \
-    done
-
-    wait # until current set is complete before moving on
+    printf -v LABEL "%02d" $SET
+
+    # Execute simulation (--debug time series in binary columnar form, see sim/storage.py,
+    # which visualization.ipynb opens with sim.storage.load_run)
+    python3 main.py \
+        --runs=$RUNS_PER_SIM \
+        --workers=$NUM_WORKERS \
+        --out="$OUTPUT_DIR/batch_$LABEL" \
+        --store="$RESULTS_DIR" \
+        --debug \
+        --format=npy \
+        < $INPUT_FILE
 done
@@ -1,4 +1,5 @@
 """ Numerical simulation package. """
 
-from . import config, setup
-from .integrate import execute
+from . import checkpoint, config, control, convergence, design, eventlog, manifest, network, record, results, setup, solvers, sparse, stats, storage, sweep
+from .network import Network
+from .integrate import execute, execute_ensemble
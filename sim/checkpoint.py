@@ -0,0 +1,93 @@
+# Checkpoints of running simulations.
+#
+# execute periodically saves the complete state of its integrator
+# (time, composition, timestep, Ornstein-Uhlenbeck knots, solver stages
+# and the trajectory recorded so far) to a single .npz file. A run that
+# is started again with the same inputs and the same checkpoint file
+# continues from the saved state and gives bit-identical results.
+#
+# Files are written atomically: a run killed while saving leaves
+# the previous checkpoint intact.
+
+import numpy as np
+
+import os
+import hashlib
+import tempfile
+import zipfile
+
+from . import sparse
+
+def fingerprint(*parts) -> str:
+    """
+    Hash of the inputs of a run (arrays, sparse matrices and plain values):
+    a checkpoint is only restored by a run with the same fingerprint.
+    """
+    digest = hashlib.sha256()
+
+    for part in parts:
+        if sparse.issparse(part):
+            part = np.concatenate([np.asarray(a, dtype=np.double) for a in sparse.triplets(part)] + [np.asarray(part.shape, dtype=np.double)])
+
+        if isinstance(part, np.ndarray):
+            digest.update(str(part.shape).encode())
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode())
+
+        # separator - keeps the hash of ('ab', 'c') apart from ('a', 'bc')
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+def seed_identity(random_seed):
+    """ Reproducible description of a random seed (Generators by their bit generator state). """
+    if isinstance(random_seed, np.random.Generator):
+        return random_seed.bit_generator.state
+
+    if isinstance(random_seed, np.random.SeedSequence):
+        return (random_seed.entropy, random_seed.spawn_key, random_seed.pool_size)
+
+    return random_seed
+
+def save_checkpoint(path, key, state) -> None:
+    """
+    Writes the state of a run (dictionary: name -> array) to path, atomically.
+    key - fingerprint of the inputs of the run (see fingerprint).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    handle, temporary = tempfile.mkstemp(prefix='checkpoint_', suffix='.npz', dir=directory)
+
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, key=np.array(key), **state)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+def load_checkpoint(path, key) -> dict:
+    """ Returns the state saved in path (see save_checkpoint), or None if it is missing, unreadable or from other inputs. """
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['key']) != key:
+                return None
+
+            return {name : data[name] for name in data.files if name != 'key'}
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        return None
+
+def remove_checkpoint(path) -> None:
+    """ Deletes a checkpoint (if it exists). """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
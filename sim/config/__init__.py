@@ -1,3 +1,3 @@
 """ Configuration library for sim package. """
 
-from . import reactions, metabolites
\ No newline at end of file
+from . import general, reactions, metabolites
\ No newline at end of file
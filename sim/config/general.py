@@ -20,3 +20,46 @@ E_MAX = 1
 # Boundary condition - simulation will terminate early
 # if ∆G for all reactions is above this value
 DELTA_G_BOUND = -1
+
+# Step-size control (see sim/control.py).
+# 'bounds' - halve or double the timestep when the error leaves [E_MIN, E_MAX]
+# 'tolerance' - scale the timestep to keep every metabolite within its tolerance
+CONTROL = 'bounds'
+
+# Tolerances for the 'tolerance' controller: a step is accepted if
+# the error of every metabolite is below ATOL + RTOL * concentration.
+RTOL = 1e-3
+ATOL = 1e-3 # uM
+
+# Optional per-metabolite absolute tolerances (units in uM), e.g. {'H2O': 1.0}
+ATOL_SPECIES = {}
+
+# Safety factor and bounds on how much the timestep may shrink or grow per step
+SAFETY = 0.9
+MIN_SCALE = 0.2
+MAX_SCALE = 5.0
+
+# Accuracy (in days) of the located times of ∆G sign changes
+# and of the dead-end state when events are enabled (see sim/events.py)
+EVENT_TOLERANCE = 1e-6
+
+# Maximum number of events (timestep changes, rejected steps, ...) kept in the
+# log of a run; beyond it, only the first and the most recent ones are kept
+# (see sim/eventlog.py)
+EVENT_LOG_LIMIT = 10_000
+
+# Sequential stopping of replicate runs (see --converge in main.py and sim/convergence.py):
+# largest relative change of the statistics when a batch of runs is added,
+# runs added at a time, and bounds on the number of runs of every design point
+CONVERGENCE_TOLERANCE = 0.05
+CONVERGENCE_BATCH = 10
+MIN_RUNS = 10
+MAX_RUNS = 200
+
+# Seconds between two checkpoints of a running simulation (see sim/checkpoint.py)
+CHECKPOINT_INTERVAL = 600
+
+# Stoichiometric matrices with at most this fraction of nonzero entries
+# are stored and multiplied in sparse form (see sim/sparse.py).
+# Only large reaction libraries are affected; requires scipy.
+SPARSE_DENSITY = 0.05
@@ -0,0 +1,71 @@
+# Step-size control for the numerical integration code.
+#
+# The 'bounds' controller is the original scheme of execute: halve or
+# double the timestep whenever the (unscaled) error leaves [E_MIN, E_MAX].
+# The 'tolerance' controller scales the error of every metabolite by
+# its own absolute and relative tolerance, and picks the next timestep
+# in proportion to the error, so that most steps are accepted at once.
+#
+# Source: [Hairer, Norsett & Wanner (1993) - Solving Ordinary Differential Equations I, pp. 167-168]
+
+import numpy as np
+
+from .config.general import RTOL, ATOL, ATOL_SPECIES, SAFETY, MIN_SCALE, MAX_SCALE
+
+CONTROLS = ['bounds', 'tolerance']
+
+def tolerance_vector(metabolites, atol=ATOL, species=ATOL_SPECIES) -> np.array:
+    """
+    Vector of absolute tolerances (uM) for the given metabolites:
+    atol, except for the metabolites listed in species (name -> tolerance).
+    """
+    return np.array([species.get(met, atol) for met in metabolites], dtype=np.double)
+
+class ToleranceControl:
+    """
+    Error-proportional step-size controller.
+
+    A step from C to new_C with error estimate e is accepted if
+
+        max_m |e[m]| / (atol[m] + rtol * max(|C[m]|, |new_C[m]|)) <= 1
+
+    and the next timestep is h * safety * err ** (-1 / error_order),
+    limited to [min_scale * h, max_scale * h].
+
+    rtol - relative tolerance.
+    atol - absolute tolerance in uM (scalar, or one value per metabolite).
+    error_order - order of the local error estimate of the solver.
+    """
+
+    def __init__(self, error_order, rtol=RTOL, atol=ATOL, safety=SAFETY, min_scale=MIN_SCALE, max_scale=MAX_SCALE):
+        self.exponent = -1.0 / error_order
+        self.rtol = rtol
+        self.atol = np.asarray(atol, dtype=np.double)
+        self.safety = safety
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+
+    def error_norm(self, C, new_C, error) -> float:
+        """ Scaled error of a step (accept if <= 1). """
+        scale = self.atol + self.rtol * np.maximum(np.abs(C), np.abs(new_C))
+        return np.max(np.abs(error) / scale)
+
+    def next_timestep(self, h, error_norm) -> float:
+        """ Proposed timestep after a step of size h with the given scaled error. """
+        if error_norm == 0:
+            return h * self.max_scale
+
+        factor = self.safety * error_norm ** self.exponent
+        return h * min(self.max_scale, max(self.min_scale, factor))
+
+    def depletion_timestep(self, h, new_C, flux) -> float:
+        """
+        Timestep at which the first consumed metabolite would run out,
+        if the flux of the last step (of size h) went on unchanged.
+        Explicit solvers step past zero (and are rejected) beyond it.
+        """
+        consumed = flux < 0
+        if not consumed.any():
+            return np.inf
+
+        return h * np.min(new_C[consumed] / -flux[consumed])
@@ -0,0 +1,157 @@
+# Sequential stopping of replicate runs (see --converge in main.py).
+#
+# With stochastic Ornstein-Uhlenbeck rates, every design point needs
+# enough replicate runs for the distribution of its dead-end states to
+# converge - some points after 10 runs, others only after hundreds.
+# Instead of a fixed number of runs per point, replicates are added in
+# batches until the chosen statistics of the end states (means, quantiles,
+# fraction of failed runs) no longer change by more than a tolerance when
+# the last batch is added, within a minimum and maximum number of runs.
+#
+# The decision for a point only depends on its own runs, in run order,
+# so results do not depend on the number of workers.
+
+import numpy as np
+
+from .config.general import ATOL, CONVERGENCE_TOLERANCE, CONVERGENCE_BATCH, MIN_RUNS, MAX_RUNS
+
+class Statistic:
+    """
+    Statistic of the runs of one design point:
+
+        'mean'          mean end state of the successful runs (one value per metabolite)
+        'quantile:P'    P-quantile (0 <= P <= 1) of the end states of the successful runs
+        'failure'       fraction of runs that did not reach a dead-end state
+    """
+
+    def __init__(self, kind, p=None):
+        self.kind = kind
+        self.p = p
+
+    def __repr__(self) -> str:
+        return f'quantile:{self.p}' if self.kind == 'quantile' else self.kind
+
+    def __call__(self, end_states, success) -> np.array:
+        """ Value of the statistic for end states (R x M) and success flags (R,) of R runs. """
+        if self.kind == 'failure':
+            return np.array([1.0 - success.mean()])
+
+        end_states = end_states[success]
+
+        if len(end_states) == 0:
+            return np.full(end_states.shape[1], np.nan)
+
+        if self.kind == 'mean':
+            return end_states.mean(axis=0)
+
+        return np.quantile(end_states, self.p, axis=0)
+
+def parse_statistic(spec) -> Statistic:
+    """ Reads a statistic from its specification ('mean', 'quantile:P' or 'failure', see Statistic). Raises ValueError. """
+    kind, _, value = spec.partition(':')
+
+    if kind in ['mean', 'failure'] and not value:
+        return Statistic(kind)
+
+    if kind == 'quantile' and value:
+        try:
+            p = float(value)
+        except ValueError:
+            p = None
+
+        if p is not None and 0 <= p <= 1:
+            return Statistic(kind, p)
+
+    raise ValueError(f"Invalid statistic: {spec}. Expected mean, quantile:P (0 <= P <= 1) or failure.")
+
+class StoppingRule:
+    """
+    When to stop adding replicate runs to a design point.
+
+    statistics - list of Statistic.
+    tolerance - largest relative change of any statistic (and any metabolite) when
+                the last batch of runs is added; absolute below floor (uM), and
+                for the fraction of failed runs.
+    batch - number of runs added to an unconverged point at a time.
+    min_runs, max_runs - bounds on the number of runs of every point.
+    """
+
+    def __init__(self, statistics, tolerance=CONVERGENCE_TOLERANCE, batch=CONVERGENCE_BATCH,
+                 min_runs=MIN_RUNS, max_runs=MAX_RUNS, floor=ATOL):
+        if not statistics:
+            raise ValueError("At least one statistic is needed for sequential stopping.")
+
+        if not (tolerance > 0 and batch > 0 and 0 < min_runs <= max_runs):
+            raise ValueError(f"Invalid stopping rule: tolerance {tolerance}, batch {batch}, runs {min_runs} to {max_runs}.")
+
+        self.statistics = list(statistics)
+        self.tolerance = tolerance
+        self.batch = batch
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.floor = floor
+
+    def __repr__(self) -> str:
+        return (f'{", ".join(map(repr, self.statistics))} within {self.tolerance}'
+                f' ({self.min_runs} to {self.max_runs} runs, in batches of {self.batch})')
+
+    def values(self, end_states, success) -> list:
+        """ All statistics of the given runs (one array per statistic). """
+        return [statistic(end_states, success) for statistic in self.statistics]
+
+    def stable(self, previous, current) -> bool:
+        """ True if no statistic changed by more than the tolerance (values that are NaN twice are stable). """
+        for statistic, a, b in zip(self.statistics, previous, current):
+            # the fraction of failed runs is compared on an absolute scale
+            scale = 1.0 if statistic.kind == 'failure' else np.maximum(np.maximum(np.abs(a), np.abs(b)), self.floor)
+
+            within = (np.abs(b - a) <= self.tolerance * scale) | (np.isnan(a) & np.isnan(b))
+            if not within.all():
+                return False
+
+        return True
+
+class Replicates:
+    """ The runs of one design point so far, and whether they have converged (see StoppingRule). """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.end_states = []
+        self.success = []
+        self.converged = False
+
+    @property
+    def runs(self) -> int:
+        return len(self.success)
+
+    @property
+    def done(self) -> bool:
+        """ True if no more runs are needed: converged, or at the maximum number of runs. """
+        return self.converged or self.runs >= self.rule.max_runs
+
+    def add(self, success, end_state) -> None:
+        """ Adds the result of the next run (in run order). """
+        self.success.append(bool(success))
+        self.end_states.append(np.asarray(end_state, dtype=np.double))
+
+    def check(self) -> bool:
+        """ Decides whether the runs so far have converged: the statistics with and without the last batch agree. """
+        rule = self.rule
+        before = self.runs - rule.batch
+
+        if self.runs < rule.min_runs or before < 1:
+            self.converged = False
+            return False
+
+        end_states = np.array(self.end_states)
+        success = np.array(self.success)
+
+        self.converged = rule.stable(rule.values(end_states[:before], success[:before]), rule.values(end_states, success))
+        return self.converged
+
+    def next_runs(self) -> int:
+        """ Number of runs to add next (0 when done). """
+        if self.runs < self.rule.min_runs:
+            return self.rule.min_runs - self.runs
+
+        return 0 if self.done else min(self.rule.batch, self.rule.max_runs - self.runs)
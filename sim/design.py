@@ -0,0 +1,169 @@
+# Space-filling designs for multi-dimensional parameter sweeps.
+#
+# A design varies several factors together: initial concentrations of
+# metabolites, the temperature and the Ornstein-Uhlenbeck ranges of
+# reactions (see Factor). Besides full grids, Latin hypercube and Sobol designs are
+# supported - they cover the whole parameter space with far fewer points
+# than a grid, or than sweeping one factor at a time.
+#
+# scipy is only imported for Sobol designs.
+
+import numpy as np
+
+import itertools
+
+# Design methods (see unit_design)
+DESIGNS = ['grid', 'lhs', 'sobol']
+
+# Per-reaction factors: prefix of the name, and index of the scaled range in ou_parameters
+OU_FACTORS = {'rate' : 0, 'decay' : 1, 'std' : 2}
+
+class Factor:
+    """
+    One dimension of a design.
+
+    name - one of:
+        <metabolite>        initial concentration of the metabolite (uM)
+        TEMPERATURE         temperature (K) for the Gibbs energies
+        rate:<reaction>     scale factor for the typical rate range of the reaction
+        decay:<reaction>    scale factor for the typical decay range of the reaction
+        std:<reaction>      scale factor for the typical std range of the reaction
+    low, high - range of values (low <= high).
+    log - spread values evenly on a logarithmic scale (needs low > 0).
+    """
+
+    def __init__(self, name, low, high, log=False):
+        if not low <= high:
+            raise ValueError(f"Invalid range for {name}: {low} > {high}.")
+
+        if (log or name.partition(':')[0] in OU_FACTORS) and low <= 0:
+            raise ValueError(f"Invalid range for {name}: values must be strictly positive.")
+
+        self.name = name
+        self.low = float(low)
+        self.high = float(high)
+        self.log = bool(log)
+
+    def __repr__(self) -> str:
+        return f'{self.name}={self.low}:{self.high}' + (':log' if self.log else '')
+
+    @property
+    def kind(self) -> str:
+        """ 'metabolite', 'temperature', or one of OU_FACTORS ('rate', 'decay', 'std'). """
+        if self.name == 'TEMPERATURE':
+            return 'temperature'
+        prefix, colon, reaction = self.name.partition(':')
+        return prefix if colon and prefix in OU_FACTORS else 'metabolite'
+
+    @property
+    def label(self) -> str:
+        """ Column name of the factor in result tables (metabolites as <metabolite>_INIT, as in dead_ends.tsv). """
+        return f'{self.name}_INIT' if self.kind == 'metabolite' else self.name
+
+    @property
+    def target(self) -> str:
+        """ Name of the metabolite or reaction (None for the temperature). """
+        if self.kind == 'temperature':
+            return None
+        return self.name[len(self.kind) + 1:] if self.kind in OU_FACTORS else self.name
+
+    def values(self, u) -> np.array:
+        """ Maps points u of the unit interval onto the range of the factor. """
+        u = np.asarray(u, dtype=np.double)
+
+        if self.log:
+            return np.exp(np.log(self.low) + u * (np.log(self.high) - np.log(self.low)))
+
+        return self.low + u * (self.high - self.low)
+
+def parse_factor(spec) -> Factor:
+    """
+    Reads a factor from the command-line syntax NAME=LOW:HIGH or NAME=LOW:HIGH:log,
+    e.g. 'O2=50:150', 'TEMPERATURE=278:308', 'rate:amoA=0.1:10:log' or 'std:nxr=0.5:2'.
+    Raises ValueError.
+    """
+    name, equals, bounds = spec.rpartition('=')
+    parts = bounds.split(':')
+
+    if not equals or not name or len(parts) not in [2, 3] or (len(parts) == 3 and parts[2] != 'log'):
+        raise ValueError(f"Invalid factor: {spec}. Expected NAME=LOW:HIGH or NAME=LOW:HIGH:log.")
+
+    try:
+        low, high = float(parts[0]), float(parts[1])
+    except ValueError:
+        raise ValueError(f"Invalid factor: {spec}. LOW and HIGH must be numbers.")
+
+    return Factor(name.strip(), low, high, log=len(parts) == 3)
+
+def check_factors(network, factors) -> None:
+    """ Raises ValueError unless every factor refers to a metabolite or reaction of the network (once). """
+    names = [factor.name for factor in factors]
+    repeated = sorted(set([name for name in names if names.count(name) > 1]))
+    if repeated:
+        raise ValueError(f'{", ".join(repeated)} varied more than once.')
+
+    for factor in factors:
+        if factor.kind == 'metabolite' and factor.target not in network.metabolite_index:
+            raise ValueError(f"Metabolite '{factor.target}' is not part of this network.")
+        if factor.kind in OU_FACTORS and factor.target not in network.reaction_index:
+            raise ValueError(f"Reaction '{factor.target}' is not part of this network.")
+
+def unit_design(method, dimensions, points, rng=None) -> np.array:
+    """
+    Design in the unit hypercube: one row per design point, one column per dimension.
+
+    method - 'grid': full grid with points levels per dimension (points ** dimensions rows),
+             'lhs': Latin hypercube of points rows (one point in every 1/points slice of each dimension),
+             'sobol': scrambled Sobol sequence of points rows (best balanced for powers of two).
+    rng - seed for the random designs ('lhs' and 'sobol').
+    """
+    if method == 'grid':
+        levels = np.linspace(0, 1, points) if points > 1 else np.array([0.5])
+        return np.array(list(itertools.product(levels, repeat=dimensions)), dtype=np.double).reshape(-1, dimensions)
+
+    if method == 'lhs':
+        rng = np.random.default_rng(rng)
+        # column by column: a random permutation of the slices, and a random point within each slice
+        slices = np.column_stack([rng.permutation(points) for _ in range(dimensions)]).reshape(points, dimensions)
+        return (slices + rng.uniform(size=(points, dimensions))) / points
+
+    if method == 'sobol':
+        from scipy.stats import qmc
+
+        rng = np.random.default_rng(rng)
+        try:
+            sampler = qmc.Sobol(d=dimensions, scramble=True, rng=rng)
+        except TypeError:
+            # scipy < 1.15
+            sampler = qmc.Sobol(d=dimensions, scramble=True, seed=rng)
+
+        return sampler.random(points)
+
+    raise ValueError(f"Unknown design '{method}' (expected one of {', '.join(DESIGNS)}).")
+
+def make_design(factors, method, points, rng=None) -> np.array:
+    """ Design points (see unit_design), with one column of values per factor. """
+    unit = unit_design(method, len(factors), points, rng=rng)
+    return np.column_stack([factor.values(unit[:, d]) for d, factor in enumerate(factors)]).reshape(len(unit), len(factors))
+
+def apply_design(network, factors, coordinates, temperature) -> tuple:
+    """
+    Simulation inputs of one design point.
+
+    coordinates - one value per factor.
+    temperature - used unless the temperature is a factor.
+
+    Returns (initialC, ou_parameters, temperature) for execute.
+    """
+    initialC = network.initialC.copy()
+    ou_parameters = [parameter.copy() for parameter in network.ou_parameters]
+
+    for factor, value in zip(factors, coordinates):
+        if factor.kind == 'temperature':
+            temperature = value
+        elif factor.kind in OU_FACTORS:
+            ou_parameters[OU_FACTORS[factor.kind]][network.reaction_index[factor.target]] *= value
+        else:
+            initialC[network.metabolite_index[factor.target]] = value
+
+    return initialC, ou_parameters, temperature
@@ -0,0 +1,144 @@
+# Compact log of the notable events of a run (timestep changes,
+# rejected steps, reaction switches, termination).
+#
+# Events are stored as typed arrays - time, event code, timestep and
+# one extra value per event - and only rendered to text on output
+# (see EventLog.lines), so the integrator never formats strings.
+#
+# At most limit events are retained per run: the first half of them,
+# and the most recent ones in a ring buffer. Runs that keep halving and
+# doubling their timestep for a long time therefore use bounded memory.
+
+import numpy as np
+
+from .config.general import E_MIN, E_MAX, EVENT_LOG_LIMIT
+
+# Event codes
+START = 0
+TERMINATED_ITERATIONS = 1   # value: iteration count
+HALVED_NAN = 2
+HALVED_NEGATIVE = 3
+REDUCED_TOLERANCE = 4       # value: scaled error
+LOOP_ESCAPE = 5
+HALVED_ERROR = 6
+DOUBLED_ERROR = 7
+TERMINATED_TIMESTEP = 8
+DEAD_END_LOCATED = 9
+REACTION_SWITCH = 10        # value: reaction index
+SUCCESS = 11
+FAILURE = 12
+FINISHED = 13               # value: iteration count
+
+# Text of every event (time t, timestep h, value v)
+TEMPLATES = {
+    START : lambda t, h, v : f'{t:.4f}: simulation starts with timestep {h}.',
+    TERMINATED_ITERATIONS : lambda t, h, v : f'{t:.4f}: simulation terminated after {int(v)} iterations.',
+    HALVED_NAN : lambda t, h, v : f'{t:.4f}: timestep halved to {h} due to NaN concentrations.',
+    HALVED_NEGATIVE : lambda t, h, v : f'{t:.4f}: timestep halved to {h} due to negative concentrations.',
+    REDUCED_TOLERANCE : lambda t, h, v : f'{t:.4f} : timestep reduced to {h} due to scaled error {v:.3g} over tolerance.',
+    LOOP_ESCAPE : lambda t, h, v : f'{t:.4f} : excessive loop count detected. Continuing with timestep {h}.',
+    HALVED_ERROR : lambda t, h, v : f'{t:.4f} : timestep halved to {h} due to error over {E_MAX}.',
+    DOUBLED_ERROR : lambda t, h, v : f'{t:.4f} : timestep doubled to {h} due to error under {E_MIN}.',
+    TERMINATED_TIMESTEP : lambda t, h, v : f'{t:.4f}: simulation terminated early with timestep {h}.',
+    DEAD_END_LOCATED : lambda t, h, v : f'{t:.4f}: dead-end state located at {t + h:.6f}.',
+    REACTION_SWITCH : lambda t, h, v : f'{t:.4f}: ∆G of reaction {int(v)} changes sign at {t + h:.6f}.',
+    SUCCESS : lambda t, h, v : f'{t:.4f}: simulation terminated successfully with timestep {h}.',
+    FAILURE : lambda t, h, v : f'{t:.4f}: simulation terminated unsuccessfully with timestep {h}.',
+}
+
+class EventLog:
+    """
+    Array-backed log of the events of one run.
+
+    source - name of the function that ran the simulation (for the last line of the log).
+    limit - maximum number of retained events (at least 2).
+    """
+
+    def __init__(self, source='execute', limit=EVENT_LOG_LIMIT):
+        assert limit >= 2, "Event log must retain at least two events!"
+
+        self.source = source
+        self.limit = int(limit)
+        self.head = self.limit // 2     # the first head events are always retained
+        self.total = 0                  # events logged, including dropped ones
+
+        self.capacity = min(64, self.limit)
+        self.allocate(self.capacity)
+
+    def allocate(self, capacity):
+        times = np.empty(capacity, dtype=np.double)
+        codes = np.empty(capacity, dtype=np.int8)
+        timesteps = np.empty(capacity, dtype=np.double)
+        values = np.empty(capacity, dtype=np.double)
+
+        if self.total > 0:
+            n = min(self.total, self.capacity)
+            times[:n], codes[:n], timesteps[:n], values[:n] = self.times[:n], self.codes[:n], self.timesteps[:n], self.values[:n]
+
+        self.times, self.codes, self.timesteps, self.values = times, codes, timesteps, values
+        self.capacity = capacity
+
+    def add(self, code, time, timestep=np.nan, value=np.nan) -> None:
+        """ Logs one event (see the event codes above). """
+        n = self.total
+
+        if n >= self.capacity and self.capacity < self.limit:
+            self.allocate(min(2 * self.capacity, self.limit))
+
+        if n < self.capacity:
+            i = n
+        else:
+            # ring buffer behind the retained head
+            i = self.head + (n - self.head) % (self.limit - self.head)
+
+        self.times[i] = time
+        self.codes[i] = code
+        self.timesteps[i] = timestep
+        self.values[i] = value
+        self.total = n + 1
+
+    @property
+    def omitted(self) -> int:
+        """ Number of dropped events (between the head and the most recent events). """
+        return max(0, self.total - self.limit)
+
+    def order(self) -> np.array:
+        """ Indices of the retained events, in the order they were logged. """
+        if self.total <= self.limit:
+            return np.arange(self.total)
+
+        start = self.head + (self.total - self.head) % (self.limit - self.head)
+        return np.concatenate([np.arange(self.head), np.arange(start, self.limit), np.arange(self.head, start)])
+
+    def table(self) -> dict:
+        """ Retained events as arrays: time, code, timestep and value. """
+        order = self.order()
+        return {'time' : self.times[order], 'code' : self.codes[order], 'timestep' : self.timesteps[order], 'value' : self.values[order]}
+
+    def lines(self) -> list:
+        """ The log as text, one line per retained event. """
+        events = self.table()
+        lines = ['# Time (in days) : message.']
+
+        for k, (t, code, h, v) in enumerate(zip(events['time'].tolist(), events['code'].tolist(), events['timestep'].tolist(), events['value'].tolist())):
+            if k == self.head and self.omitted:
+                lines.append(f'# ... {self.omitted} events omitted ...')
+
+            if code == FINISHED:
+                lines.append(f'Simulation terminated after {int(v)} loop iterations (see sim.{self.source} function).')
+            else:
+                lines.append(TEMPLATES[code](t, h, v))
+
+        return lines
+
+    def state(self) -> dict:
+        """ The log as a dictionary of arrays (for checkpoints, see restore). """
+        return {'total' : np.array(self.total), 'times' : self.times, 'codes' : self.codes,
+                'timesteps' : self.timesteps, 'values' : self.values}
+
+    def restore(self, state) -> None:
+        """ Restores the log saved by state (same limit). """
+        self.total = int(state['total'])
+        self.times, self.codes = state['times'].copy(), state['codes'].copy()
+        self.timesteps, self.values = state['timesteps'].copy(), state['values'].copy()
+        self.capacity = len(self.times)
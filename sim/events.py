@@ -0,0 +1,96 @@
+# Event location for the numerical integration code.
+#
+# The ODE model switches a reaction off as soon as its ∆G reaches 0,
+# so its right-hand side jumps whenever some ∆G changes sign. Stepping
+# across such a jump makes the error estimate meaningless, and the
+# dead-end state (all ∆G >= DELTA_G_BOUND) is only seen at step ends.
+#
+# Both kinds of events are located by root finding along the linear
+# interpolant C + theta * flux (0 <= theta <= 1) of an accepted step,
+# which keeps all concentrations positive. execute then cuts the step
+# at the first event and restarts the solver from there.
+
+import numpy as np
+
+from .config.general import DELTA_G_BOUND, EVENT_TOLERANCE
+
+# Maximum number of iterations of the root finder
+EVENT_ITERATIONS = 60
+
+def illinois(g, a, b, ga, gb, xtol, max_iterations=EVENT_ITERATIONS) -> float:
+    """
+    Locates a sign change of the scalar function g in [a, b]
+    with the Illinois (modified regula falsi) method.
+
+    g(a) and g(b) must lie on different sides of 0 (g >= 0 counts as
+    the non-negative side). Returns the end of the final bracket on the
+    side of b, so that the event has already happened at the returned point.
+
+    Source: [Dowell & Jarratt (1971) - A modified regula falsi method for computing the root of an equation. BIT 11: 168-174]
+    """
+    side_b = gb >= 0
+    retained = None   # end of the bracket kept in the last iteration
+
+    for _ in range(max_iterations):
+        if b - a <= xtol:
+            break
+
+        c = b - gb * (b - a) / (gb - ga)
+
+        # secant falls outside the bracket (e.g. g(b) == 0): bisect instead
+        if not a < c < b:
+            c = 0.5 * (a + b)
+
+        gc = g(c)
+
+        if (gc >= 0) == side_b:
+            b, gb = c, gc
+            if retained == 'a':
+                ga *= 0.5
+            retained = 'a'
+        else:
+            a, ga = c, gc
+            if retained == 'b':
+                gb *= 0.5
+            retained = 'b'
+
+    return b
+
+def locate_event(gibbs, C, flux, h, deltaG, new_deltaG, bound=DELTA_G_BOUND, tolerance=EVENT_TOLERANCE) -> tuple:
+    """
+    Finds the first event within a step from C to C + flux of size h.
+
+    Events are reactions whose ∆G changes sign over the step (switching
+    the reaction on or off), and the dead-end state (all ∆G >= bound).
+
+    gibbs - function: composition -> ∆G vector (e.g. model.GibbsKernel).
+    deltaG, new_deltaG - ∆G at the start and the end of the step.
+    tolerance - accuracy of the event time (in days).
+
+    Returns (theta, n): the event happens at C + theta * flux, and n is the
+    index of the reaction (None for the dead-end state). Returns None if
+    there is no event within the step.
+
+    Sign changes within tolerance of the start of the step are ignored:
+    a reaction whose ∆G stays at 0 (because other reactions keep pushing
+    it back) would otherwise cut every step down to nothing.
+    """
+    events = [(n, lambda theta, n=n : gibbs(C + theta * flux)[n], deltaG[n], new_deltaG[n])
+              for n in np.flatnonzero((deltaG >= 0) != (new_deltaG >= 0))]
+
+    if not (deltaG >= bound).all() and (new_deltaG >= bound).all():
+        events.append((None, lambda theta : np.min(gibbs(C + theta * flux)) - bound,
+                       np.min(deltaG) - bound, np.min(new_deltaG) - bound))
+
+    first = None
+
+    for n, g, ga, gb in events:
+        theta = illinois(g, 0.0, 1.0, ga, gb, xtol=tolerance / h)
+
+        if theta * h <= tolerance:
+            continue
+
+        if first is None or theta < first[0]:
+            first = (theta, n)
+
+    return first
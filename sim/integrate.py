@@ -4,13 +4,26 @@
 import numpy as np
 
 from . import ornbeck
-from .model import ode_model
+from .model import RateKernel, GibbsKernel
+from .solvers import SOLVERS, calculate_flux, resolve_control
+from .control import ToleranceControl
+from .events import locate_event
+from .record import Trajectory, EndState, parse_policy
+from .checkpoint import fingerprint, seed_identity, save_checkpoint, load_checkpoint, remove_checkpoint
+from .stats import RunStats, COUNTERS
+from . import eventlog
+from .eventlog import EventLog
 
-from .config.general import RUNTIME, TEMPERATURE, MAX_ITERATIONS, E_MIN, E_MAX, DELTA_G_BOUND
+from .config.general import RUNTIME, TEMPERATURE, MAX_ITERATIONS, E_MIN, E_MAX, DELTA_G_BOUND, RTOL, ATOL, CHECKPOINT_INTERVAL
+
+from time import monotonic, perf_counter
 
 def calculate_gibbs(C, S, F, T):
     """
     Calculate Gibbs free energy vector ∆G.
+
+    C may also be an (R x M) matrix of compositions,
+    in which case an (R x N) matrix is returned.
     """
     R = 8.3e-3 # universal gas constant
     molar_C = C * 10e-6
@@ -22,31 +35,11 @@ def calculate_gibbs(C, S, F, T):
     if (molar_C <= 0).any():
         molar_C[molar_C <= 0] = 1e-37
 
-    return S.transpose() @ (F + R * T * np.log(molar_C))
-
-def calculate_flux(t, h, C, f) -> tuple:
-    """
-    Uses a 5th order Runge-Kutta-Fehlberg method to determine
-    the net metabolite flux at time t. Also returns the error bound.
-
-    Source: [Cheney & Kincaid (2008) - Numerical Mathematics and Computing Sixth Edition pp. 450-453]
-    """
-    k1 = h * f(t, C)
-    k2 = h * f(t + 0.25 * h, C + 0.25 * k1)
-    k3 = h * f(t + 0.375 * h, C + 0.09375 * k1 + 0.28125 * k2)
-    k4 = h * f(t + 12./13. * h, C + 1932./2197. * k1 + (-7200./2197.) * k2 + 7296./2197 * k3) 
-    k5 = h * f(t + h, C + 439./216. * k1 + (-8.) * k2 + (3680./513.) * k3 + (-845./4104.) * k4)
-    k6 = h * f(t + 0.5 * h, C + (-8./27.) * k1 + 2. * k2 + (-3544./2565.) * k3 + (-845./4104.) * k4 + (-0.275) * k5)
-
-    C_RK4_flux = (25./216.) * k1 + (1408./2565.) * k3 + (2197./4104.) * k4 + (-0.2) * k5
-    C_RK5_flux = (16./135.) * k1 + (6656./12825.) * k3 + (28561./56430.) * k4 + (-0.18) * k5 + (2./55.) * k6
-
-    # Error is determined as the euclidean distance between estimates.
-    error = np.linalg.norm(C_RK5_flux - C_RK4_flux)
+    return (S.transpose() @ (F + R * T * np.log(molar_C)).transpose()).transpose()
 
-    return C_RK5_flux, error
-
-def execute(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=0.01, random_seed=None) -> object:
+def execute(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=0.01, random_seed=None, spill=None, record=None, solver='rkf45',
+            control=None, rtol=RTOL, atol=ATOL, events=False, temperature=TEMPERATURE, checkpoint=None, checkpoint_interval=CHECKPOINT_INTERVAL,
+            timers=False, state=None, keep_spill=False, resume=False) -> object:
     """ 
     Executes a simulation to
     to find the Dead-End of a given ODE
@@ -61,33 +54,80 @@ def execute(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=0.0
     deltaGf0 - vector of free energies.
     stoich_mats - three stoichiometric matrices from sim_config file.
     ou_parameters - list of parameter vectors for reaction kinetics
+    random_seed - integer, numpy SeedSequence or Generator for the Ornstein-Uhlenbeck process.
+    spill - directory (or True for the temp directory) to spill the recorded time series to.
+            Bounds memory on long runs; see record.Trajectory.
+    keep_spill - leave the spilled files on disk, for the caller to remove (see record.Trajectory.finish).
+    record - recording policy: 'all' (default), 'every:K', 'grid:DT', 'change:X' or 'end'.
+             The integrator always steps at full resolution; see record.parse_policy.
+    solver - single-step method: 'rkf45' (explicit Fehlberg), 'dopri5' (explicit Dormand-Prince
+             with stage reuse) or 'rosenbrock' (implicit, for stiff networks). See solvers.py.
+    control - step-size controller: 'bounds' (E_MIN/E_MAX) or 'tolerance' (rtol/atol). See control.py.
+              By default CONTROL, or the controller the solver needs (see solvers.resolve_control).
+    rtol, atol - relative and absolute (uM, scalar or per metabolite) tolerances for the 'tolerance' controller.
+    events - cut steps at sign changes of ∆G and at the dead-end state, located by
+             root finding (see events.py), so that the solver is restarted at each switch.
+             Needs the 'tolerance' controller (raises ValueError otherwise).
+    temperature - temperature (K) for the Gibbs free energies.
+    checkpoint - file to save the state of the run to, every checkpoint_interval seconds (see checkpoint.py).
+                 The file is removed when the run finishes.
+    resume - if the checkpoint file holds a checkpoint of a run with the same inputs,
+             continue from there with bit-identical results (otherwise it is overwritten).
+    timers - also measure the time spent in every phase of the integrator (see stats.py).
+    state - state of a run to continue from, in the form saved in checkpoints
+            (used by execute_ensemble to hand over its last running run).
 
     output:
     - - - - - - - -
-    sol - dictionary containing time-series data for multiple variables.
+    sol - dictionary containing time-series data for multiple variables,
+          and the statistics of the run in sol['stats'] (see stats.RunStats.finish).
     """
 
     stoich_mat_full, stoich_mat_lim, stoich_mat_nconst = stoich_mats
     M, N = stoich_mat_full.shape
 
-    sol = {'time' : [],
-           'composition' : [],
-           'deltaG' : [],
-           'stochastic process value' : [],
-           'net metabolite flux' : [],
-           'messages' : []}
-    
+    # raises ValueError for solvers that do not work with the given controller
+    control = resolve_control(solver, control)
+
+    # The 'bounds' controller never grows the timestep while some concentration is
+    # below 1 uM (see E_MIN), so cut steps only add iterations near the dead end.
+    if events and control != 'tolerance':
+        raise ValueError("Event location needs the 'tolerance' controller.")
+
+    trajectory = Trajectory({'time' : 0,
+                             'composition' : M,
+                             'deltaG' : N,
+                             'stochastic process value' : N,
+                             'net metabolite flux' : M}, spill=spill, policy=parse_policy(record))
+
+    sol = {}
+
+    # notable events, rendered to text only on output (see eventlog.py)
+    log = EventLog('execute')
+
     composition = initialC.copy()
 
     time = 0
 
+    # Counters (and optional phase timers) of this run
+    stats = RunStats(timers=timers)
+
     # Initiate the Ornstein-Uhlenbeck process
     weeks = int(RUNTIME // 7)
     ornbeck_times = np.linspace(0, (weeks + 1) * 7.0, weeks + 1)
 
+    if checkpoint is not None:
+        # checkpoints are only restored by runs with the same inputs
+        key = fingerprint(initialC, deltaGf0, *stoich_mats, *ou_parameters, default_timestep, seed_identity(random_seed),
+                          record if isinstance(record, str) or record is None else type(record).__name__,
+                          solver, control, rtol, np.asarray(atol, dtype=np.double), events, temperature, RUNTIME, MAX_ITERATIONS)
+
+    # Each run draws from its own random stream (see ornbeck.calibrate)
+    rng = np.random.default_rng(random_seed)
+
     typical_rates, typical_decay, typical_std = ou_parameters
-    [means, sigmas, decays, starts] = ornbeck.calibrate(stoich_mat_lim, typical_rates, typical_decay, typical_std, typical_con=1.0, random_seed=random_seed)
-    ornbeck_spline = ornbeck.spline(ornbeck_times, means, sigmas, decays, starts)
+    [means, sigmas, decays, starts] = ornbeck.calibrate(stoich_mat_lim, typical_rates, typical_decay, typical_std, typical_con=1.0, random_seed=rng)
+    ornbeck_table = ornbeck.spline(ornbeck_times, means, sigmas, decays, starts, rng=rng)
 
     # Boolean flag: indicates whether a dead-end state has been reached
     success = False
@@ -95,10 +135,45 @@ def execute(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=0.0
     # Set timestep to default
     timestep = default_timestep
 
-    ode_function = lambda t, C : ode_model(t, C, stoich_mats, calculate_gibbs(C, stoich_mat_full, deltaGf0, TEMPERATURE), ornbeck_vector)
+    # Compile the network once - see model.ode_model and calculate_gibbs for the reference implementations.
+    rate_kernel = RateKernel(stoich_mats)
+    gibbs = GibbsKernel(stoich_mats, deltaGf0, temperature)
+
+    deltaG = gibbs.start(composition)
+
+    # every evaluation of a kernel is counted (see stats.py)
+    evaluate_rates = stats.instrument('rhs', rate_kernel)
+    evaluate_jacobian = stats.instrument('jacobian', rate_kernel.jacobian)
+    evaluate_gibbs = stats.instrument('gibbs', gibbs)
+
+    stepper = SOLVERS[solver]()
+
+    if stepper.fsal:
+        # stages are reused between steps, so the rates must follow the stage times
+        stage_rates = lambda t : evaluate_ornbeck(t)
+    else:
+        stage_rates = lambda t : ornbeck_vector
+
+    # dCdt at the start of the step - shared by the first stage of every attempt
+    start_dCdt = None
+
+    def ode_function(t, C):
+        nonlocal start_dCdt
 
-    sol['messages'].append('# Time (in days) : message.')
-    sol['messages'].append(f'{time:.4f}: simulation starts with timestep {timestep}.')
+        if C is not composition:
+            return evaluate_rates(t, C, evaluate_gibbs(C), stage_rates(t))
+
+        if start_dCdt is None:
+            start_dCdt = evaluate_rates(t, C, deltaG, stage_rates(t))
+
+        return start_dCdt
+
+    jacobian_function = lambda t, C : evaluate_jacobian(t, C, deltaG if C is composition else evaluate_gibbs(C), ornbeck_vector)
+
+    if control == 'tolerance':
+        controller = ToleranceControl(stepper.error_order, rtol=rtol, atol=atol, max_scale=stepper.max_scale)
+
+    log.add(eventlog.START, time, timestep)
 
     # Counts how many times we have changed the timestep without moving forward
     loop_count = 0
@@ -106,83 +181,437 @@ def execute(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=0.0
     # Counts total iterations
     iter = 0
 
+    # Indicates whether the last attempted step was rejected
+    rejected = False
+
+    if checkpoint is not None and resume and state is None:
+        state = load_checkpoint(checkpoint, key)
+
+    try:
+        if state is not None:
+            trajectory.restore({name[len('trajectory_'):] : value for name, value in state.items() if name.startswith('trajectory_')})
+    except OSError:
+        # spilled rows are gone - start over
+        state = None
+
+    if state is not None:
+        time = state['time'].item()
+        timestep = state['timestep'].item()
+        iter = state['iter'].item()
+        composition = state['composition']
+        deltaG = state['deltaG']
+        log.restore({name[len('log_'):] : value for name, value in state.items() if name.startswith('log_')})
+
+        ornbeck_table = ornbeck.RateTable(ornbeck_times, state['knots'])
+        stepper.restore({name[len('stepper_'):] : value for name, value in state.items() if name.startswith('stepper_')})
+        stats.restore({name[len('stats_'):] : value for name, value in state.items() if name.startswith('stats_')})
+
+    if checkpoint is not None:
+        saved_at = monotonic()
+
+    evaluate_ornbeck = stats.instrument('ornbeck', ornbeck_table)
+
     while time <= RUNTIME:
 
         iter += 1
 
-        deltaG = calculate_gibbs(composition, stoich_mat_full, deltaGf0, TEMPERATURE)
-        ornbeck_vector = ornbeck_spline(time)
+        ornbeck_vector = evaluate_ornbeck(time)
 
-        # Fehlberg scheme
-        flux, error = calculate_flux(time, timestep, composition, ode_function)
+        # Fehlberg scheme (or any other single-step method, see solvers.py)
+        flux, error = stepper.step(time, timestep, composition, ode_function, jacobian_function)
 
         # Adaptive timestep
         new_composition = composition + flux
 
         if iter > MAX_ITERATIONS:
-            sol['messages'].append(f'{time:.4f}: simulation terminated after {iter} iterations.')
+            log.add(eventlog.TERMINATED_ITERATIONS, time, timestep, iter)
             break
 
         # This should never happen
         if np.isnan(new_composition).any():
             timestep /= 2.0
-            sol['messages'].append(f'{time:.4f}: timestep halved to {timestep} due to NaN concentrations.')
+            rejected = True
+            stats.counts['rejected_nan'] += 1
+            log.add(eventlog.HALVED_NAN, time, timestep)
             continue
 
         if (new_composition <= 0).any():
             timestep /= 2.0
-            sol['messages'].append(f'{time:.4f}: timestep halved to {timestep} due to negative concentrations.')
+            rejected = True
+            stats.counts['rejected_negative'] += 1
+            log.add(eventlog.HALVED_NEGATIVE, time, timestep)
             continue
 
+        # Timestep for the step after this one
+        next_timestep = timestep
+
+        if control == 'tolerance':
+            # Error scaled by the tolerance of every metabolite - accept if <= 1
+            error = controller.error_norm(composition, new_composition, error)
+        else:
+            # Error is determined as the euclidean distance between estimates.
+            error = np.linalg.norm(error)
+
+        if control == 'tolerance':
+            if error > 1.0:
+                timestep = controller.next_timestep(timestep, error)
+                rejected = True
+                stats.counts['rejected_tolerance'] += 1
+                log.add(eventlog.REDUCED_TOLERANCE, time, timestep, error)
+                continue
+
+            next_timestep = controller.next_timestep(timestep, error)
+
+            # Do not step past the depletion of any metabolite
+            next_timestep = min(next_timestep, max(timestep, controller.depletion_timestep(timestep, new_composition, flux)))
+
+            # Never grow the timestep right after a rejected step
+            if rejected:
+                next_timestep = min(next_timestep, timestep)
+
         # If this occurs, we are stuck in a loop
         # where the simulation is halving and doubling
         # the time step over and over again.
         #
         # To remedy this, we simply move forward without adjusting the timestep.
-        if loop_count > 5:
-            sol['messages'].append(f'{time:.4f} : excessive loop count detected. Continuing with timestep {timestep}.')
+        elif loop_count > 5:
+            stats.counts['loop_escapes'] += 1
+            log.add(eventlog.LOOP_ESCAPE, time, timestep)
 
         # These error bounds can be interpreted as:
         # E_MIN to E_MAX uM uncertainty in predictions.
         elif error > E_MAX:
             timestep /= 2.0
             loop_count += 1
-            sol['messages'].append(f'{time:.4f} : timestep halved to {timestep} due to error over {E_MAX}.')
+            stats.counts['rejected_error_max'] += 1
+            log.add(eventlog.HALVED_ERROR, time, timestep)
             continue
         elif (error < E_MIN and (new_composition > 1.0).all()):
             timestep *= 2.0
             loop_count += 1
-            sol['messages'].append(f'{time:.4f} : timestep doubled to {timestep} due to error under {E_MIN}.')
+            stats.counts['rejected_error_min'] += 1
+            log.add(eventlog.DOUBLED_ERROR, time, timestep)
             continue
 
         # Abort - avoids an infinite loop
         if timestep == 0:
-            sol['messages'].append(f'{time:.4f}: simulation terminated early with timestep {timestep}.')
+            log.add(eventlog.TERMINATED_TIMESTEP, time, timestep)
             break
 
+        new_deltaG = evaluate_gibbs(new_composition)
+
+        # Cut the step at the first reaction switch (or the dead-end state) within it
+        if events:
+            event = locate_event(evaluate_gibbs, composition, flux, timestep, deltaG, new_deltaG)
+
+            if event is not None:
+                theta, n = event
+                flux = theta * flux
+                new_composition = composition + flux
+                new_deltaG = evaluate_gibbs(new_composition)
+                timestep *= theta
+                stats.counts['events'] += 1
+
+                # next_timestep was proposed for the whole step - the cut does not shrink the next one
+
+                # the right-hand side changes here - no stages may be reused
+                stepper.reset()
+
+                if n is None:
+                    log.add(eventlog.DEAD_END_LOCATED, time, timestep)
+                else:
+                    log.add(eventlog.REACTION_SWITCH, time, timestep, n)
+
         # Record current values
-        sol['time'].append(time)
-        sol['composition'].append(composition)
-        sol['deltaG'].append(deltaG)
-        sol['stochastic process value'].append(ornbeck_vector)
-        sol['net metabolite flux'].append(flux)
+        trajectory.offer(time, composition, deltaG, ornbeck_vector, flux)
 
         # Dead-end state condition:
         if (deltaG >= DELTA_G_BOUND).all():
-            sol['messages'].append(f'{time:.4f}: simulation terminated successfully with timestep {timestep}.')
+            log.add(eventlog.SUCCESS, time, timestep)
             success = True
             break
 
         composition = new_composition
         time += timestep
+        timestep = next_timestep
         loop_count = 0
+        rejected = False
+
+        deltaG = new_deltaG
+        start_dCdt = None
+
+        stepper.accept()
+        stats.counts['accepted'] += 1
+
+        if checkpoint is not None and monotonic() - saved_at >= checkpoint_interval:
+            state = {'time' : np.array(time), 'timestep' : np.array(timestep), 'iter' : np.array(iter),
+                     'composition' : composition, 'deltaG' : deltaG, 'knots' : ornbeck_table.knots}
+            state.update({f'log_{name}' : value for name, value in log.state().items()})
+            state.update({f'stepper_{name}' : value for name, value in stepper.state().items()})
+            state.update({f'trajectory_{name}' : value for name, value in trajectory.state().items()})
+            state.update({f'stats_{name}' : value for name, value in stats.state().items()})
+
+            save_checkpoint(checkpoint, key, state)
+            saved_at = monotonic()
     
     if success == False:
-        sol['messages'].append(f'{time:.4f}: simulation terminated unsuccessfully with timestep {timestep}.')
+        log.add(eventlog.FAILURE, time, timestep)
 
-    sol['messages'].append(f'Simulation terminated after {iter} loop iterations (see sim.execute function).')
+    log.add(eventlog.FINISHED, time, timestep, iter)
+
+    sol.update(trajectory.finish(keep=keep_spill))
+    sol['log'] = log
+
+    stats.counts['iterations'] = iter
+    sol['stats'] = stats.finish()
+
+    if checkpoint is not None:
+        remove_checkpoint(checkpoint)
 
-    for data in sol:
-        sol[data] = np.array(sol[data])
-    
     return sol, success
+
+def execute_ensemble(initialC, deltaGf0, stoich_mats, ou_parameters, default_timestep=0.01, random_seeds=None, record=None, temperature=TEMPERATURE) -> tuple:
+    """
+    Ensemble version of execute: advances R runs of the same network at once.
+
+    The state of the ensemble is an (R x M) composition matrix and an
+    (R x N) matrix of Ornstein-Uhlenbeck rates. Fehlberg stages, Gibbs
+    energies and dead-end checks are evaluated for all runs in single
+    array operations. Every run keeps its own timestep, loop count and
+    iteration count, and is retired from the batch when it finishes, so
+    each run follows the same adaptive scheme as in execute (up to round-off).
+
+    Once a single run is left, batching no longer pays for its overhead:
+    that run is handed over to execute (see its state argument) at its next
+    accepted step, and finished there.
+
+    input:
+    - - - - - - - -
+    initialC - (R x M) matrix of starting concentrations, one row per run.
+    deltaGf0 - vector of free energies.
+    stoich_mats - three stoichiometric matrices from sim_config file.
+    ou_parameters - list of parameter vectors for reaction kinetics
+    random_seeds - optional list of R random seeds (one per run).
+    record - recording policy of every run, as a specification string (see record.parse_policy).
+             With 'end', only the last accepted step of every run is kept, without any per-run work.
+    temperature - temperature (K) for the Gibbs free energies.
+
+    output:
+    - - - - - - - -
+    sols - list of R dictionaries with the same layout as in execute.
+    successes - boolean array, True for runs that reached a dead-end state.
+    """
+
+    stoich_mat_full, stoich_mat_lim, stoich_mat_nconst = stoich_mats
+    M, N = stoich_mat_full.shape
+
+    composition = np.array(initialC, dtype=np.double, ndmin=2)
+    R = composition.shape[0]
+
+    # One counter per run (see stats.py) - the wall time is that of the whole ensemble
+    started = perf_counter()
+    counts = {name : np.zeros(R, dtype=int) for name in COUNTERS}
+
+    # Initiate one Ornstein-Uhlenbeck process per run
+    weeks = int(RUNTIME // 7)
+    ornbeck_times = np.linspace(0, (weeks + 1) * 7.0, weeks + 1)
+
+    typical_rates, typical_decay, typical_std = ou_parameters
+
+    if random_seeds is None:
+        # a single random stream: generate the whole (R x N x T) ensemble in bulk
+        rng = np.random.default_rng()
+        [means, sigmas, decays, starts] = ornbeck.calibrate(stoich_mat_lim, typical_rates, typical_decay, typical_std, typical_con=1.0, random_seed=rng, runs=R)
+        ornbeck_knots = ornbeck.knot_matrix(ornbeck_times, means, sigmas, decays, starts, rng=rng)
+    else:
+        # one random stream per run, exactly as in execute
+        ornbeck_knots = np.zeros(shape=(R, N, len(ornbeck_times)), dtype=np.double)
+        for r in range(R):
+            rng = np.random.default_rng(random_seeds[r])
+            [means, sigmas, decays, starts] = ornbeck.calibrate(stoich_mat_lim, typical_rates, typical_decay, typical_std, typical_con=1.0, random_seed=rng)
+            ornbeck_knots[r] = ornbeck.knot_matrix(ornbeck_times, means, sigmas, decays, starts, rng=rng)
+
+    # evaluates the rates of each run at its own time
+    ornbeck_table = ornbeck.RateTable(ornbeck_times, ornbeck_knots)
+
+    rate_kernel = RateKernel(stoich_mats)
+    gibbs = GibbsKernel(stoich_mats, deltaGf0, temperature)
+    gibbs.start(composition)
+
+    time = np.zeros(R)
+    timestep = np.full(R, default_timestep, dtype=np.double)
+    loop_count = np.zeros(R, dtype=int)
+    iters = np.zeros(R, dtype=int)
+
+    success = np.zeros(R, dtype=bool)
+    running = np.ones(R, dtype=bool)
+
+    logs = [EventLog('execute_ensemble') for r in range(R)]
+    for log in logs:
+        log.add(eventlog.START, 0.0, default_timestep)
+
+    fields = {'time' : 0, 'composition' : M, 'deltaG' : N, 'stochastic process value' : N, 'net metabolite flux' : M}
+    end_only = isinstance(parse_policy(record), EndState)
+
+    if end_only:
+        # the last accepted step of every run, overwritten batch-wise
+        last = {field : np.full((R,) if width == 0 else (R, width), np.nan) for field, width in fields.items()}
+        recorded = np.zeros(R, dtype=bool)
+    else:
+        # one trajectory per run - buffers start small and double as needed
+        trajectories = [Trajectory(fields, capacity=64, policy=parse_policy(record)) for r in range(R)]
+
+    def trajectory_of(r):
+        """ Trajectory of run r (rebuilt from its last accepted step, with end_only). """
+        if not end_only:
+            return trajectories[r]
+
+        trajectory = Trajectory(fields, capacity=1, policy=EndState())
+        if recorded[r]:
+            trajectory.offer(*[last[field][r] for field in fields])
+
+        return trajectory
+
+    # (sol, success) of the runs handed over to execute
+    handed_over = {}
+
+    def log(mask, runs, code, values=None):
+        for r in runs[mask]:
+            logs[r].add(code, time[r], timestep[r], np.nan if values is None else values[r])
+
+    while running.any():
+
+        runs = np.flatnonzero(running)
+        iters[runs] += 1
+
+        C = composition[runs]
+        h = timestep[runs]
+
+        deltaG = gibbs(C, runs)
+        ornbeck_vector = ornbeck_table(time[runs], runs)
+
+        counts['gibbs_evaluations'][runs] += 1
+        counts['ornbeck_evaluations'][runs] += 1
+
+        def ode_function(t, C_stage):
+            counts['rhs_evaluations'][runs] += 1
+
+            # the first stage is evaluated at C itself
+            if C_stage is C:
+                return rate_kernel(t, C_stage, deltaG, ornbeck_vector)
+
+            counts['gibbs_evaluations'][runs] += 1
+            return rate_kernel(t, C_stage, gibbs(C_stage, runs), ornbeck_vector)
+
+        # Fehlberg scheme (one row per run)
+        flux, error = calculate_flux(time[runs][:, None], h[:, None], C, ode_function)
+
+        new_composition = C + flux
+
+        # see execute for the meaning of each branch
+        exhausted = iters[runs] > MAX_ITERATIONS
+        nan = ~exhausted & np.isnan(new_composition).any(axis=1)
+        negative = ~exhausted & ~nan & (new_composition <= 0).any(axis=1)
+        proceed = ~exhausted & ~nan & ~negative
+
+        escape = proceed & (loop_count[runs] > 5)
+        too_large = proceed & ~escape & (error > E_MAX)
+        too_small = proceed & ~escape & ~too_large & (error < E_MIN) & (new_composition > 1.0).all(axis=1)
+
+        h[nan | negative | too_large] /= 2.0
+        h[too_small] *= 2.0
+        timestep[runs] = h
+        loop_count[runs[too_large | too_small]] += 1
+
+        for name, mask in [('rejected_nan', nan), ('rejected_negative', negative), ('rejected_error_max', too_large),
+                           ('rejected_error_min', too_small), ('loop_escapes', escape)]:
+            counts[name][runs[mask]] += 1
+
+        log(exhausted, runs, eventlog.TERMINATED_ITERATIONS, iters)
+        log(nan, runs, eventlog.HALVED_NAN)
+        log(negative, runs, eventlog.HALVED_NEGATIVE)
+        log(escape, runs, eventlog.LOOP_ESCAPE)
+        log(too_large, runs, eventlog.HALVED_ERROR)
+        log(too_small, runs, eventlog.DOUBLED_ERROR)
+
+        # Abort - avoids an infinite loop
+        stalled = proceed & ~too_large & ~too_small & (h == 0)
+        log(stalled, runs, eventlog.TERMINATED_TIMESTEP)
+
+        accepted = proceed & ~too_large & ~too_small & ~stalled
+
+        # Record current values
+        kept = runs[accepted]
+
+        if end_only:
+            for field, values in zip(fields, [time[kept], C[accepted], deltaG[accepted], ornbeck_vector[accepted], flux[accepted]]):
+                last[field][kept] = values
+            recorded[kept] = True
+        else:
+            for r, k in zip(kept, np.flatnonzero(accepted)):
+                trajectories[r].offer(time[r], C[k], deltaG[k], ornbeck_vector[k], flux[k])
+
+        # Dead-end state condition:
+        dead_end = accepted & (deltaG >= DELTA_G_BOUND).all(axis=1)
+        success[runs[dead_end]] = True
+        log(dead_end, runs, eventlog.SUCCESS)
+
+        advance = accepted & ~dead_end
+        composition[runs[advance]] = new_composition[advance]
+        time[runs[advance]] += h[advance]
+        loop_count[runs[advance]] = 0
+        counts['accepted'][runs[advance]] += 1
+
+        # Retire finished runs from the batch
+        running[runs[exhausted | stalled | dead_end]] = False
+        running[time > RUNTIME] = False
+
+        # Hand the last running run over to execute, right after an accepted step
+        # (where execute saves its checkpoints, so the state has the same form)
+        if running.sum() == 1 and running[runs[advance]].any():
+            r = np.flatnonzero(running)[0]
+
+            state = {'time' : np.array(time[r]), 'timestep' : np.array(timestep[r]), 'iter' : np.array(iters[r]),
+                     'composition' : composition[r].copy(), 'deltaG' : gibbs(composition[r:r + 1], runs=[r])[0],
+                     'knots' : ornbeck_knots[r]}
+            state.update({f'log_{name}' : value for name, value in logs[r].state().items()})
+            state.update({f'trajectory_{name}' : value for name, value in trajectory_of(r).state().items()})
+            state.update({f'stats_{name}' : np.array(count[r]) for name, count in counts.items()})
+
+            sol, success[r] = execute(composition[r], deltaGf0, stoich_mats, ou_parameters, default_timestep=default_timestep,
+                                      random_seed=None if random_seeds is None else random_seeds[r], record=record,
+                                      solver='rkf45', control='bounds', temperature=temperature, state=state)
+
+            sol['log'].source = 'execute_ensemble'
+            sol['stats']['wall_time'] = perf_counter() - started
+            handed_over[r] = sol
+
+            running[r] = False
+
+    for r in range(R):
+        if r in handed_over:
+            continue
+
+        if success[r] == False:
+            logs[r].add(eventlog.FAILURE, time[r], timestep[r])
+
+        logs[r].add(eventlog.FINISHED, time[r], timestep[r], iters[r])
+
+    counts['iterations'] = iters
+
+    sols = []
+    for r in range(R):
+        if r in handed_over:
+            sols.append(handed_over[r])
+            continue
+
+        sol = trajectory_of(r).finish()
+        sol['log'] = logs[r]
+
+        run_stats = RunStats(started=started)
+        run_stats.counts.update({name : int(count[r]) for name, count in counts.items()})
+        sol['stats'] = run_stats.finish()
+
+        sols.append(sol)
+
+    return sols, success
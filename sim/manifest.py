@@ -0,0 +1,96 @@
+# Run manifest for incremental output (see --incremental in main.py).
+#
+# The manifest is a JSON-lines file with one entry per finished run:
+# its index, random seed, network and parameters, the options it ran
+# with, its status, its end state and its statistics. An entry is
+# appended (and synced to disk) only once all other output of its run
+# has been written, so the manifest is the record of which runs are
+# complete. A line cut off
+# by a crash is ignored when reading; later entries of the same run
+# replace earlier ones.
+
+import numpy as np
+
+import os
+import json
+import hashlib
+
+MANIFEST = 'manifest.jsonl'
+
+# Status of a run: dead-end state reached, or not
+SUCCESS = 'success'
+FAILURE = 'failure'
+
+def network_id(reactions) -> str:
+    """ Short identifier of a network (its reactions). """
+    return hashlib.sha256('\n'.join([str(rxn) for rxn in reactions]).encode()).hexdigest()[:16]
+
+def seed_record(seed) -> dict:
+    """ JSON form of a numpy SeedSequence: the master entropy and the spawn key of the run. """
+    return {'entropy' : int(seed.entropy), 'spawn_key' : [int(k) for k in seed.spawn_key]}
+
+def seed_label(seed) -> str:
+    """ Text form of the random stream of a run (a SeedSequence, or its seed_record): entropy and spawn key, e.g. '1234:0'. """
+    record = seed if isinstance(seed, dict) else seed_record(seed)
+    return ':'.join([str(record['entropy'])] + [str(k) for k in record['spawn_key']])
+
+def read_manifest(path) -> dict:
+    """ Returns a dictionary: run index -> latest complete entry (empty if there is no manifest). """
+    entries = {}
+
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # partial line of an interrupted write
+                    continue
+
+                entries[entry['run']] = entry
+    except OSError:
+        pass
+
+    return entries
+
+def append_entry(path, entry) -> None:
+    """ Appends one entry to the manifest, as a single write that is synced to disk. """
+    line = json.dumps(entry, separators=(',', ':')) + '\n'
+
+    with open(path, 'a') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+def make_entry(run, seed, network, parameters, options, success, end_state, stats=None) -> dict:
+    """
+    Manifest entry of a finished run.
+
+    seed - SeedSequence of the run.
+    network - identifier of the network (see network_id).
+    parameters - dictionary of the inputs that differ between runs (e.g. varied initial concentrations).
+    options - dictionary of the solver options the run was executed with.
+    stats - statistics record of the run (see stats.py).
+    """
+    return {'run' : int(run), 'seed' : seed_record(seed), 'network' : network,
+            'parameters' : parameters, 'options' : options,
+            'status' : SUCCESS if success else FAILURE,
+            'end_state' : np.asarray(end_state, dtype=np.double).tolist(),
+            'stats' : stats}
+
+def is_complete(entry, seed, network, parameters, options, retry=False) -> bool:
+    """
+    True if entry is a finished run with the given seed, network, parameters and options,
+    i.e. the run need not be executed again. With retry, failed runs are never complete.
+    """
+    if entry is None:
+        return False
+
+    if retry and entry['status'] != SUCCESS:
+        return False
+
+    # options as read back from the manifest (e.g. tuples become lists)
+    options = json.loads(json.dumps(options))
+
+    return (entry['seed'] == seed_record(seed) and entry['network'] == network and entry['parameters'] == parameters
+            and entry['options'] == options)
@@ -5,9 +5,14 @@
 
 import numpy as np
 
+from . import sparse
+
 def ode_model(t, C, S_mats, G, X):
     """
     Non-autonomous ODE: returns dCdt.
+
+    Reference implementation - see RateKernel for the
+    compiled version used by the integrator.
     """
     S_full, S_lim, S_nconst = S_mats
     M, N = S_full.shape
@@ -25,3 +30,205 @@ def ode_model(t, C, S_mats, G, X):
                 H[n] *= C[m]
         
     return S_nconst @ H
+
+class RateKernel:
+    """
+    Compiled form of ode_model for a fixed set of stoichiometric matrices.
+
+    The limiting substrates of every reaction are gathered once into
+    a padded (N x K+1) index table into the vector [C, 1.0, X], where K
+    is the largest number of limiting substrates of any reaction.
+    Column 0 points at X[n] and padding points at the 1.0 slot, so that
+
+        H[n] = X[n] * C[lim[n, 1]] * ... * C[lim[n, K]]
+
+    is a single gather followed by a product along the last axis.
+    Factors are multiplied in the same order as in ode_model,
+    so both implementations agree to the last bit.
+
+    Works on a single composition vector (M,) or on a batch of
+    compositions (R x M), in which case G and X must be (R x N).
+
+    S_nconst is kept dense or sparse depending on its density
+    (see sparse.py), so dCdt = S_nconst @ H costs O(nonzeros) on
+    large libraries.
+    """
+
+    def __init__(self, S_mats):
+        S_full, S_lim, S_nconst = S_mats
+        M, N = S_full.shape
+
+        limiting = sparse.column_entries(S_lim, lambda s : s < 0)
+        K = max([len(lim) for lim in limiting], default=0)
+
+        # index M points to the padding slot (always 1.0)
+        lim_index = np.full(shape=(N, K + 1), fill_value=M, dtype=np.intp)
+        lim_index[:, 0] = M + 1 + np.arange(N)
+        for n, lim in enumerate(limiting):
+            lim_index[n, 1:len(lim) + 1] = lim
+
+        self.M = M
+        self.N = N
+        self.lim_index = lim_index
+        self.padding = np.ones(1, dtype=np.double)
+        self.S_nconst = sparse.auto(S_nconst)
+        self.sparse = sparse.issparse(self.S_nconst)
+
+        if not self.sparse:
+            self.S_nconst = np.ascontiguousarray(self.S_nconst, dtype=np.double)
+            self.S_nconst_T = np.ascontiguousarray(self.S_nconst.transpose())
+
+    def rates(self, C, G, X):
+        """ Vector of reaction rates H (or an R x N matrix of them). """
+        if C.ndim == 1:
+            padding = self.padding
+        else:
+            padding = np.ones((C.shape[0], 1), dtype=np.double)
+
+        H = np.concatenate((C, padding, X), axis=-1)[..., self.lim_index].prod(axis=-1)
+
+        # reactions with G >= 0 are switched off
+        H[G >= 0] = 0.0
+
+        return H
+
+    def __call__(self, t, C, G, X):
+        """ Non-autonomous ODE: returns dCdt (same as ode_model). """
+        H = self.rates(C, G, X)
+
+        if H.ndim == 1:
+            return self.S_nconst @ H
+
+        if self.sparse:
+            return (self.S_nconst @ H.transpose()).transpose()
+
+        return H @ self.S_nconst_T
+
+    def jacobian(self, t, C, G, X):
+        """
+        Analytic Jacobian d(dCdt)/dC of the ODE at C (M x M).
+
+        The active-reaction mask (G < 0) is held fixed, so that
+        dH[n]/dC[m] is the product of all other factors of H[n]
+        for every limiting substrate m of reaction n.
+
+        Sparse networks get a sparse Jacobian (CSC), built from
+        the nonzero derivatives only.
+        """
+        factors = np.concatenate((C, self.padding, X))[self.lim_index]
+        rows = np.arange(self.N)
+
+        if self.sparse:
+            # one derivative per limiting substrate - padding slots are left out
+            columns = self.lim_index[:, 1:]
+            others = np.empty(columns.shape, dtype=np.double)
+
+            for k in range(1, self.lim_index.shape[1]):
+                others[:, k - 1] = np.delete(factors, k, axis=1).prod(axis=1)
+
+            others[G >= 0] = 0.0
+
+            keep = columns < self.M
+            dHdC = sparse.from_triplets(np.broadcast_to(rows[:, None], columns.shape)[keep], columns[keep], others[keep],
+                                        shape=(self.N, self.M), sparse=True)
+
+            return (self.S_nconst @ dHdC).tocsc()
+
+        # extra columns collect the (discarded) derivatives w.r.t. padding and X
+        dHdC = np.zeros(shape=(self.N, self.M + 1 + self.N), dtype=np.double)
+
+        for k in range(1, self.lim_index.shape[1]):
+            others = np.delete(factors, k, axis=1).prod(axis=1)
+            dHdC[rows, self.lim_index[:, k]] = others
+
+        dHdC[G >= 0] = 0.0
+
+        return self.S_nconst @ dHdC[:, :self.M]
+
+class GibbsKernel:
+    """
+    Compiled form of integrate.calculate_gibbs for a fixed network.
+
+        ∆G = S^T F + RT S^T log(C)
+
+    S^T F is computed once per network. The log terms of metabolites with
+    constant concentrations (all zero rows of S_nconst) do not change
+    during a run; start folds them into a fixed offset, so that every
+    later evaluation only takes the logarithm of the changing metabolites.
+
+    Works on a single composition vector (M,) or on a batch of
+    compositions (R x M), in which case start must be called with the
+    whole batch and runs selects the rows of the offset to use.
+    Sparse networks (see sparse.py) are multiplied in sparse form.
+
+    For a single composition, the log terms are computed in place in a
+    preallocated vector (one entry per changing metabolite), so that every
+    evaluation allocates nothing but the returned ∆G.
+    """
+
+    def __init__(self, S_mats, F, T):
+        S_full, S_lim, S_nconst = S_mats
+        R = 8.3e-3 # universal gas constant
+
+        variable = sparse.nonzero_rows(S_nconst)
+        F = np.asarray(F, dtype=np.double)
+
+        self.RT = R * T
+        self.variable = np.flatnonzero(variable)
+        self.constant = np.flatnonzero(~variable)
+        self.offset = None
+
+        # log terms of the changing metabolites, overwritten by every evaluation, and the
+        # constant factors as vectors (array-array ufuncs skip the conversion of a Python float)
+        self.log_C = np.empty(len(self.variable), dtype=np.double)
+        self.molar = np.full(len(self.variable), 10e-6)
+        self.RT_vector = np.full(S_full.shape[1], self.RT)
+
+        S_full = sparse.auto(S_full)
+        self.sparse = sparse.issparse(S_full)
+
+        if self.sparse:
+            # transposed (N x M) blocks, multiplied from the left
+            self.SF = S_full.transpose() @ F
+            self.S_variable = sparse.select_rows(S_full, self.variable).transpose().tocsr()
+            self.S_constant = sparse.select_rows(S_full, self.constant).transpose().tocsr()
+        else:
+            self.SF = F @ S_full
+            self.S_variable = np.ascontiguousarray(S_full[self.variable], dtype=np.double)
+            self.S_constant = np.ascontiguousarray(S_full[self.constant], dtype=np.double)
+
+    def product(self, L, S):
+        """ L @ S for the (R x) M vector (or matrix) of log terms L and a block S of S_full. """
+        if self.sparse:
+            return (S @ L.transpose()).transpose()
+
+        return L @ S
+
+    def log_molar(self, C):
+        """ Log of molar concentrations (non-positive values are replaced by 1e-37, as in calculate_gibbs). """
+        molar_C = C * 10e-6
+        return np.log(np.where(molar_C <= 0, 1e-37, molar_C))
+
+    def start(self, C):
+        """ Fixes the constant metabolites at their values in C and returns ∆G at C. """
+        self.offset = self.SF + self.RT * self.product(self.log_molar(C[..., self.constant]), self.S_constant)
+        return self(C)
+
+    def __call__(self, C, runs=None):
+        """ Gibbs free energy vector ∆G at C (or an R x N matrix of them). """
+        if C.ndim > 1:
+            offset = self.offset if runs is None else self.offset[runs]
+            return offset + self.RT * self.product(self.log_molar(C[..., self.variable]), self.S_variable)
+
+        L = np.multiply(C[self.variable], self.molar, out=self.log_C)
+
+        # same replacement of non-positive values as in log_molar
+        if L.size and np.minimum.reduce(L) <= 0:
+            L[L <= 0] = 1e-37
+
+        np.log(L, out=L)
+
+        G = self.product(L, self.S_variable) if self.sparse else L @ self.S_variable
+        G *= self.RT_vector
+        G += self.offset
+        return G
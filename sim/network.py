@@ -0,0 +1,111 @@
+# Immutable reaction network: everything the simulation needs to know
+# about one selection of reactions from the library in sim/config.
+#
+# Networks are built by sim.setup.make_network. They never share state
+# with the library or with each other, so any number of networks (and
+# simulations of them) can coexist in one interpreter.
+
+import numpy as np
+
+from types import MappingProxyType
+
+from .sparse import issparse, nonzero_rows, submatrix
+
+def read_only(array, dtype=None) -> np.array:
+    """ Read-only copy of an array (or of a sparse matrix, see sparse.py). """
+    if issparse(array):
+        array = array.tocsr().astype(dtype or array.dtype, copy=True)
+        for part in [array.data, array.indices, array.indptr]:
+            part.setflags(write=False)
+        return array
+
+    array = np.array(array, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+class Network:
+    """
+    Reaction-centric model of one selection of reactions.
+
+    metabolites, reactions - names of all M species and N reactions.
+    deltaGf0 - (M,) Gibbs free energies of formation (kJ / mol).
+    initialC - (M,) default starting concentrations (uM).
+    stoich_mats - (full, lim, nconst) stoichiometric matrices (M x N),
+                  dense or sparse (see sparse.py).
+    ou_parameters - (typical_rates, typical_decay, typical_std), one value per reaction.
+    metabolite_index, reaction_index - read-only maps: name -> row / column.
+
+    All arrays are read-only, and attributes cannot be reassigned.
+    Unpacks in the same order as the list returned by setup.build_network:
+
+        metabolites, reactions, deltaGf0, initialC, stoich_mats, ou_parameters = network
+    """
+
+    def __init__(self, metabolites, reactions, deltaGf0, initialC, stoich_mats, ou_parameters):
+        set_attribute = super().__setattr__
+
+        set_attribute('metabolites', read_only(metabolites))
+        set_attribute('reactions', read_only(reactions))
+        set_attribute('deltaGf0', read_only(deltaGf0, dtype=np.double))
+        set_attribute('initialC', read_only(initialC, dtype=np.double))
+        set_attribute('stoich_mats', tuple(read_only(S, dtype=np.double) for S in stoich_mats))
+        set_attribute('ou_parameters', tuple(read_only(p, dtype=np.double) for p in ou_parameters))
+
+        set_attribute('metabolite_index', MappingProxyType({met : j for j, met in enumerate(self.metabolites)}))
+        set_attribute('reaction_index', MappingProxyType({rxn : i for i, rxn in enumerate(self.reactions)}))
+
+        M, N = len(self.metabolites), len(self.reactions)
+        for S in self.stoich_mats:
+            assert S.shape == (M, N), "Stoichiometric matrices must have one row per metabolite and one column per reaction!"
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Network objects are immutable!")
+
+    def __delattr__(self, name):
+        raise AttributeError("Network objects are immutable!")
+
+    def __reduce__(self):
+        return (Network, (self.metabolites, self.reactions, self.deltaGf0, self.initialC,
+                          list(self.stoich_mats), list(self.ou_parameters)))
+
+    def __iter__(self):
+        return iter([self.metabolites, self.reactions, self.deltaGf0, self.initialC,
+                     list(self.stoich_mats), list(self.ou_parameters)])
+
+    def __repr__(self) -> str:
+        return f'Network(reactions={self.reactions.tolist()}, metabolites={self.metabolites.tolist()})'
+
+    @property
+    def shape(self) -> tuple:
+        """ (M, N): number of metabolites and reactions. """
+        return self.stoich_mats[0].shape
+
+    def composition(self, concentrations=None) -> np.array:
+        """
+        Writable starting composition: initialC, with the metabolites
+        in concentrations (dictionary: name -> uM) set to other values.
+        """
+        C = self.initialC.copy()
+
+        for met, value in (concentrations or {}).items():
+            if met not in self.metabolite_index:
+                raise KeyError(f"Metabolite '{met}' is not part of this network.")
+            C[self.metabolite_index[met]] = value
+
+        return C
+
+    def subnetwork(self, reactions) -> 'Network':
+        """
+        Network of a subset of the reactions (names or column indices),
+        with the metabolites that take part in them. Same as building the
+        subset from the library, without parsing the config files again.
+        """
+        columns = np.array([self.reaction_index[rxn] if isinstance(rxn, str) else int(rxn) for rxn in reactions], dtype=np.intp)
+        columns = np.unique(columns)
+
+        S_full = self.stoich_mats[0]
+        rows = np.flatnonzero(nonzero_rows(submatrix(S_full, np.arange(S_full.shape[0]), columns)))
+
+        return Network(self.metabolites[rows], self.reactions[columns], self.deltaGf0[rows], self.initialC[rows],
+                       [submatrix(S, rows, columns) for S in self.stoich_mats],
+                       [p[columns] for p in self.ou_parameters])
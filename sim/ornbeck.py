@@ -5,26 +5,120 @@
 # Author: Nathan Malamud
 
 import numpy as np
-from scipy import interpolate
 
-def spline(times, means, sigmas, decays, starts, dt=7.0) -> callable:
+from . import sparse
+
+class RateTable:
+    """
+    Piecewise-linear interpolation of Ornstein-Uhlenbeck knots
+    on a uniform time grid.
+
+    Since the knots are evenly spaced, the segment holding time t is found
+    by index arithmetic instead of a search, and the differences between
+    neighbouring knots are precomputed - evaluating all N rates costs one
+    multiply-add per rate.
+
+    times - uniformly spaced knot times (T,)
+    knots - (N x T) matrix of knot values, or (R x N x T) for an ensemble of R runs.
+
+    Times outside of the grid are extrapolated from the first or last segment.
+    """
+
+    def __init__(self, times, knots):
+        times = np.asarray(times, dtype=np.double)
+        T = len(times)
+
+        assert T >= 2 and knots.shape[-1] == T, "Need at least two knots per process!"
+
+        self.start = times[0]
+        self.spacing = (times[-1] - times[0]) / (T - 1)
+
+        assert np.allclose(np.diff(times), self.spacing), "Knot times must be uniformly spaced!"
+
+        self.times = times
+        self.knots = knots
+        self.ensemble = knots.ndim == 3
+
+        # (T x N) or (T x R x N) - one contiguous row of rates per knot
+        self.table = np.ascontiguousarray(np.moveaxis(knots, -1, 0), dtype=np.double)
+        self.slopes = np.diff(self.table, axis=0)
+        self.last = T - 2
+
+    def __call__(self, t, runs=None) -> np.array:
+        """
+        Rates at time t.
+
+        Single-run tables return (N,) for a scalar t,
+        and (k x N) for a batch of k times (e.g. Runge-Kutta stage times).
+
+        Ensemble tables take one time per run and return (R x N),
+        or (len(runs) x N) if only the given run indices are evaluated.
+        """
+        if np.ndim(t) == 0 and not self.ensemble:
+            s = (t - self.start) / self.spacing
+            i = min(max(int(s // 1), 0), self.last)
+            return self.table[i] + (s - i) * self.slopes[i]
+
+        s = (np.asarray(t, dtype=np.double) - self.start) / self.spacing
+        i = np.clip(np.floor(s).astype(np.intp), 0, self.last)
+        w = (s - i)[..., None]
+
+        if not self.ensemble:
+            return self.table[i] + w * self.slopes[i]
+
+        if runs is None:
+            runs = np.arange(self.table.shape[1])
+
+        return self.table[i, runs] + w * self.slopes[i, runs]
+
+def spline(times, means, sigmas, decays, starts, dt=7.0, rng=None) -> RateTable:
     """ Interpolates Ornstein-Uhlenbeck nodes. """
     assert len(means) == len(sigmas) == len(decays) == len(starts), "Parameter arrays must be the same size!"
 
-    N = len(means)
+    time_series = knot_matrix(times, means, sigmas, decays, starts, dt, rng)
+
+    return RateTable(times, time_series)
+
+def knot_matrix(times, means, sigmas, decays, starts, dt=7.0, rng=None) -> np.array:
+    """
+    Generates the knots of many Ornstein-Uhlenbeck processes at once.
+
+    Parameters are (N,) vectors for the N reactions of one run, or (R x N)
+    matrices for an ensemble of R runs, giving an (N x T) or (R x N x T)
+    matrix of knots. All normal deviates are drawn in bulk from rng,
+    and the recursion (truncated at zero, as in knots) steps
+    through time for all processes together.
+    """
+    rng = np.random.default_rng(rng)
+
+    means, sigmas, decays, starts = np.broadcast_arrays(*[np.asarray(p, dtype=np.double) for p in (means, sigmas, decays, starts)])
     T = len(times)
-    
-    time_series = np.ndarray(shape=(N, T), dtype=np.double)
 
-    for n in range(N):
-        time_series[n] = knots(times, means[n], sigmas[n], decays[n], starts[n], dt)
+    stds = sigmas * np.sqrt(1 - np.exp(-2 * dt * decays))
+    retention = np.exp(-dt * decays)
 
-    vector_spline = interpolate.interp1d(times, time_series, kind='linear')
+    noise = rng.standard_normal(size=(T - 1,) + means.shape)
+    noise *= stds
 
-    return vector_spline
+    # time runs along the first axis while generating, so that every step is contiguous
+    series = np.empty(shape=(T,) + means.shape, dtype=np.double)
+    series[0] = starts
 
-def knots(times, mu, sigma, decay, start, dt) -> np.array:
-    """ Generated by Ornstein-Uhlenbeck process """
+    for t in range(T - 1):
+        new_value = means + (series[t] - means) * retention
+        new_value += noise[t]
+        np.maximum(new_value, 0.0, out=series[t + 1])
+
+    return np.moveaxis(series, 0, -1)
+
+def knots(times, mu, sigma, decay, start, dt, rng=None) -> np.array:
+    """
+    Generated by Ornstein-Uhlenbeck process
+
+    Reference implementation for a single process - see knot_matrix.
+    """
+
+    rng = np.random.default_rng(rng)
 
     NT = len(times)
 
@@ -36,7 +130,7 @@ def knots(times, mu, sigma, decay, start, dt) -> np.array:
 
         std = sigma * np.sqrt(1 - np.exp(-2 * dt * decay))
         expectation = mu + (previous - mu) * np.exp(-dt * decay)
-        new_value = expectation + std * np.random.randn()
+        new_value = expectation + std * rng.standard_normal()
 
         if new_value < 0.0:
             new_value = 0.0
@@ -45,41 +139,38 @@ def knots(times, mu, sigma, decay, start, dt) -> np.array:
 
     return knots
 
-def calibrate(stoich_mat_lim, typical_rates, typical_decay, typical_std, typical_con=1.0, random_seed=None) -> list:
+def calibrate(stoich_mat_lim, typical_rates, typical_decay, typical_std, typical_con=1.0, random_seed=None, runs=None) -> list:
     """
     Calibrates the Ornstein-Uhlenbeck process based on
     simulation parameters from the configuration files.
 
     The value of random_seed will determine the behavior of the Ornstein-Uhlenbeck processes.
+    It may be an integer, a numpy SeedSequence or a numpy Generator (which is then drawn from).
 
     stoich_mat_lim - stoichiometry for limiting substrates (M x N matrix)
     typical_rates - typical range for reaction rates (N x 2 matrix)
     typical_decay - typical range for decay rates (N x 2 matrix)
     typical_std - typical range for standard deviation values (N x 2 matrix)
     typical_con - typical metabolite concentration value (set to 1.0 uM by default)
+    runs - if given, calibrates a whole ensemble: every parameter becomes a (runs x N) matrix.
     """
 
-    if not random_seed is None:
-        np.random.seed(random_seed)
+    rng = np.random.default_rng(random_seed)
 
     M, N = stoich_mat_lim.shape
+    shape = (N,) if runs is None else (runs, N)
+
+    typical_rates = np.asarray(typical_rates, dtype=np.double)
+    typical_decay = np.asarray(typical_decay, dtype=np.double)
+    typical_std = np.asarray(typical_std, dtype=np.double)
+
+    # count number of limiting substrates
+    tot_limiting_substrates = np.array([len(lim) for lim in sparse.column_entries(stoich_mat_lim, lambda s : s < 0)])
 
-    means = np.zeros(N)
-    sigmas = np.zeros(N)
-    decays = np.zeros(N)
-    starts = np.zeros(N)
-
-    for n in range(N):
-        # count number of limiting substrates
-        tot_limiting_substrates = 0
-        for m in range(M):
-            if stoich_mat_lim[m, n] < 0:
-                tot_limiting_substrates += 1
-
-        # formulas provided by Dr. Louca
-        means[n] = np.random.uniform(typical_rates[n][0], typical_rates[n][1]) / (typical_con ** tot_limiting_substrates)
-        sigmas[n] = np.random.uniform(typical_std[n][0]*means[n], typical_std[n][1]*means[n]) 
-        decays[n] = abs(pow(10, np.random.uniform(np.log10(typical_decay[n][0]), np.log10(typical_decay[n][1]))))
-        starts[n] = abs(np.random.normal(means[n], sigmas[n]))
+    # formulas provided by Dr. Louca
+    means = rng.uniform(typical_rates[:, 0], typical_rates[:, 1], size=shape) / (typical_con ** tot_limiting_substrates)
+    sigmas = rng.uniform(typical_std[:, 0] * means, typical_std[:, 1] * means)
+    decays = np.abs(10 ** rng.uniform(np.log10(typical_decay[:, 0]), np.log10(typical_decay[:, 1]), size=shape))
+    starts = np.abs(rng.normal(means, sigmas))
 
     return [means, sigmas, decays, starts]
@@ -1,3 +1,4 @@
 # Parsing script for stoichiometry.txt.
 
-from .parser import parse_file
\ No newline at end of file
+from .parser import parse_file
+from .stream import iter_reactions, ParseError
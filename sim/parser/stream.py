@@ -0,0 +1,160 @@
+# Single-pass streaming parser for stoichiometry files.
+#
+# Lines are split with plain string operations, and each distinct species string
+# (e.g. 'H2O[NL|C]') is only parsed once. Reactions that are not
+# requested (see only) are skipped without parsing their species.
+#
+# Errors do not stop the parser: every malformed line is reported,
+# with its line number, in a single ParseError at the end.
+
+import re
+
+NamePat = re.compile(r"[A-Za-z0-9\{\}\-\+]+")
+FlagPat = re.compile(r"[A-Za-z0-9\{\}\-]+")
+CoeffPat = re.compile(r"-?[0-9]+(\.[0-9]+)?([eE]-?[0-9]+)?")
+
+class ParseError(ValueError):
+    """
+    All errors found in a stoichiometry file.
+
+    errors - list of (line number, message) tuples.
+    """
+
+    def __init__(self, errors, fname=None):
+        self.errors = list(errors)
+        self.fname = fname
+
+        source = f' in {fname}' if fname else ''
+        lines = [f'line {lineno}: {message}' for lineno, message in self.errors]
+        super().__init__(f'{len(self.errors)} error(s){source}:\n' + '\n'.join(lines))
+
+def split_species(species: str) -> tuple:
+    """
+    Splits one species, e.g. '[2]H2O[CONST|NL]', into (2.0, 'H2O', ['CONST', 'NL']).
+    The coefficient (in brackets, 1 by default) and the flags (in brackets, separated by |)
+    are optional; a negative coefficient is replaced by its absolute value. Raises SyntaxError.
+    """
+    text = species
+    coeff = 1.0
+    flags = []
+
+    if text.startswith('['):
+        close = text.find(']')
+        if close < 0 or not CoeffPat.fullmatch(text[1:close]):
+            raise SyntaxError(f"coefficient of species '{species}' not recognized")
+
+        coeff = float(text[1:close])
+        text = text[close + 1:]
+
+        if coeff < 0:
+            print(f"\nWarning: negative coefficient for {species} is not recognized.")
+            print(f"Absolute value of {coeff} will be used instead.")
+            coeff = abs(coeff)
+
+    if text.endswith(']'):
+        start = text.find('[')
+        flags = [flag.strip() for flag in text[start + 1:-1].split('|')]
+
+        if start < 0 or not all(FlagPat.fullmatch(flag) for flag in flags):
+            raise SyntaxError(f"flags of species '{species}' not recognized")
+
+        text = text[:start]
+
+    if not NamePat.fullmatch(text):
+        raise SyntaxError(f"species '{species}' not recognized")
+
+    return coeff, text, flags
+
+def iter_reactions(lines, only=None, errors=None, fname=None):
+    """
+    Generator: yields (reaction name, entry, line number) for every reaction
+    in lines (e.g. an open file), with entries as in parse_file:
+
+        {'species' : {metabolite : {'coeff' : coeff, 'flags' : flags}}}
+
+    Reactant coefficients are negative, product coefficients positive.
+
+    only - optional collection of reaction names: other reactions are skipped.
+    errors - optional list that collects (line number, message) tuples.
+             Without it, a ParseError with all errors is raised once
+             every valid reaction has been yielded.
+    """
+    only = None if only is None else set(only)
+    found = [] if errors is None else errors
+
+    # each distinct species string (and side of a reaction) is only split once
+    known_species = {}
+    known_sides = {}
+
+    def split_side(side, sign, lineno, name):
+        """ Parses one side of a reaction: a tuple of (metabolite, coeff, flags), or None after errors. """
+        parsed = []
+
+        for species in side.split(','):
+            species = species.strip()
+
+            if species not in known_species:
+                try:
+                    known_species[species] = split_species(species)
+                except SyntaxError as error:
+                    known_species[species] = error.msg
+
+            if isinstance(known_species[species], str):
+                found.append((lineno, f'{known_species[species]} in reaction {name}'))
+                return None
+
+            coeff, metabolite_name, flags = known_species[species]
+            parsed.append((metabolite_name, sign * coeff, flags))
+
+        return tuple(parsed)
+
+    for lineno, line in enumerate(lines, start=1):
+
+        # comments (and empty lines)
+        if '#' in line or ';' in line:
+            line = line.split('#', 1)[0].split(';', 1)[0]
+
+        head, arrow, products = line.partition('->')
+        if not arrow:
+            if line.strip():
+                found.append((lineno, f'line not recognized (expected "name : reactants -> products") >>> {line.strip()}'))
+            continue
+
+        name, colon, reactants = head.rpartition(':')
+        name = name.strip()
+
+        if not colon or not name or '->' in products or len(name.split()) > 1:
+            found.append((lineno, f'line not recognized (expected "name : reactants -> products") >>> {line.strip()}'))
+            continue
+
+        if only is not None and name not in only:
+            continue
+
+        sides = []
+        for sign, side in ((-1.0, reactants), (+1.0, products)):
+            key = (sign, side)
+            if key not in known_sides:
+                known_sides[key] = split_side(side, sign, lineno, name)
+            elif known_sides[key] is None:
+                # report the error of a known bad side again, for this line
+                split_side(side, sign, lineno, name)
+            sides.append(known_sides[key])
+
+        if None in sides:
+            continue
+
+        # reactants are consumed (negative coefficients), products are produced
+        species_entries = {metabolite_name : {'flags' : list(flags), 'coeff' : coeff}
+                           for metabolite_name, coeff, flags in sides[0] + sides[1]}
+
+        # make sure the same metabolite isn't parsed twice
+        if len(species_entries) < len(sides[0]) + len(sides[1]):
+            names = [metabolite_name for metabolite_name, coeff, flags in sides[0] + sides[1]]
+            repeated = sorted(set([met for met in names if names.count(met) > 1]))
+            found.append((lineno, f'metabolite {", ".join(repeated)} appears more than once in {name}. Be sure to combine like terms!'))
+            continue
+
+        yield name, {'species' : species_entries}, lineno
+
+    if errors is None and found:
+        raise ParseError(found, fname)
@@ -0,0 +1,378 @@
+# Storage for the time series recorded during a simulation.
+
+import numpy as np
+
+import os
+import tempfile
+import contextlib
+
+class Trajectory:
+    """
+    Records one row per accepted step into contiguous buffers.
+
+    In memory, every field is a preallocated (capacity x width) buffer
+    that doubles in size whenever it runs full, so appending is amortized
+    O(1) and finish returns views of the buffers - no conversion copy.
+
+    With spill set (a directory, or True for the system temp directory),
+    every field is written to disk in chunks of chunk_size rows instead.
+    Peak memory is then bounded by one chunk per field, and finish returns
+    read-only memory maps of the spilled files. The files are unlinked
+    as soon as they are mapped, so they disappear with the arrays.
+
+    Rows are offered by the integrator at every accepted step; the
+    recording policy (see parse_policy) decides which of them are kept.
+
+    fields - dictionary: field name -> row width (0 for scalar fields, e.g. time)
+    policy - recording policy, or None to keep every row.
+    """
+
+    def __init__(self, fields, capacity=1024, spill=None, chunk_size=65536, policy=None):
+        self.fields = dict(fields)
+        self.rows = 0
+        self.policy = policy
+
+        self.spill = spill
+        self.files = {}
+
+        if spill:
+            directory = None if spill is True else spill
+            capacity = chunk_size
+
+            for field in self.fields:
+                handle, path = tempfile.mkstemp(prefix='trajectory_', suffix='.bin', dir=directory)
+                self.files[field] = (os.fdopen(handle, 'wb'), path)
+
+        self.capacity = capacity
+        self.buffered = 0   # rows currently held in the buffers
+        self.buffers = {field : np.empty(self.shape(field, capacity), dtype=np.double) for field in self.fields}
+
+    def shape(self, field, rows) -> tuple:
+        width = self.fields[field]
+        return (rows,) if width == 0 else (rows, width)
+
+    def offer(self, *values) -> None:
+        """ Offers one row to the recording policy (same arguments as append). """
+        if self.policy is None:
+            self.append(*values)
+        else:
+            self.policy.offer(self, values)
+
+    def append(self, *values) -> None:
+        """ Appends one row: one value per field, in the order of fields. """
+        if self.buffered == self.capacity:
+            if self.spill:
+                self.flush()
+            else:
+                self.grow()
+
+        row = self.buffered
+        for buffer, value in zip(self.buffers.values(), values):
+            buffer[row] = value
+
+        self.buffered += 1
+        self.rows += 1
+
+    def grow(self) -> None:
+        """ Doubles the capacity of all in-memory buffers. """
+        self.capacity *= 2
+
+        for field, buffer in self.buffers.items():
+            grown = np.empty(self.shape(field, self.capacity), dtype=np.double)
+            grown[:self.buffered] = buffer[:self.buffered]
+            self.buffers[field] = grown
+
+    def flush(self) -> None:
+        """ Writes all buffered rows to the spill files. """
+        for field, buffer in self.buffers.items():
+            f, path = self.files[field]
+            buffer[:self.buffered].tofile(f)
+
+        self.buffered = 0
+
+    def state(self) -> dict:
+        """
+        Everything needed to continue recording in a new Trajectory (see restore),
+        as a dictionary of arrays. In spill mode, the spilled rows stay in their
+        files (which are flushed to disk) and only the file names are saved.
+        """
+        state = {'rows' : np.array(self.rows)}
+
+        if self.spill:
+            self.flush()
+            for f, path in self.files.values():
+                f.flush()
+                os.fsync(f.fileno())
+            state['spill_paths'] = np.array([path for f, path in self.files.values()])
+
+        for k, buffer in enumerate(self.buffers.values()):
+            state[f'field_{k}'] = buffer[:self.buffered]
+
+        if self.policy is not None:
+            state.update({f'policy_{name}' : value for name, value in policy_state(self.policy).items()})
+
+        return state
+
+    def restore(self, state) -> None:
+        """
+        Continues the recording saved by state. The trajectory must have the same
+        fields, spill mode and kind of policy. Raises OSError if spilled files are missing.
+        """
+        rows = int(state['rows'])
+        buffered = len(state['field_0'])
+
+        if self.spill:
+            # open the spilled files first - nothing changes (and no file stays open) if one of them is missing
+            with contextlib.ExitStack() as opened:
+                files = [opened.enter_context(open(str(path), 'r+b')) for path in state['spill_paths']]
+                opened.pop_all()
+
+            for (f, path), spilled, field in zip(self.files.values(), files, self.fields):
+                f.close()
+                os.remove(path)
+
+                # drop anything written after the checkpoint
+                spilled.truncate((rows - buffered) * int(np.prod(self.shape(field, 1))) * 8)
+                spilled.seek(0, os.SEEK_END)
+
+            self.files = {field : (f, f.name) for field, f in zip(self.fields, files)}
+
+        while self.capacity < buffered:
+            self.grow()
+
+        for k, buffer in enumerate(self.buffers.values()):
+            buffer[:buffered] = state[f'field_{k}']
+
+        self.rows = rows
+        self.buffered = buffered
+
+        if self.policy is not None:
+            restore_policy(self.policy, {name[len('policy_'):] : value for name, value in state.items() if name.startswith('policy_')})
+
+    def finish(self, keep=False) -> dict:
+        """
+        Returns a dictionary: field name -> array of all recorded rows.
+
+        keep - leave the spilled files on disk: the caller removes them
+               (e.g. once the maps have reached another process, see sweep.run_batch).
+        """
+        if self.policy is not None:
+            self.policy.close(self)
+
+        if not self.spill:
+            return {field : buffer[:self.rows] for field, buffer in self.buffers.items()}
+
+        self.flush()
+
+        arrays = {}
+        for field, (f, path) in self.files.items():
+            f.close()
+
+            if self.rows == 0:
+                arrays[field] = np.empty(self.shape(field, 0), dtype=np.double)
+            else:
+                arrays[field] = np.memmap(path, dtype=np.double, mode='r', shape=self.shape(field, self.rows))
+
+            if keep and self.rows > 0:
+                continue
+
+            # the mapping stays valid after the file is unlinked
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        self.buffers = {}
+        return arrays
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+# RECORDING POLICIES
+#
+# A policy receives every accepted step of the integrator (offer)
+# and decides which rows are appended to the trajectory. The last
+# offered row is always kept (close), so that the final state of
+# a run is recorded regardless of the policy.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+def copy_row(values) -> tuple:
+    return tuple(np.copy(value) for value in values)
+
+def policy_state(policy) -> dict:
+    """ The attributes named in policy.saved, as a dictionary of arrays (rows are split into parts). """
+    state = {}
+
+    for name in policy.saved:
+        value = getattr(policy, name)
+
+        if value is None:
+            continue
+
+        if isinstance(value, tuple):
+            state[f'{name}_parts'] = np.array(len(value))
+            state.update({f'{name}_{k}' : np.asarray(part) for k, part in enumerate(value)})
+        else:
+            state[name] = np.asarray(value)
+
+    return state
+
+def restore_policy(policy, state) -> None:
+    """ Sets the attributes of policy from policy_state (missing attributes become None). """
+    for name in policy.saved:
+        if f'{name}_parts' in state:
+            value = tuple(state[f'{name}_{k}'] for k in range(int(state[f'{name}_parts'])))
+        elif name in state:
+            value = state[name].item() if state[name].ndim == 0 else state[name]
+        else:
+            value = None
+
+        setattr(policy, name, value)
+
+class EveryStep:
+    """ Keeps every k-th offered row. """
+
+    # state saved in checkpoints (see policy_state)
+    saved = ['count', 'pending']
+
+    def __init__(self, k):
+        assert k >= 1, "Recording interval must be at least 1 step!"
+        self.k = int(k)
+        self.count = 0
+        self.pending = None
+
+    def offer(self, trajectory, values):
+        if self.count % self.k == 0:
+            trajectory.append(*values)
+            self.pending = None
+        else:
+            self.pending = copy_row(values)
+
+        self.count += 1
+
+    def close(self, trajectory):
+        if self.pending is not None:
+            trajectory.append(*self.pending)
+            self.pending = None
+
+class TimeGrid:
+    """
+    Keeps rows on a fixed output grid of times 0, dt, 2 dt, ...
+
+    Values at grid times are interpolated linearly between
+    the two accepted steps around each grid time.
+    """
+
+    # state saved in checkpoints (see policy_state)
+    saved = ['next', 'count', 'previous', 'recorded']
+
+    def __init__(self, dt):
+        assert dt > 0, "Output grid spacing must be positive!"
+        self.dt = float(dt)
+        self.next = 0.0
+        self.count = 0
+        self.previous = None
+        self.recorded = None
+
+    def offer(self, trajectory, values):
+        time = values[0]
+
+        if self.previous is not None:
+            previous_time = self.previous[0]
+
+            while self.next <= time and time > previous_time:
+                w = (self.next - previous_time) / (time - previous_time)
+                trajectory.append(self.next, *[(1.0 - w) * a + w * np.asarray(b) for a, b in zip(self.previous[1:], values[1:])])
+                self.recorded = self.next
+                self.advance()
+
+        elif self.next <= time:
+            trajectory.append(*values)
+            self.recorded = time
+            self.advance()
+
+        self.previous = copy_row(values)
+
+    def advance(self):
+        self.count += 1
+        self.next = self.count * self.dt
+
+    def close(self, trajectory):
+        if self.previous is not None and self.recorded != self.previous[0]:
+            trajectory.append(*self.previous)
+
+class ChangeThreshold:
+    """
+    Keeps a row whenever the composition has changed by more than
+    the given relative threshold (in any metabolite) since the last kept row.
+    """
+
+    # state saved in checkpoints (see policy_state)
+    saved = ['last', 'pending']
+
+    def __init__(self, threshold, field=1):
+        assert threshold > 0, "Change threshold must be positive!"
+        self.threshold = float(threshold)
+        self.field = field
+        self.last = None
+        self.pending = None
+
+    def offer(self, trajectory, values):
+        current = np.asarray(values[self.field])
+
+        if self.last is None or (np.abs(current - self.last) > self.threshold * np.abs(self.last)).any():
+            trajectory.append(*values)
+            self.last = np.copy(current)
+            self.pending = None
+        else:
+            self.pending = copy_row(values)
+
+    def close(self, trajectory):
+        if self.pending is not None:
+            trajectory.append(*self.pending)
+            self.pending = None
+
+class EndState:
+    """ Keeps only the last offered row. """
+
+    # state saved in checkpoints (see policy_state)
+    saved = ['pending']
+
+    def __init__(self):
+        self.pending = None
+
+    def offer(self, trajectory, values):
+        self.pending = copy_row(values)
+
+    def close(self, trajectory):
+        if self.pending is not None:
+            trajectory.append(*self.pending)
+            self.pending = None
+
+POLICIES = {'every' : EveryStep, 'grid' : TimeGrid, 'change' : ChangeThreshold}
+
+def parse_policy(spec):
+    """
+    Builds a recording policy from a specification string:
+
+        'all'         - every accepted step (returns None)
+        'every:K'     - every K-th accepted step
+        'grid:DT'     - fixed output time grid with spacing DT (days), interpolated
+        'change:X'    - whenever some concentration changed by a fraction X
+        'end'         - end state only
+
+    Policy objects (and None) are passed through unchanged.
+    """
+    if spec is None or not isinstance(spec, str):
+        return spec
+
+    kind, _, value = spec.partition(':')
+
+    if kind == 'all' and not value:
+        return None
+
+    if kind == 'end' and not value:
+        return EndState()
+
+    if kind in POLICIES and value:
+        return POLICIES[kind](int(value) if kind == 'every' else float(value))
+
+    raise ValueError(f"Recording policy '{spec}' not recognized! Use all, every:K, grid:DT, change:X or end.")
@@ -0,0 +1,238 @@
+# Append-only store of the results of many runs (see --store in main.py).
+#
+# All batches of a sweep append to one store instead of writing separate
+# dead_ends.tsv files that have to be found and concatenated before every
+# plot. A store is a directory:
+#
+#   schema.json         - columns (name and numpy dtype) of every row, and
+#                         the sweep parameter (e.g. O2_INIT) the store is indexed on.
+#   segments/*.rows     - fixed-size binary rows, one file per writer.
+#
+# Every process that writes to the store appends to its own segment, so any
+# number of batches and workers can write at the same time without locks.
+# Every row is appended with a single write; a row cut off by a crash is
+# ignored when reading. Reading concatenates the segments into one column
+# (numpy array) per field, sorted by the sweep parameter (see Results).
+
+import numpy as np
+
+import os
+import json
+import time
+import uuid
+import socket
+import tempfile
+
+SCHEMA = 'schema.json'
+SEGMENTS = 'segments'
+
+# Metadata of every row, followed by one float64 column per metabolite (the end state)
+#   seed - master seed of the run (decimal, see sweep.run_seed)
+#   network - identifier of the network (see manifest.network_id)
+#   written - time (seconds since the epoch) the row was appended
+METADATA = [('run', '<i8'), ('seed', 'S40'), ('network', 'S16'), ('success', 'u1'), ('iterations', '<i8'), ('written', '<f8')]
+
+def make_schema(metabolites, parameter=None) -> dict:
+    """ Schema of a store of end states of the given metabolites, optionally indexed on a varied parameter (e.g. 'O2_INIT'). """
+    columns = list(METADATA)
+
+    if parameter is not None:
+        columns.append((parameter, '<f8'))
+
+    columns += [(str(met), '<f8') for met in metabolites]
+
+    return {'columns' : [{'name' : name, 'dtype' : dtype} for name, dtype in columns], 'parameter' : parameter}
+
+def row_dtype(schema) -> np.dtype:
+    """ numpy dtype of one row of a store with the given schema. """
+    return np.dtype([(column['name'], column['dtype']) for column in schema['columns']])
+
+def read_schema(directory) -> dict:
+    """ Schema of the store in directory (None if there is no store). """
+    try:
+        with open(os.path.join(directory, SCHEMA)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def create_schema(directory, schema) -> dict:
+    """
+    Creates the store in directory with the given schema, unless it exists.
+    Returns the schema of the store. Raises ValueError if an existing store has another schema.
+    """
+    os.makedirs(os.path.join(directory, SEGMENTS), exist_ok=True)
+
+    existing = read_schema(directory)
+
+    if existing is None:
+        handle, temporary = tempfile.mkstemp(prefix='schema_', suffix='.json', dir=directory)
+
+        with os.fdopen(handle, 'w') as f:
+            json.dump(schema, f, indent=1)
+            f.write('\n')
+
+        try:
+            # fails if another writer has created the store in the meantime
+            os.link(temporary, os.path.join(directory, SCHEMA))
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+
+        existing = read_schema(directory)
+
+    if existing != schema:
+        raise ValueError(f"Result store {directory} has another schema (metabolites or sweep parameter) than these runs.")
+
+    return existing
+
+class ResultStore:
+    """
+    Writer of one segment of the store in directory (created if needed).
+
+    metabolites - names of the end-state columns.
+    parameter - name of the varied parameter (e.g. 'O2_INIT'), or None.
+
+    Raises ValueError if the store exists with another schema.
+    """
+
+    def __init__(self, directory, metabolites, parameter=None):
+        self.directory = directory
+        self.schema = create_schema(directory, make_schema(metabolites, parameter))
+        self.dtype = row_dtype(self.schema)
+        self.parameter = parameter
+
+        writer = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.path = os.path.join(directory, SEGMENTS, f'{writer}.rows')
+        self.handle = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def append(self, run, seed, network, success, iterations, end_state, value=np.nan) -> None:
+        """
+        Appends the row of one run (synced to disk).
+
+        seed - master seed of the run.
+        value - value of the varied parameter (ignored by stores without one).
+        """
+        row = np.zeros(1, dtype=self.dtype)
+        row['run'] = run
+        row['seed'] = str(seed)
+        row['network'] = network
+        row['success'] = bool(success)
+        row['iterations'] = iterations
+        row['written'] = time.time()
+
+        if self.parameter is not None:
+            row[self.parameter] = value
+
+        for name, concentration in zip(self.dtype.names[-len(end_state):], end_state):
+            row[name] = concentration
+
+        os.write(self.handle, row.tobytes())
+        os.fsync(self.handle)
+
+    def close(self) -> None:
+        if self.handle is not None:
+            os.close(self.handle)
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+class Results:
+    """
+    Columnar view of all rows of a store.
+
+    results[name] - one column as a 1-D array (seed and network as strings).
+    results.parameter - name of the sweep parameter (or None); rows are sorted by it.
+    results.between(low, high) - rows whose parameter lies in [low, high], as a Results.
+    """
+
+    def __init__(self, columns, parameter=None):
+        self.columns = columns
+        self.parameter = parameter
+        self.names = list(columns)
+
+    def __getitem__(self, name) -> np.array:
+        return self.columns[name]
+
+    def __contains__(self, name) -> bool:
+        return name in self.columns
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.columns['run'])
+
+    def keys(self) -> list:
+        return self.names
+
+    def take(self, rows):
+        """ The given rows (indices or mask) as a Results. """
+        return Results({name : column[rows] for name, column in self.columns.items()}, self.parameter)
+
+    def between(self, low, high):
+        """ Rows whose sweep parameter lies in [low, high] (binary search on the sorted parameter). """
+        if self.parameter is None:
+            raise ValueError("The rows of this store are not indexed on a sweep parameter.")
+
+        values = self.columns[self.parameter]
+        start, stop = np.searchsorted(values, low, side='left'), np.searchsorted(values, high, side='right')
+        return self.take(slice(start, stop))
+
+def read_segment(path, dtype) -> np.array:
+    """ All complete rows of one segment. """
+    size = os.path.getsize(path)
+    rows = size // dtype.itemsize
+
+    with open(path, 'rb') as f:
+        return np.fromfile(f, dtype=dtype, count=rows)
+
+def read_results(directory, unique=False, successful=False) -> Results:
+    """
+    Reads all rows of the store in directory (see Results), sorted by the sweep parameter
+    (if any; otherwise in the order of the segments).
+
+    unique - keep only the latest row of every run (network, seed and run number),
+             e.g. of runs repeated with --retry.
+    successful - keep only the runs that reached a dead-end state (as in dead_ends.tsv).
+    """
+    schema = read_schema(directory)
+    if schema is None:
+        raise FileNotFoundError(f"No result store in {directory}.")
+
+    dtype = row_dtype(schema)
+    segments = os.path.join(directory, SEGMENTS)
+
+    rows = [read_segment(os.path.join(segments, fname), dtype) for fname in sorted(os.listdir(segments)) if fname.endswith('.rows')]
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=dtype)
+
+    if unique:
+        order = np.lexsort((rows['written'], rows['run'], rows['seed'], rows['network']))
+        rows = rows[order]
+
+        # last row of every (network, seed, run) group
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = ((rows['network'][1:] != rows['network'][:-1]) | (rows['seed'][1:] != rows['seed'][:-1])
+                     | (rows['run'][1:] != rows['run'][:-1]))
+        rows = rows[last]
+
+    if successful:
+        rows = rows[rows['success'] == 1]
+
+    parameter = schema['parameter']
+    if parameter is not None:
+        rows = rows[np.argsort(rows[parameter], kind='stable')]
+
+    columns = {name : np.ascontiguousarray(rows[name]) for name in dtype.names}
+    columns['success'] = columns['success'].astype(bool)
+
+    # few distinct seeds and networks: decoded once each
+    for name in ['seed', 'network']:
+        values, inverse = np.unique(columns[name], return_inverse=True)
+        columns[name] = values.astype(str).astype(object)[inverse]
+
+    return Results(columns, parameter)
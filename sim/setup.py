@@ -2,127 +2,204 @@
 # and stoichiometry.txt, setup.py selects K reactions
 # and builds the required data structures for a reaction-centric model.
 #
+# The library in sim/config is never modified: every call of make_network
+# returns a new, immutable Network (see network.py).
+#
 # Author: Nathan Malamud
 
 import numpy as np
 import numpy.random as np_random
 
-import sys
+import os
+import hashlib
+import tempfile
 
-from . import parser
+from . import parser, sparse
+from .network import Network
 
-from .config.reactions import *     # reactions, typical_rates, typical_decay, typical_std
-from .config.metabolites import *   # metabolites, initialC, deltaGf0
+from .config.general import SPARSE_DENSITY
 
-def build_network(reaction_argument) -> list:
+from .config import reactions as reaction_library         # reactions, typical_rates, typical_decay, typical_std
+from .config import metabolites as metabolite_library     # metabolites, initialC, deltaGf0
+
+CONFIG_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
+
+# Files that define the library - any change to them invalidates the network cache
+CONFIG_FILES = ['reactions.py', 'metabolites.py', 'stoichiometry.txt']
+
+# Directory of compiled networks (see network_key), in the user cache directory
+# ($XDG_CACHE_HOME, by default ~/.cache). Set SIM_NETWORK_CACHE to use another
+# directory, or to an empty string to disable the cache.
+CACHE_DIRECTORY = os.environ.get('SIM_NETWORK_CACHE',
+                                 os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                              'sim', 'networks'))
+
+# Version of the layout of compiled networks (see save_network) - bump on any change
+CACHE_FORMAT = 1
+
+# Stoichiometric matrices, in the order of stoich_mats
+STOICH_KINDS = ['full', 'lim', 'nconst']
+
+def network_key(reaction_names) -> str:
     """
-    Via a two-phase process, this function uses
-    all of the information provided in the config folder
-    to return all required parameters for the simulation.
+    Hash of the library (all CONFIG_FILES), of a selection of reactions and of the
+    settings that shape the compiled matrices (CACHE_FORMAT, SPARSE_DENSITY):
+    identifies one compiled network in the cache.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'format {CACHE_FORMAT}\ndensity {SPARSE_DENSITY!r}\n'.encode())
+
+    for fname in CONFIG_FILES:
+        with open(os.path.join(CONFIG_DIRECTORY, fname), 'rb') as f:
+            digest.update(f.read())
+
+    digest.update('\n'.join(reaction_names).encode())
+
+    return digest.hexdigest()
+
+def load_network(key):
+    """ Returns a compiled network from the cache, or None. """
+    if not CACHE_DIRECTORY:
+        return None
+
+    try:
+        with np.load(os.path.join(CACHE_DIRECTORY, f'{key}.npz'), allow_pickle=False) as data:
+            # matrices are stored as their nonzero entries (see save_network)
+            shape, use_sparse = tuple(data['shape']), bool(data['sparse'])
+            stoich_mats = [sparse.from_triplets(data[f'{kind}_rows'], data[f'{kind}_columns'], data[f'{kind}_values'], shape=shape, sparse=use_sparse)
+                           for kind in STOICH_KINDS]
+
+            return Network(data['metabolites'], data['reactions'], data['deltaGf0'], data['initialC'], stoich_mats,
+                           [data['typical_rates'], data['typical_decay'], data['typical_std']])
+    except (OSError, KeyError, ValueError):
+        # missing, partial or outdated file - rebuild it
+        return None
+
+def save_network(key, network) -> None:
+    """ Writes a compiled network to the cache (atomically, so that concurrent runs never see partial files). """
+    if not CACHE_DIRECTORY:
+        return
+
+    metabolites, reactions, deltaGf0, initialC, stoich_mats, ou_parameters = network
+
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        handle, path = tempfile.mkstemp(prefix='network_', suffix='.npz', dir=CACHE_DIRECTORY)
+
+        matrices = {'shape' : np.array(stoich_mats[0].shape), 'sparse' : np.array(sparse.issparse(stoich_mats[0]))}
+        for kind, S in zip(STOICH_KINDS, stoich_mats):
+            matrices[f'{kind}_rows'], matrices[f'{kind}_columns'], matrices[f'{kind}_values'] = sparse.triplets(S)
+
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, metabolites=metabolites, reactions=reactions, deltaGf0=deltaGf0, initialC=initialC,
+                     typical_rates=ou_parameters[0], typical_decay=ou_parameters[1], typical_std=ou_parameters[2], **matrices)
+
+        os.replace(path, os.path.join(CACHE_DIRECTORY, f'{key}.npz'))
+
+    except OSError:
+        # the cache is an optimization only - e.g. read-only file systems
+        pass
+
+def select_reactions(reaction_argument, rng=None) -> list:
+    """
+    Names of the reactions selected from the library, in library order.
 
     The behavior of this function varies depending on what
     datatype reaction_argument is:
-        if in 'random' mode, simulation will assume this is an integer 
+        if in 'random' mode, simulation will assume this is an integer K
+            (K distinct reactions drawn with rng, or np.random if None)
         if in 'fixed' mode, simulation will assume this is a list of reactions
-    
-    Order of returns:
-        metabolites - names of all species
-        reactions - names of all K reactions
-        deltaGf0 - gibbs free energy values
-        initalC - concentration values
-        stoich_mats - stoichiometry of the system [full, lim, nconst]
-        ou_parameters - needed for kinetic rates [means, sigmas, decays, starts]
-    """
 
-    global metabolites
-    global reactions
-
-    global typical_decay, typical_rates, typical_std
-    global deltaGf0, initialC
-
-    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-    # I. NETWORK MODEL SELECTION and TRIMMING:
-    #
-    # Using a reaction centric approach, we can produce
-    # a 'network' of chemical reactions.
-    #
-    # In order to generate a reaction network, we need
-    # to be able to access a master library (e.g. in config)
-    # and filter away what is not needed.
-    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
-    M = len(metabolites)
+    Raises ValueError for unknown reaction names and invalid arguments.
+    """
+    reactions = reaction_library.reactions
     N = len(reactions)
 
-    # select K random reactions, and extract all parameters needed for them
-    selection = np.zeros(shape=N, dtype='bool')
-    selection_indices = None
+    if isinstance(reaction_argument, (int, np.integer)):
+        K: int = int(reaction_argument)
 
-    if isinstance(reaction_argument, int):
-        K: int = reaction_argument
+        if not 0 <= K <= N:
+            raise ValueError(f'Cannot select {K} reactions from a library of {N}.')
 
         # Choose a random assortment of reaction indices (without replacement - no repeats)
-        selection_indices = np_random.choice(np.array([i for i in range(0, N)]), size=K, replace=False)
+        choice = np_random.choice if rng is None else np.random.default_rng(rng).choice
+        selection_indices = choice(np.arange(N), size=K, replace=False)
 
-    elif isinstance(reaction_argument, list):
-        reaction_list: list = reaction_argument.copy()
+    elif isinstance(reaction_argument, (list, tuple)):
+        reaction_index = {rxn : i for i, rxn in enumerate(reactions)}
 
-        selection_indices = []
+        unknown = [rxn for rxn in reaction_argument if rxn not in reaction_index]
+        if unknown:
+            raise ValueError(f'{", ".join(unknown)} is NOT a valid reaction name. Please try again.')
 
         # Choose an assortment of reaction indices based on what reactions are needed in the list
-        for rxn in reaction_list:
-            try:
-                assert rxn in reactions
-                index = list(reactions).index(rxn)
-                selection_indices.append(index)
-            
-            except AssertionError:
-                print(f'\n{rxn} is NOT a valid reaction name. Please try again.')
-                sys.exit(1)
-        
-        selection_indices = np.array(selection_indices)
+        selection_indices = [reaction_index[rxn] for rxn in reaction_argument]
 
     else:
-        print(f'\n{reaction_argument} is not a valid type for argument \'reaction_argument\' in function build_network.')
-        sys.exit(1)
+        raise ValueError(f'{reaction_argument} is not a valid type for argument \'reaction_argument\' in function build_network.')
 
-    for i in selection_indices:
-        selection[i] = True
+    selection = np.zeros(shape=N, dtype='bool')
+    selection[selection_indices] = True
 
-    reactions = reactions[selection].copy()
-    typical_rates = typical_rates[selection].copy()
-    typical_decay = typical_decay[selection].copy()
-    typical_std = typical_std[selection].copy()
+    return [str(rxn) for rxn in reactions[selection]]
 
-    stoichiometry = parser.parse_file('./sim/config/stoichiometry.txt')
+def make_network(reaction_argument, rng=None) -> Network:
+    """
+    Via a two-phase process, this function uses
+    all of the information provided in the config folder
+    to build the network of the selected reactions
+    (see select_reactions for reaction_argument).
 
-    all_reactions = list(stoichiometry.keys())
+    Compiled networks are cached on disk, keyed by the library
+    and the selected reactions (see network_key).
+    """
+    reaction_names = select_reactions(reaction_argument, rng=rng)
 
-    for rxn in all_reactions:
-        # that is, if the current reaction is not in our selection
-        if not rxn in reactions:
-            del stoichiometry[rxn]
+    key = network_key(reaction_names)
+    network = load_network(key)
 
-    # select all metabolites needed for these reactions
+    if network is None:
+        network = compile_network(reaction_names)
+        save_network(key, network)
 
-    metabolites_needed = []
-    for rxn in stoichiometry:
-        for met in stoichiometry[rxn]['species']:
-            metabolites_needed.append(met)
+    return network
+
+def compile_network(reaction_names) -> Network:
+    """ Builds the network of the given reactions (in library order) from the config files. """
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    # I. NETWORK MODEL SELECTION and TRIMMING:
+    #
+    # Using a reaction centric approach, we can produce
+    # a 'network' of chemical reactions.
+    #
+    # In order to generate a reaction network, we need
+    # to be able to access a master library (e.g. in config)
+    # and filter away what is not needed.
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+    selected = set(reaction_names)
+    selection = np.array([rxn in selected for rxn in reaction_library.reactions], dtype='bool')
+
+    # fancy indexing copies - the library itself is never modified
+    reactions = reaction_library.reactions[selection]
+    typical_rates = reaction_library.typical_rates[selection]
+    typical_decay = reaction_library.typical_decay[selection]
+    typical_std = reaction_library.typical_std[selection]
 
-    selection = []
+    # only the selected reactions are parsed
+    stoichiometry = parser.parse_file(os.path.join(CONFIG_DIRECTORY, 'stoichiometry.txt'), only=selected)
 
-    for met in metabolites:
-        if met in metabolites_needed:
-            selection.append(True)
-        else:
-            selection.append(False)
+    # select all metabolites needed for these reactions
 
-    selection = np.array(selection)
+    metabolites_needed = set()
+    for rxn in stoichiometry:
+        metabolites_needed.update(stoichiometry[rxn]['species'])
 
-    metabolites = metabolites[selection].copy()
-    deltaGf0 = deltaGf0[selection].copy()
-    initialC = initialC[selection].copy()
+    selection = np.array([met in metabolites_needed for met in metabolite_library.metabolites], dtype='bool')
 
+    metabolites = metabolite_library.metabolites[selection]
+    deltaGf0 = metabolite_library.deltaGf0[selection]
+    initialC = metabolite_library.initialC[selection]
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
     # II. BUILDING STOICHIOMETRIC MATRICES
     #
@@ -139,41 +216,68 @@ def build_network(reaction_argument) -> list:
     M = len(metabolites)
     N = len(reactions)
 
-    stoich_mat_full = np.zeros(shape=(M, N), dtype=np.double)
-    stoich_mat_lim = np.zeros(shape=(M, N), dtype=np.double)
-    stoich_mat_nconst = np.zeros(shape=(M, N), dtype=np.double)
+    # nonzero entries (row, column, value) of each matrix
+    entries = {kind : [] for kind in STOICH_KINDS}
+
+    metabolite_index = {met : j for j, met in enumerate(metabolites)}
 
     for i in range(N):
         rxn = reactions[i]
 
-        try:
-            stoich_info = stoichiometry[rxn]['species']
-        except:
-            print(f"\nERROR! reaction '{rxn}' not found in stoichiometry.txt file. Aborting!")
-            sys.exit(1)
+        if rxn not in stoichiometry:
+            raise ValueError(f"reaction '{rxn}' not found in stoichiometry.txt file.")
+
+        stoich_info = stoichiometry[rxn]['species']
 
-        for j in range(M):
-            met = metabolites[j]
+        for met, info in stoich_info.items():
+            if met not in metabolite_index:
+                continue
 
-            if met in stoich_info:
+            j = metabolite_index[met]
 
-                coeff = stoich_info[met]['coeff']
-                flags = stoich_info[met]['flags']
-                stoich_mat_full[j, i] = coeff
+            coeff = info['coeff']
+            flags = info['flags']
+            entries['full'].append((j, i, coeff))
 
-                # check for non-limiting and constant concentration flags
-                if not ('CONST' in flags or 'C' in flags):
-                    stoich_mat_nconst[j, i] = coeff
+            # check for non-limiting and constant concentration flags
+            constant = 'CONST' in flags or 'C' in flags
 
-                if not 'NL' in flags:
-                    stoich_mat_lim[j, i] = coeff
-                else:
-                    stoich_mat_lim[j, i] = 0.0
-                    # non-limiting substrates must also be constant by default
-                    if coeff < 0:
-                        stoich_mat_nconst[j, i] = 0.0
+            if not 'NL' in flags:
+                entries['lim'].append((j, i, coeff))
+            elif coeff < 0:
+                # non-limiting substrates must also be constant by default
+                constant = True
+
+            if not constant:
+                entries['nconst'].append((j, i, coeff))
+
+    # dense, or sparse for large libraries (see sim/sparse.py) - the same format for all three
+    use_sparse = len(entries['full']) <= SPARSE_DENSITY * M * N
+
+    def matrix(kind):
+        rows, columns, values = zip(*entries[kind]) if entries[kind] else ((), (), ())
+        return sparse.from_triplets(np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp), np.array(values, dtype=np.double),
+                                    shape=(M, N), sparse=use_sparse)
+
+    stoich_mat_full, stoich_mat_lim, stoich_mat_nconst = [matrix(kind) for kind in STOICH_KINDS]
 
     stoich_mats = [stoich_mat_full, stoich_mat_lim, stoich_mat_nconst]
     ou_parameters = [typical_rates, typical_decay, typical_std]
 
-    return [metabolites, reactions, deltaGf0, initialC, stoich_mats, ou_parameters]
+    return Network(metabolites, reactions, deltaGf0, initialC, stoich_mats, ou_parameters)
+
+def build_network(reaction_argument) -> list:
+    """
+    List form of make_network (see there for reaction_argument).
+
+    Order of returns:
+        metabolites - names of all species
+        reactions - names of all K reactions
+        deltaGf0 - gibbs free energy values
+        initalC - concentration values
+        stoich_mats - stoichiometry of the system [full, lim, nconst]
+        ou_parameters - needed for kinetic rates [typical_rates, typical_decay, typical_std]
+
+    All arrays are read-only (see network.Network).
+    """
+    return list(make_network(reaction_argument))
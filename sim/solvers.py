@@ -0,0 +1,231 @@
+# Single-step methods for the numerical integration code.
+#
+# A solver advances the composition C by one step h and returns the
+# net metabolite flux over the step, together with an error estimate
+# from an embedded lower-order method. execute decides, based on that
+# error, whether to accept the step and how to adapt the timestep.
+
+import numpy as np
+
+from . import sparse
+
+from .config.general import CONTROL, MAX_SCALE
+
+def fehlberg_stages(t, h, C, f) -> tuple:
+    """
+    Runge-Kutta-Fehlberg stages: returns the 5th order flux
+    and the difference to the embedded 4th order flux.
+    """
+    k1 = h * f(t, C)
+    k2 = h * f(t + 0.25 * h, C + 0.25 * k1)
+    k3 = h * f(t + 0.375 * h, C + 0.09375 * k1 + 0.28125 * k2)
+    k4 = h * f(t + 12./13. * h, C + 1932./2197. * k1 + (-7200./2197.) * k2 + 7296./2197 * k3) 
+    k5 = h * f(t + h, C + 439./216. * k1 + (-8.) * k2 + (3680./513.) * k3 + (-845./4104.) * k4)
+    k6 = h * f(t + 0.5 * h, C + (-8./27.) * k1 + 2. * k2 + (-3544./2565.) * k3 + (-845./4104.) * k4 + (-0.275) * k5)
+
+    C_RK4_flux = (25./216.) * k1 + (1408./2565.) * k3 + (2197./4104.) * k4 + (-0.2) * k5
+    C_RK5_flux = (16./135.) * k1 + (6656./12825.) * k3 + (28561./56430.) * k4 + (-0.18) * k5 + (2./55.) * k6
+
+    return C_RK5_flux, C_RK5_flux - C_RK4_flux
+
+def calculate_flux(t, h, C, f) -> tuple:
+    """
+    Uses a 5th order Runge-Kutta-Fehlberg method to determine
+    the net metabolite flux at time t. Also returns the error bound.
+
+    Works row-wise on an (R x M) matrix C if h is an (R x 1) column.
+
+    Source: [Cheney & Kincaid (2008) - Numerical Mathematics and Computing Sixth Edition pp. 450-453]
+    """
+    C_RK5_flux, difference = fehlberg_stages(t, h, C, f)
+
+    # Error is determined as the euclidean distance between estimates.
+    if C.ndim == 1:
+        error = np.linalg.norm(difference)
+    else:
+        error = np.linalg.norm(difference, axis=-1)
+
+    return C_RK5_flux, error
+
+class Solver:
+    """
+    Interface shared by all single-step methods.
+
+    step returns the flux over the step and the vector of
+    (per-metabolite) error estimates. execute calls accept after
+    every accepted step, and reset whenever the solution is
+    restarted, so that solvers can reuse stages between steps.
+
+    error_order - the local error estimate is O(h ** error_order);
+                  used by the step-size controller (see control.py).
+    max_scale - largest growth of the timestep after an accepted step (see control.ToleranceControl).
+    fsal - True for first-same-as-last methods, which evaluate the
+           rates at the stage times (f must be a function of t and C only).
+    cache - attributes reused between steps, saved in checkpoints (see state).
+    controls - step-size controllers the method works with (see control.py), or None for all.
+    """
+
+    name = None
+    error_order = None
+    max_scale = MAX_SCALE
+    fsal = False
+    cache = []
+    controls = None
+
+    def step(self, t, h, C, f, jacobian=None) -> tuple:
+        raise NotImplementedError
+
+    def accept(self) -> None:
+        pass
+
+    def reset(self) -> None:
+        pass
+
+    def state(self) -> dict:
+        """ Stages reused between steps (dictionary: attribute -> array, unset ones left out). """
+        return {name : getattr(self, name) for name in self.cache if getattr(self, name) is not None}
+
+    def restore(self, state) -> None:
+        """ Restores the stages saved by state. """
+        for name in self.cache:
+            setattr(self, name, state.get(name))
+
+class Fehlberg(Solver):
+    """ Explicit Runge-Kutta-Fehlberg 4(5) method (see calculate_flux). """
+
+    name = 'rkf45'
+    error_order = 5
+
+    def step(self, t, h, C, f, jacobian=None) -> tuple:
+        return fehlberg_stages(t, h, C, f)
+
+class DormandPrince(Solver):
+    """
+    Explicit Dormand-Prince 5(4) method with first-same-as-last stage reuse.
+
+    The last stage is evaluated at the new solution, so after an accepted
+    step it is reused as the first stage of the next one: 6 rate
+    evaluations per step instead of 7. The first stage is also kept
+    across rejected steps, since the state does not change.
+
+    Source: [Hairer, Norsett & Wanner (1993) - Solving Ordinary Differential Equations I, pp. 178-179]
+    """
+
+    name = 'dopri5'
+    error_order = 5
+    fsal = True
+    cache = ['first_stage', 'last_stage']
+
+    a = [[],
+         [1/5],
+         [3/40, 9/40],
+         [44/45, -56/15, 32/9],
+         [19372/6561, -25360/2187, 64448/6561, -212/729],
+         [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]]
+    c = [0, 1/5, 3/10, 4/5, 8/9, 1]
+    b = [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]
+    # difference between the 5th and embedded 4th order weights (7 stages)
+    e = [71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+    def __init__(self):
+        self.first_stage = None
+        self.last_stage = None
+
+    def step(self, t, h, C, f, jacobian=None) -> tuple:
+        if self.first_stage is None:
+            self.first_stage = f(t, C)
+
+        k = [self.first_stage]
+
+        for i in range(1, 6):
+            increment = sum([a * k_j for a, k_j in zip(self.a[i], k) if a != 0])
+            k.append(f(t + self.c[i] * h, C + h * increment))
+
+        flux = h * sum([b * k_j for b, k_j in zip(self.b, k) if b != 0])
+
+        self.last_stage = f(t + h, C + flux)
+        k.append(self.last_stage)
+
+        error = h * sum([e * k_j for e, k_j in zip(self.e, k) if e != 0])
+
+        return flux, error
+
+    def accept(self) -> None:
+        self.first_stage = self.last_stage
+
+    def reset(self) -> None:
+        self.first_stage = None
+        self.last_stage = None
+
+class Rosenbrock(Solver):
+    """
+    Linearly implicit Rosenbrock method ROS2 for stiff networks.
+
+    With W = I - gamma * h * J, where J is the Jacobian of f at C:
+
+        W k1 = f(t, C)
+        W k2 = f(t + h, C + h k1) - 2 k1
+        flux = h (3/2 k1 + 1/2 k2)
+
+    The embedded first-order solution C + h k1 gives the error estimate.
+    The method is L-stable, so fast reactions that drain a substrate
+    do not force tiny steps as they do in the explicit Fehlberg scheme.
+
+    Source: [Verwer, Spee, Blom & Hundsdorfer (1999) - A second-order Rosenbrock method
+             applied to photochemical dispersion problems. SIAM J. Sci. Comput. 20: 1456-1480]
+    """
+
+    name = 'rosenbrock'
+
+    # The embedded solution is first order, but on stiff networks its error
+    # shrinks only in proportion to h (order reduction): with the exponent
+    # -1/2 of an O(h ** 2) estimate, every reduction after a rejected step
+    # falls short and is rejected again. Reactions that switch off near the
+    # dead end leave single steps with a tiny error, so the timestep only
+    # grows by half as much as for the explicit methods.
+    error_order = 1
+    max_scale = 2.0
+
+    # The first-order error estimate stays above E_MAX at any useful timestep,
+    # so the 'bounds' controller would halve the timestep until MAX_ITERATIONS.
+    controls = ['tolerance']
+
+    gamma = 1.0 + 1.0 / np.sqrt(2.0)
+
+    def step(self, t, h, C, f, jacobian) -> tuple:
+        M = len(C)
+        J = jacobian(t, C)
+
+        # sparse networks have a sparse Jacobian, factorized once per step (see sparse.factorize)
+        W = sparse.identity(M, sparse=sparse.issparse(J)) - (self.gamma * h) * J
+
+        try:
+            solve = sparse.factorize(W)
+            k1 = solve(f(t, C))
+            k2 = solve(f(t + h, C + h * k1) - 2.0 * k1)
+        except np.linalg.LinAlgError:
+            # singular iteration matrix - makes execute halve the timestep
+            return np.full(M, np.nan), np.full(M, np.nan)
+
+        flux = h * (1.5 * k1 + 0.5 * k2)
+        error = h * 0.5 * (k1 + k2)
+
+        return flux, error
+
+SOLVERS = {solver.name : solver for solver in [Fehlberg, DormandPrince, Rosenbrock]}
+
+def resolve_control(solver, control=None) -> str:
+    """
+    Step-size controller for the named solver: control, or by default CONTROL
+    (the first controller the solver works with, if it does not work with CONTROL).
+    Raises ValueError if the solver does not work with control.
+    """
+    controls = SOLVERS[solver].controls
+
+    if control is None:
+        return CONTROL if controls is None or CONTROL in controls else controls[0]
+
+    if controls is not None and control not in controls:
+        raise ValueError(f"The {solver} solver needs the {' or '.join(controls)} step-size controller, not {control}.")
+
+    return control
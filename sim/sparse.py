@@ -0,0 +1,130 @@
+# Dense or sparse storage for stoichiometric matrices.
+#
+# Every reaction only involves a handful of metabolites, so the
+# stoichiometric matrices of large libraries are almost entirely zero.
+# Below SPARSE_DENSITY (fraction of nonzero entries), matrices are kept
+# in compressed sparse row format, so that memory and the cost of every
+# product scale with the number of nonzeros instead of M x N.
+#
+# scipy is only imported when a sparse matrix is actually needed;
+# without it, all matrices simply stay dense.
+
+import numpy as np
+
+from .config.general import SPARSE_DENSITY
+
+def scipy_sparse():
+    """ The scipy.sparse module, or None if scipy is not installed. """
+    try:
+        import scipy.sparse
+    except ImportError:
+        return None
+
+    return scipy.sparse
+
+def issparse(S) -> bool:
+    """ True for scipy sparse matrices (without importing scipy). """
+    return hasattr(S, 'tocsr')
+
+def density(S) -> float:
+    """ Fraction of nonzero entries of S. """
+    size = S.shape[0] * S.shape[1]
+    if size == 0:
+        return 1.0
+
+    nonzeros = S.count_nonzero() if issparse(S) else np.count_nonzero(S)
+    return nonzeros / size
+
+def dense(S) -> np.array:
+    """ S as a dense array. """
+    return S.toarray() if issparse(S) else np.asarray(S)
+
+def triplets(S) -> tuple:
+    """ Row indices, column indices and values of the nonzero entries of S. """
+    if issparse(S):
+        S = S.tocoo()
+        keep = S.data != 0
+        return S.row[keep], S.col[keep], S.data[keep]
+
+    rows, columns = np.nonzero(S)
+    return rows, columns, np.asarray(S)[rows, columns]
+
+def from_triplets(rows, columns, values, shape, threshold=SPARSE_DENSITY, sparse=None):
+    """
+    Matrix of the given shape with the given nonzero entries:
+    sparse (CSR) if its density is at most threshold, dense otherwise.
+    sparse=True or False overrides the choice (True needs scipy).
+    """
+    size = shape[0] * shape[1]
+
+    if sparse is None:
+        sparse = size > 0 and len(values) / size <= threshold
+
+    module = scipy_sparse() if sparse else None
+
+    if module is not None:
+        return module.csr_array((np.asarray(values, dtype=np.double), (rows, columns)), shape=shape)
+
+    S = np.zeros(shape=shape, dtype=np.double)
+    S[rows, columns] = values
+    return S
+
+def auto(S, threshold=SPARSE_DENSITY):
+    """ S in the format chosen by its density (see from_triplets). """
+    return from_triplets(*triplets(S), shape=S.shape, threshold=threshold)
+
+def nonzero_rows(S) -> np.array:
+    """ Boolean vector: True for every row of S with a nonzero entry. """
+    rows, columns, values = triplets(S)
+    mask = np.zeros(S.shape[0], dtype=bool)
+    mask[rows] = True
+    return mask
+
+def column_entries(S, select) -> list:
+    """
+    For every column n of S: the row indices m (in increasing order)
+    of the entries for which select(S[m, n]) is True.
+    """
+    rows, columns, values = triplets(S)
+    keep = select(values)
+    rows, columns = rows[keep], columns[keep]
+
+    order = np.lexsort((rows, columns))
+    rows, columns = rows[order], columns[order]
+
+    bounds = np.searchsorted(columns, np.arange(S.shape[1] + 1))
+    return [rows[bounds[n]:bounds[n + 1]] for n in range(S.shape[1])]
+
+def select_rows(S, rows):
+    """ Rows of S (a new matrix in the same format). """
+    return S[rows] if not issparse(S) else S.tocsr()[rows]
+
+def submatrix(S, rows, columns):
+    """ S[rows, columns] for index vectors rows and columns (a new matrix in the same format). """
+    if issparse(S):
+        return S.tocsc()[:, columns].tocsr()[rows]
+
+    return np.asarray(S)[np.ix_(rows, columns)]
+
+def identity(M, sparse=False):
+    """ M x M identity matrix: sparse (CSC) or dense. """
+    return scipy_sparse().identity(M, format='csc') if sparse else np.identity(M)
+
+def factorize(W):
+    """
+    Function that solves W x = b for a square matrix W.
+
+    Sparse matrices are factorized once (sparse LU, scipy.sparse.linalg.splu),
+    so every solve only costs two triangular substitutions.
+    Raises np.linalg.LinAlgError if W is singular.
+    """
+    if not issparse(W):
+        return lambda b : np.linalg.solve(W, b)
+
+    from scipy.sparse.linalg import splu
+
+    try:
+        return splu(W.tocsc()).solve
+    except RuntimeError as error:
+        # "Factor is exactly singular"
+        raise np.linalg.LinAlgError(str(error))
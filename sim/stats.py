@@ -0,0 +1,109 @@
+# Run statistics: what the integrator did during one run.
+#
+# Counters (steps, rejected steps by reason, evaluations of every kernel)
+# are always kept - each costs one integer increment. Phase timers, which
+# measure the time spent in the Ornstein-Uhlenbeck spline, the Gibbs
+# energies (thermodynamics), the rate kernel (right-hand side) and its
+# Jacobian, are optional: they add two clock reads per kernel call.
+#
+# execute returns the statistics of a run as a plain dictionary in
+# sol['stats']; summarize aggregates the records of a whole sweep.
+
+import numpy as np
+
+from time import perf_counter
+
+# Kernels whose evaluations are counted (and timed, see RunStats.instrument)
+PHASES = ['ornbeck', 'gibbs', 'rhs', 'jacobian']
+
+# Reasons for rejecting a step:
+#   nan, negative - NaN or negative concentrations
+#   error_max, error_min - error outside [E_MIN, E_MAX] ('bounds' controller; error_min retries with a larger step)
+#   tolerance - scaled error over 1 ('tolerance' controller)
+REJECTIONS = ['nan', 'negative', 'error_max', 'error_min', 'tolerance']
+
+COUNTERS = (['iterations', 'accepted']
+            + [f'rejected_{reason}' for reason in REJECTIONS]
+            + ['loop_escapes', 'events']
+            + [f'{phase}_evaluations' for phase in PHASES])
+
+class RunStats:
+    """
+    Counters and optional phase timers of one run.
+
+    counts - dictionary: counter name (see COUNTERS) -> count.
+    times - dictionary: phase (see PHASES) -> seconds, or None without timers.
+    started - clock time (perf_counter) at which the run started, by default now.
+    """
+
+    def __init__(self, timers=False, started=None):
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.times = dict.fromkeys(PHASES, 0.0) if timers else None
+        self.started = perf_counter() if started is None else started
+
+    def instrument(self, phase, function):
+        """ Wraps function so that its calls are counted (and timed, with timers) under phase. """
+        counts = self.counts
+        counter = f'{phase}_evaluations'
+
+        if self.times is None:
+            def counted(*args):
+                counts[counter] += 1
+                return function(*args)
+
+            return counted
+
+        times = self.times
+
+        def timed(*args):
+            counts[counter] += 1
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                times[phase] += perf_counter() - start
+
+        return timed
+
+    def state(self) -> dict:
+        """ Counters as a dictionary of arrays (for checkpoints). """
+        return {name : np.array(count) for name, count in self.counts.items()}
+
+    def restore(self, state) -> None:
+        """ Restores the counters saved by state. """
+        for name in self.counts:
+            if name in state:
+                self.counts[name] = int(state[name])
+
+    def finish(self) -> dict:
+        """
+        Statistics record of the run: all counters, the total number of rejected steps,
+        the wall time (seconds) and, with timers, the time spent in every phase ('time_<phase>').
+        """
+        record = dict(self.counts)
+        record['rejected'] = sum([self.counts[f'rejected_{reason}'] for reason in REJECTIONS])
+        record['wall_time'] = perf_counter() - self.started
+
+        if self.times is not None:
+            record.update({f'time_{phase}' : seconds for phase, seconds in self.times.items()})
+
+        return record
+
+def fields(records) -> list:
+    """ All fields of the given statistics records, in order of appearance. """
+    return list(dict.fromkeys([field for record in records for field in record]))
+
+def summarize(records) -> dict:
+    """
+    Summary of the statistics records of many runs (e.g. a sweep):
+    number of runs, and the total, mean and maximum of every field
+    (over the runs whose records have it).
+    """
+    summary = {'runs' : len(records)}
+
+    for field in fields(records):
+        # e.g. phase times are only part of the records of runs with timers
+        values = np.array([record[field] for record in records if field in record], dtype=np.double)
+        summary[field] = {'total' : float(values.sum()), 'mean' : float(values.mean()), 'max' : float(values.max())}
+
+    return summary
@@ -0,0 +1,100 @@
+# Binary columnar storage for simulation output.
+#
+# A table is stored as two files:
+#   name.npy  - (columns x rows) float64 matrix in standard .npy format,
+#               so that every column is one contiguous block on disk.
+#   name.json - metadata: column names, number of rows and the index column (time).
+#
+# Tables are opened as read-only memory maps, so loading is zero-copy
+# and only the columns that are actually used are ever read from disk.
+
+import numpy as np
+
+import json
+import os
+
+FORMATS = ['tsv', 'npy']
+
+class Columns:
+    """
+    Read-only view of a columnar table.
+
+    columns[name] - one column as a 1-D (memory-mapped) array.
+    columns.time  - the index column.
+    columns.matrix - the whole (columns x rows) memory map.
+    """
+
+    def __init__(self, matrix, metadata):
+        self.matrix = matrix
+        self.metadata = metadata
+        self.names = list(metadata['columns'])
+        self.index = {name : i for i, name in enumerate(self.names)}
+
+    def __getitem__(self, name) -> np.array:
+        return self.matrix[self.index[name]]
+
+    def __contains__(self, name) -> bool:
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def time(self) -> np.array:
+        return self[self.metadata['index']]
+
+    def keys(self) -> list:
+        return self.names
+
+def write_columns(path, index, data, names, index_name='time', **metadata) -> None:
+    """
+    Writes a table with an index column (e.g. time) and one column per name.
+
+    path - output path without extension (.npy and .json are added).
+    index - (rows,) vector.
+    data - (rows x columns) matrix, e.g. sol['composition']. May be a memory map.
+    names - column names for data.
+    metadata - any additional JSON-serializable values to store.
+    """
+    index = np.asarray(index, dtype=np.double)
+    rows = len(index)
+
+    matrix = np.lib.format.open_memmap(f'{path}.npy', mode='w+', dtype=np.double, shape=(len(names) + 1, rows))
+    matrix[0] = index
+    matrix[1:] = np.asarray(data, dtype=np.double).reshape(rows, len(names)).transpose()
+    matrix.flush()
+    del matrix
+
+    metadata.update({'columns' : [index_name] + list(names), 'rows' : rows, 'index' : index_name})
+
+    with open(f'{path}.json', 'w') as f:
+        json.dump(metadata, f, indent=1)
+
+def load_columns(path) -> Columns:
+    """ Opens a table written by write_columns (path with or without extension). """
+    path = os.path.splitext(path)[0] if path.endswith(('.npy', '.json')) else path
+
+    with open(f'{path}.json') as f:
+        metadata = json.load(f)
+
+    matrix = np.load(f'{path}.npy', mmap_mode='r')
+
+    return Columns(matrix, metadata)
+
+def load_run(directory) -> dict:
+    """
+    Opens all tables in the output directory of one run (e.g. data/sim_01),
+    keyed by quantity: 'composition', 'deltaG', 'ornbeck' and 'flux'.
+    """
+    tables = {}
+
+    for fname in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(fname)
+        if extension == '.json':
+            quantity = stem.rsplit('_', 1)[0]
+            tables[quantity] = load_columns(os.path.join(directory, stem))
+
+    return tables
@@ -0,0 +1,339 @@
+# Running many simulations of one network, in serial or on a process pool.
+#
+# Every run draws its Ornstein-Uhlenbeck processes from its own random
+# stream, derived from a master seed and the run index. Results therefore
+# do not depend on how many worker processes are used, or in which order
+# the runs happen to finish.
+
+import numpy as np
+
+import os
+import math
+import itertools
+import contextlib
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+from .integrate import execute, execute_ensemble
+from .control import tolerance_vector
+from .design import apply_design
+
+from .config.general import TEMPERATURE
+
+# Network shared by all runs in this process (see initialize)
+network = None
+
+# Reaction library shared by all networks of an assembly sweep in this process (see initialize_library)
+library = None
+
+# Network and factors shared by all design points in this process (see initialize_design)
+design = None
+
+def run_seed(master_seed, index) -> np.random.SeedSequence:
+    """
+    Independent random stream for run number index (1, 2, ...).
+
+    Same as np.random.SeedSequence(master_seed).spawn(RUNS)[index - 1],
+    but does not depend on the total number of runs.
+    """
+    return np.random.SeedSequence(entropy=master_seed, spawn_key=(index - 1,))
+
+def initialize(deltaGf0, stoich_mats, ou_parameters, options) -> None:
+    """
+    Stores the network shared by all runs in this process.
+    Used as the initializer of every worker process.
+
+    options - keyword arguments for execute (e.g. default_timestep),
+              plus 'trajectory' (keep full time series, or only the end state)
+              and 'checkpoints' (directory for the checkpoints of single runs, see checkpoint_path).
+    """
+    global network
+    network = (deltaGf0, stoich_mats, ou_parameters, dict(options))
+
+def checkpoint_path(directory, index) -> str:
+    """ Checkpoint file of run number index (see execute). """
+    return os.path.join(directory, f'run_{index:0>2}.npz')
+
+class Spilled:
+    """
+    Time series spilled to disk by a worker process, sent to the main process
+    in place of its rows (see run_batch). load maps the file and removes it.
+    """
+
+    def __init__(self, array):
+        self.path = array.filename
+        self.shape = array.shape
+
+    def load(self) -> np.array:
+        array = np.memmap(self.path, dtype=np.double, mode='r', shape=self.shape)
+
+        # the mapping stays valid after the file is unlinked
+        os.remove(self.path)
+        return array
+
+def ship(sol) -> dict:
+    """ Replaces the spilled time series of sol (memory maps) by references to their files (see Spilled). """
+    return {data : Spilled(value) if isinstance(value, np.memmap) else value for data, value in sol.items()}
+
+def unship(sol) -> dict:
+    """ Maps the spilled time series referenced by ship. """
+    return {data : value.load() if isinstance(value, Spilled) else value for data, value in sol.items()}
+
+def end_state(sol) -> np.array:
+    """ Last recorded composition of a run (NaN for every metabolite if no row was recorded). """
+    composition = sol['composition']
+    return composition[-1] if len(composition) else np.full(composition.shape[1], np.nan)
+
+def trim(sol) -> dict:
+    """ Keeps only the last recorded row of every time series in sol. """
+    return {data : (sol[data] if data in ['log', 'stats'] else sol[data][-1:]) for data in sol}
+
+def run_batch(batch) -> list:
+    """
+    Runs a batch of simulations on the network set by initialize.
+
+    batch - list of (index, initialC, seed) tuples. Batches of more than one
+            run are advanced together with execute_ensemble.
+
+    Returns a list of (index, sol, success) tuples, in the order of batch.
+    """
+    deltaGf0, stoich_mats, ou_parameters, options = network
+    options = options.copy()
+    trajectory = options.pop('trajectory', True)
+    checkpoints = options.pop('checkpoints', None)
+
+    indices = [index for index, initialC, seed in batch]
+
+    if len(batch) == 1:
+        index, initialC, seed = batch[0]
+        if checkpoints is not None:
+            options['checkpoint'] = checkpoint_path(checkpoints, index)
+        sols, successes = zip(execute(initialC, deltaGf0, stoich_mats, ou_parameters, random_seed=seed, **options))
+    else:
+        initial_conditions = np.array([initialC for index, initialC, seed in batch])
+        seeds = [seed for index, initialC, seed in batch]
+        sols, successes = execute_ensemble(initial_conditions, deltaGf0, stoich_mats, ou_parameters, random_seeds=seeds, **options)
+
+    if not trajectory:
+        sols = [trim(sol) for sol in sols]
+    elif options.get('keep_spill'):
+        # spilled rows stay on disk instead of being pickled back to the main process (see run_all)
+        sols = [ship(sol) for sol in sols]
+
+    return [(index, sol, bool(success)) for index, sol, success in zip(indices, sols, successes)]
+
+def run_all(batches, deltaGf0, stoich_mats, ou_parameters, options, workers=1):
+    """
+    Generator: runs all batches and yields (index, sol, success) in the order of batches.
+
+    With workers > 1, batches are distributed over a process pool,
+    while results are still yielded in order - so that the caller
+    can act as the single writer of all output files. At most
+    2 * workers batches are in flight, so that few finished results
+    wait in memory for a slow one. Spilled time series are passed
+    on as files (see Spilled), not as rows.
+    """
+    if workers <= 1:
+        initialize(deltaGf0, stoich_mats, ou_parameters, options)
+        for batch in batches:
+            yield from run_batch(batch)
+        return
+
+    if options.get('spill') and options.get('trajectory', True):
+        options = dict(options, keep_spill=True)
+
+    batches = iter(batches)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initialize,
+                             initargs=(deltaGf0, stoich_mats, ou_parameters, options)) as executor:
+        running = collections.deque([executor.submit(run_batch, batch) for batch in itertools.islice(batches, 2 * workers)])
+
+        while running:
+            results = running.popleft().result()
+
+            for batch in itertools.islice(batches, 1):
+                running.append(executor.submit(run_batch, batch))
+
+            for index, sol, success in results:
+                yield index, unship(sol), success
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+# COMMUNITY-ASSEMBLY SWEEPS
+#
+# Many networks (subsets of the reactions of one library) are
+# simulated in one process pool. The library is compiled once and
+# sent to every worker; each task only names the columns (reactions)
+# of its network, which the worker cuts out of the library.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+def point_seed(master_seed, index, run) -> np.random.SeedSequence:
+    """ Independent random stream for run number run (1, 2, ...) of network or design point number index (1, 2, ...). """
+    return np.random.SeedSequence(entropy=master_seed, spawn_key=(index - 1, run - 1))
+
+def random_subsets(N, K, count, rng=None) -> list:
+    """
+    count distinct random K-subsets of range(N) (as sorted tuples, in the order drawn).
+    Duplicates are redrawn; if there are at most count K-subsets, returns all of them.
+    """
+    if count >= math.comb(N, K):
+        return list(itertools.combinations(range(N), K))
+
+    rng = np.random.default_rng(rng)
+    subsets = {}
+
+    # dict keys: distinct, in the order drawn
+    while len(subsets) < count:
+        subsets[tuple(np.sort(rng.choice(N, size=K, replace=False)).tolist())] = None
+
+    return list(subsets)
+
+def all_subsets(N, K) -> list:
+    """ All non-empty subsets of range(N) with at most K elements, by size. """
+    return [subset for k in range(1, K + 1) for subset in itertools.combinations(range(N), k)]
+
+def initialize_library(reaction_library, options) -> None:
+    """
+    Stores the library shared by all networks in this process.
+    Used as the initializer of every worker process.
+
+    options - keyword arguments for execute (e.g. default_timestep, solver).
+              A scalar 'atol' is expanded per network (see control.tolerance_vector).
+    """
+    global library
+    library = (reaction_library, dict(options), {})
+
+def run_subset(task) -> tuple:
+    """
+    Runs one simulation of a network cut out of the library set by initialize_library.
+
+    task - (index, columns, run, seed): network number, reaction columns, run number and seed.
+
+    Returns (index, run, success, end state, stats), where the end state has one
+    entry per metabolite of the library (NaN if not part of the network)
+    and stats is the statistics record of the run (see stats.py).
+    """
+    reaction_library, options, networks = library
+    index, columns, run, seed = task
+
+    # runs of the same network are usually handled by the same worker
+    if columns not in networks:
+        networks.clear()
+        networks[columns] = reaction_library.subnetwork(columns)
+
+    network = networks[columns]
+    options = options.copy()
+
+    if 'atol' in options:
+        options['atol'] = tolerance_vector(network.metabolites, options['atol'])
+
+    sol, success = execute(network.composition(), network.deltaGf0, network.stoich_mats, network.ou_parameters,
+                           random_seed=seed, record='end', **options)
+
+    composition = np.full(len(reaction_library.metabolites), np.nan)
+    composition[[reaction_library.metabolite_index[met] for met in network.metabolites]] = end_state(sol)
+
+    return index, run, bool(success), composition, sol['stats']
+
+def run_chunked(function, tasks, initializer, initargs, workers=1, chunksize=None, executor=None):
+    """
+    Generator: yields function(task) for all tasks, in order.
+
+    With workers > 1, tasks are distributed over a process pool in chunks
+    of chunksize tasks (by default, about four chunks per worker).
+    initializer(*initargs) sets up every process (including this one, in serial).
+    executor - pool of worker processes already set up by initializer(*initargs),
+               used instead of starting a new one (see run_sequential).
+    """
+    if executor is None and workers <= 1:
+        initializer(*initargs)
+        for task in tasks:
+            yield function(task)
+        return
+
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4 * workers))
+
+    if executor is not None:
+        yield from executor.map(function, tasks, chunksize=chunksize)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        yield from executor.map(function, tasks, chunksize=chunksize)
+
+def run_assembly(tasks, reaction_library, options, workers=1, chunksize=None):
+    """ Generator: runs all tasks (see run_subset) and yields their results in order (see run_chunked). """
+    yield from run_chunked(run_subset, tasks, initialize_library, (reaction_library, options), workers=workers, chunksize=chunksize)
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+# DESIGN SWEEPS
+#
+# One network, simulated at every point of a multi-dimensional
+# design (see design.py). Each task only carries the coordinates
+# of its point, from which the worker derives the inputs of execute.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - //
+
+def initialize_design(network, factors, options) -> None:
+    """
+    Stores the network and the design factors shared by all design points in this process.
+    Used as the initializer of every worker process.
+
+    options - keyword arguments for execute (e.g. default_timestep, solver).
+    """
+    global design
+    design = (network, list(factors), dict(options))
+
+def run_point(task) -> tuple:
+    """
+    Runs one simulation at a design point of the design set by initialize_design.
+
+    task - (index, coordinates, run, seed): point number, one value per factor, run number and seed.
+
+    Returns (index, run, success, end state, stats).
+    """
+    network, factors, options = design
+    index, coordinates, run, seed = task
+
+    options = options.copy()
+    initialC, ou_parameters, temperature = apply_design(network, factors, coordinates, options.pop('temperature', TEMPERATURE))
+
+    sol, success = execute(initialC, network.deltaGf0, network.stoich_mats, ou_parameters,
+                           random_seed=seed, record='end', temperature=temperature, **options)
+
+    return index, run, bool(success), end_state(sol), sol['stats']
+
+def run_design(tasks, network, factors, options, workers=1, chunksize=None, executor=None):
+    """ Generator: runs all tasks (see run_point) and yields their results in order (see run_chunked). """
+    yield from run_chunked(run_point, tasks, initialize_design, (network, factors, options),
+                           workers=workers, chunksize=chunksize, executor=executor)
+
+def run_sequential(coordinates, replicates, network, factors, options, master_seed, workers=1, chunksize=None):
+    """
+    Generator: runs replicates of every design point until the point converges
+    (see convergence.StoppingRule), and yields the results of all runs (see run_point).
+
+    replicates - one convergence.Replicates per point (updated with every run).
+
+    Runs are scheduled in rounds: every point first gets the minimum number of runs,
+    then every unconverged point another batch per round - so that the runs go to
+    the points that need them. Results are yielded in order within each round.
+    All rounds share one process pool.
+    """
+    pool = (ProcessPoolExecutor(max_workers=workers, initializer=initialize_design, initargs=(network, factors, options))
+            if workers > 1 else contextlib.nullcontext())
+
+    with pool as executor:
+        while True:
+            tasks = [(index, coordinates[index - 1], run, point_seed(master_seed, index, run))
+                     for index, point in enumerate(replicates, start=1)
+                     for run in range(point.runs + 1, point.runs + point.next_runs() + 1)]
+
+            if not tasks:
+                return
+
+            for index, run, success, end_state, run_stats in run_design(tasks, network, factors, options, workers=workers,
+                                                                        chunksize=chunksize, executor=executor):
+                replicates[index - 1].add(success, end_state)
+                yield index, run, success, end_state, run_stats
+
+            for index in sorted(set([index for index, point, run, seed in tasks])):
+                replicates[index - 1].check()